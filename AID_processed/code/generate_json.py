@@ -4,9 +4,15 @@ import os
 import re
 import json
 import random
+import sys
 from pathlib import Path
 from typing import List, Dict
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "dataset_processed" / "code"))
+from compact_dataset import CompactWriter, compact_path  # noqa: E402
+from dataset_splits import SEED as SPLIT_SEED, write_splits  # noqa: E402
+from image_scan import ImageScanner  # noqa: E402
+
 # ---- Expert prompt: exactly ONE <image> ----
 PROMPT = (
     "<image>\n"
@@ -28,6 +34,11 @@ if len(re.findall(r"<image>", PROMPT)) != 1:
 INDEX_JSON   = "/root/openset/dataset/AID_0909/aid_label_index.json"   # produced by process_rename.py
 OUTPUT_JSON  = "/root/openset/llama_factory/LLaMA-Factory/data/0909AID_dataset.jsonl"
 RANDOM_SEED  = 20250909  # set None for fully random order
+COMPACT_OUTPUT = False   # True: PROMPT/INPUT_TXT stored once in the header, written to *.compact.jsonl
+WRITE_SPLITS = False     # True: also write deterministic, label-stratified train/val/test shards (dataset_splits.py)
+SPLIT_DIR    = "/root/openset/llama_factory/LLaMA-Factory/data/0909AID_splits"
+VALIDATE_IMAGES = "header"   # None | "header" | "decode"; unreadable images are reported and dropped (image_scan.py)
+SCAN_CACHE   = os.path.join(os.path.dirname(INDEX_JSON), ".image_scan_cache.json")   # same file as process_rename.py; entries are per path (flat copies here, sources there)
 
 def load_index(index_path: str) -> List[Dict]:
     p = Path(index_path)
@@ -41,12 +52,16 @@ def load_index(index_path: str) -> List[Dict]:
     else:
         raise ValueError("Index JSON format must be a list or {'samples': [...]}")
 
-    # filter only records with existing image file
+    # filter only records with an existing (and readable) image file; stat/validation run in parallel
+    pairs = [(it.get("file", ""), it.get("label", "")) for it in samples]
+    scanner = ImageScanner(VALIDATE_IMAGES, SCAN_CACHE)
+    found = scanner.check_files([fp for fp, lb in pairs if fp and lb])
+    scanner.save_cache()
+    if scanner.bad:
+        print(f"[WARN] Dropped {len(scanner.bad)} unreadable images")
     kept = []
-    for it in samples:
-        fp = it.get("file", "")
-        lb = it.get("label", "")
-        if fp and lb and Path(fp).exists():
+    for fp, lb in pairs:
+        if fp and lb and fp in found:
             kept.append({"file": str(Path(fp).resolve()), "label": str(lb)})
     if not kept:
         raise RuntimeError("No valid (file, label) pairs found in index.")
@@ -82,6 +97,13 @@ def save_json(records: List[dict], out_json: str):
             f.write(json.dumps(rec, ensure_ascii=False) + "\n")
     print(f"[OK] Wrote {len(records)} samples to {out_json}")
 
+def save_compact_json(records: List[dict], out_json: str):
+    # every record shares PROMPT / INPUT_TXT (checked in build_records), so keep them in the header only
+    with CompactWriter(out_json, {"instruction": PROMPT, "input": INPUT_TXT}) as w:
+        for rec in records:
+            w.write({**rec, "instruction": w.ref("instruction"), "input": w.ref("input")})
+    print(f"[OK] Wrote {len(records)} compact samples to {out_json}")
+
 
 def main():
     print(f"[INFO] Loading index: {INDEX_JSON}")
@@ -101,7 +123,19 @@ def main():
         if tok_cnt != len(r["images"]):
             raise AssertionError(f"Post-shuffle <image>:images check failed at idx {i}")
 
-    save_json(records, OUTPUT_JSON)
+    out_path = compact_path(OUTPUT_JSON) if COMPACT_OUTPUT else OUTPUT_JSON
+    if COMPACT_OUTPUT:
+        save_compact_json(records, out_path)
+    else:
+        save_json(records, out_path)
+
+    if WRITE_SPLITS:
+        os.makedirs(SPLIT_DIR, exist_ok=True)
+        # 划分只取决于图像路径与 seed，与打乱顺序无关；RANDOM_SEED=None 时用 dataset_splits 的 SEED
+        seed = str(RANDOM_SEED) if RANDOM_SEED is not None else SPLIT_SEED
+        manifest = write_splits(out_path, SPLIT_DIR, seed=seed)
+        for name, info in manifest["splits"].items():
+            print(f"[OK] {name}: {info['records']} samples in {len(info['shards'])} shards -> {SPLIT_DIR}")
 
 if __name__ == "__main__":
     main()
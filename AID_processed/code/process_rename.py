@@ -2,19 +2,35 @@
 # -*- coding: utf-8 -*-
 import os
 import re
+import sys
 import json
 import shutil
 from pathlib import Path
-from typing import List
+from typing import Any, Dict, List
+
+# shared copy/link engine lives next to the second-stage scripts
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "dataset_processed" / "code"))
+from copy_engine import copy_many, format_stats, prune_stale  # noqa: E402
+from image_scan import ImageScanner  # noqa: E402
 
 # ---- I/O paths ----
 ORIGINAL_PATH = "/root/openset/dataset/AID"              # AID/<class_name>/*
 FLAT_DIR      = "/root/openset/dataset/AID_0909"     # single folder: dataset_0909/image_00001.jpg ...
 INDEX_JSON    = "/root/openset/dataset/AID_0909/aid_label_index.json"
 
+# ---- copy engine ----
+COPY_MODE     = "copy"      # "copy" | "hardlink" | "reflink" | "symlink"
+COPY_WORKERS  = 16
+RESUME        = True        # keep FLAT_DIR and only re-place changed files (False -> delete and recreate)
+COPY_MANIFEST = os.path.join(FLAT_DIR, ".copy_manifest.json")
+
 # Acceptable image extensions
 IMG_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
 
+# ---- image scan (image_scan.py) ----
+VALIDATE_IMAGES = "header"  # None | "header" | "decode"; corrupt / truncated / unsupported images are reported and skipped
+SCAN_CACHE    = os.path.join(FLAT_DIR, ".image_scan_cache.json")   # same file as generate_json.py; entries are per path (source images here)
+
 # Fixed category order -> numeric labels (1..30)
 CATEGORY_ORDER = [
     "BareLand","BaseballField","Beach","Bridge","Center","Church","Commercial",
@@ -26,19 +42,17 @@ CATEGORY_ORDER = [
 def natsort_key(s: str):
     return [int(t) if t.isdigit() else t.lower() for t in re.split(r"(\d+)", s)]
 
-def list_images(dir_path: Path) -> List[Path]:
-    files = [p for p in dir_path.iterdir() if p.is_file() and p.suffix.lower() in IMG_EXTS]
-    files.sort(key=lambda p: natsort_key(p.name))
-    return files
+def list_images(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return sorted(records, key=lambda r: natsort_key(os.path.basename(r["path"])))
 
 def main():
     src = Path(ORIGINAL_PATH)
     if not src.exists():
         raise FileNotFoundError(f"Original path not found: {ORIGINAL_PATH}")
 
-    # recreate flat dir
+    # recreate flat dir (or reuse it when resuming)
     flat = Path(FLAT_DIR)
-    if flat.exists():
+    if flat.exists() and not RESUME:
         print(f"[WARN] {FLAT_DIR} exists. Deleting and recreating ...")
         shutil.rmtree(flat)
     flat.mkdir(parents=True, exist_ok=True)
@@ -54,31 +68,50 @@ def main():
 
     print(f"[INFO] Found {len(mapping)}/{len(CATEGORY_ORDER)} class folders present.")
 
+    # list + validate all class folders at once (scandir threads, header checks in a process pool)
+    scanner = ImageScanner(VALIDATE_IMAGES, SCAN_CACHE, io_workers=COPY_WORKERS)
+    scanned = scanner.scan_dirs([str(src / c) for c in CATEGORY_ORDER if c in mapping], IMG_EXTS)
+    scanner.save_cache()
+    if scanner.bad:
+        print(f"[WARN] Skipped {len(scanner.bad)} unreadable images")
+
     # flatten with global running index; also build label index list
     global_idx = 0
     total_copied = 0
     index_list = []  # each: {"file": "<abs_path>", "label": "<1..30>"}
+    copy_jobs = []
 
     for cname in CATEGORY_ORDER:
         if cname not in mapping:
             continue
         label_id = mapping[cname]
-        imgs = list_images(src / cname)
+        imgs = list_images(scanned[str(src / cname)])
         print(f"[CLASS] {cname} -> {label_id} | {len(imgs)} files")
-        for img in imgs:
+        for rec in imgs:
+            img = Path(rec["path"])
             global_idx += 1
             new_name = f"image_{global_idx:05d}{img.suffix.lower()}"
             dst_path = flat / new_name
-            shutil.copy2(str(img), str(dst_path))
+            copy_jobs.append((str(img), str(dst_path)))
             index_list.append({
-                "file": str(dst_path.resolve()),
+                "file": str(flat.resolve() / new_name),   # not dst_path.resolve(): symlink mode would point back at src
                 "label": str(label_id),
                 "orig_class": cname,
-                "orig_name": img.name
+                "orig_name": img.name,
+                "width": rec["width"],
+                "height": rec["height"],
             })
             total_copied += 1
-            if total_copied % 500 == 0:
-                print(f"  copied {total_copied} files ...")
+
+    if RESUME:
+        removed = prune_stale(FLAT_DIR, {dst for _, dst in copy_jobs}, exts=IMG_EXTS)
+        if removed:
+            print(f"[INFO] Removed {removed} stale files from {FLAT_DIR}")
+    stats = copy_many(copy_jobs, mode=COPY_MODE, workers=COPY_WORKERS,
+                      manifest_path=COPY_MANIFEST if RESUME else None)
+    print(f"[COPY] {format_stats(stats)}")
+    if stats["errors"]:
+        raise RuntimeError(f"{len(stats['errors'])} files failed to copy, first: {stats['errors'][0]}")
 
     # write index json
     with open(INDEX_JSON, "w", encoding="utf-8") as f:
@@ -0,0 +1,472 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar annotation store: the merged "image + annotations" records of combine.py / rename.py held as
+NumPy columns instead of millions of Python dicts.
+
+- 图像表：id / width / height / 路径（UTF-8 字节 arena + offsets）/ 该图标注在标注表中的 (start, count)
+- 标注表：id / image_id / category_id / iscrowd / area / score / bbox(N,4) / RLE size(N,2) / flags，
+  RLE counts 存于一个字节 arena；不符合列类型的字段（score 为 null、polygon 分割、SAM 的其它键等）
+  以 JSON 文本存入 extra arena，整体无损
+- 同一标注表可被多个图像表共享：rename 只重排图像表并替换路径（take），不复制标注
+- 持久化：目录（每列一个 .npy，np.load(mmap_mode="r") 内存映射，meta.json 最后写入）或单个 .npz
+- ImageRecord / AnnRecord 是按行读取列的只读 Mapping 视图，process_json / visualize 的
+  item["annotations"][k].get("bbox") 等写法无需改动；数值按原类型（int / float）还原
+"""
+import json
+import os
+import shutil
+from array import array
+from collections.abc import Mapping, Sequence
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+STORE_FORMAT = "annstore"
+STORE_VERSION = 1
+STORE_SUFFIX = ".annstore"
+META_FILE = "meta.json"
+
+# ---- 标注 flags ----
+HAS_CATEGORY = 1 << 0
+HAS_ISCROWD = 1 << 1
+HAS_AREA = 1 << 2
+AREA_INT = 1 << 3
+HAS_SCORE = 1 << 4
+SCORE_INT = 1 << 5
+HAS_BBOX = 1 << 6
+BBOX_INT = 1 << 7
+HAS_SEG = 1 << 8
+
+_CORE_KEYS = ("id", "image_id", "category_id", "segmentation", "area", "bbox", "iscrowd", "score")
+
+IMAGE_COLUMNS = ("img_id", "width", "height", "path_off", "path_data", "ann_start", "ann_count")
+ANN_COLUMNS = ("id", "image_id", "category_id", "iscrowd", "area", "score", "bbox", "seg_size", "flags",
+               "counts_off", "counts_data", "extra_off", "extra_data")
+
+
+def is_store_path(path: str) -> bool:
+    return path.endswith((STORE_SUFFIX, ".npz"))
+
+
+def signature_file(path: str) -> str:
+    """File whose (size, mtime) identifies a saved store (for build stamps)."""
+    return os.path.join(path, META_FILE) if os.path.isdir(path) else path
+
+
+def _is_int(v: Any) -> bool:
+    return isinstance(v, int) and not isinstance(v, bool)
+
+
+def _is_num(v: Any) -> bool:
+    return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+
+def _num(v: float, is_int: bool) -> Any:
+    return int(v) if is_int else float(v)
+
+
+class StoreBuilder:
+    """
+    Append-only builder backed by typed arrays (no per-record Python objects).
+
+    Either add whole merged items (add_item), or COCO images and annotations in any order
+    (add_image / add_annotation); in the latter case annotations are grouped by image_id in finish(),
+    keeping their input order, exactly like combine.build_ann_index.
+    """
+
+    def __init__(self):
+        self.img_id = array("q")
+        self.width = array("q")
+        self.height = array("q")
+        self.path_off = array("q", [0])
+        self.path_data = bytearray()
+        self.ann_start = array("q")
+        self.ann_count = array("q")
+        self.grouped: Optional[bool] = None
+
+        self.id = array("q")
+        self.image_id = array("q")
+        self.category_id = array("q")
+        self.iscrowd = array("B")
+        self.area = array("d")
+        self.score = array("d")
+        self.bbox = array("d")
+        self.seg_size = array("i")
+        self.flags = array("H")
+        self.counts_off = array("q", [0])
+        self.counts_data = bytearray()
+        self.extra_off = array("q", [0])
+        self.extra_data = bytearray()
+
+    def _mode(self, grouped: bool) -> None:
+        if self.grouped is None:
+            self.grouped = grouped
+        elif self.grouped != grouped:
+            raise ValueError("Cannot mix add_item with add_image/add_annotation")
+
+    def _image(self, img_id: int, file_path: str, width: Any, height: Any) -> None:
+        self.img_id.append(int(img_id))
+        self.width.append(width if _is_int(width) else -1)
+        self.height.append(height if _is_int(height) else -1)
+        self.path_data += file_path.encode("utf-8")
+        self.path_off.append(len(self.path_data))
+
+    def add_image(self, img: Dict[str, Any], base_dir: str) -> None:
+        self._mode(False)
+        self._image(img["id"], os.path.join(base_dir, img["file_name"]), img.get("width"), img.get("height"))
+
+    def add_item(self, item: Dict[str, Any]) -> None:
+        self._mode(True)
+        self._image(item["id"], item["file_path"], item.get("width"), item.get("height"))
+        anns = item.get("annotations", [])
+        self.ann_start.append(len(self.id))
+        self.ann_count.append(len(anns))
+        for ann in anns:
+            self._annotation(ann)
+
+    def add_annotation(self, ann: Dict[str, Any]) -> None:
+        self._mode(False)
+        self._annotation(ann)
+
+    def _annotation(self, ann: Dict[str, Any]) -> None:
+        flags = 0
+        extra = {k: v for k, v in ann.items() if k not in _CORE_KEYS}
+        self.id.append(int(ann["id"]))
+        self.image_id.append(int(ann["image_id"]))
+
+        v = ann.get("category_id")
+        if _is_int(v):
+            flags |= HAS_CATEGORY
+        elif "category_id" in ann:
+            extra["category_id"] = v
+        self.category_id.append(v if flags & HAS_CATEGORY else -1)
+
+        v = ann.get("iscrowd")
+        if _is_int(v) and 0 <= v < 256:
+            flags |= HAS_ISCROWD
+            self.iscrowd.append(v)
+        else:
+            if "iscrowd" in ann:
+                extra["iscrowd"] = v
+            self.iscrowd.append(0)
+
+        for key, col, has, is_int in (("area", self.area, HAS_AREA, AREA_INT),
+                                      ("score", self.score, HAS_SCORE, SCORE_INT)):
+            v = ann.get(key)
+            if _is_num(v):
+                flags |= has | (is_int if _is_int(v) else 0)
+                col.append(v)
+            else:
+                if key in ann:
+                    extra[key] = v
+                col.append(np.nan)
+
+        v = ann.get("bbox")
+        if isinstance(v, list) and len(v) == 4 and (all(map(_is_int, v)) or all(isinstance(x, float) for x in v)):
+            flags |= HAS_BBOX | (BBOX_INT if _is_int(v[0]) else 0)
+            self.bbox.extend(v)
+        else:
+            if "bbox" in ann:
+                extra["bbox"] = v
+            self.bbox.extend((np.nan,) * 4)
+
+        v = ann.get("segmentation")
+        if (isinstance(v, dict) and v.keys() == {"size", "counts"}
+                and isinstance(v["counts"], str) and v["counts"].isascii()
+                and isinstance(v["size"], list) and len(v["size"]) == 2 and all(map(_is_int, v["size"]))):
+            flags |= HAS_SEG
+            self.seg_size.extend(v["size"])
+            self.counts_data += v["counts"].encode("ascii")
+        else:
+            if "segmentation" in ann:
+                extra["segmentation"] = v
+            self.seg_size.extend((0, 0))
+        self.counts_off.append(len(self.counts_data))
+
+        if extra:
+            self.extra_data += json.dumps(extra, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self.extra_off.append(len(self.extra_data))
+        self.flags.append(flags)
+
+    def finish(self) -> "AnnotationStore":
+        arr = {name: np.frombuffer(getattr(self, name), dtype=np.uint8) if name.endswith("_data")
+               else np.asarray(getattr(self, name)) for name in IMAGE_COLUMNS + ANN_COLUMNS
+               if name not in ("ann_start", "ann_count")}
+        arr["bbox"] = arr["bbox"].reshape(-1, 4)
+        arr["seg_size"] = arr["seg_size"].reshape(-1, 2)
+        if self.grouped:
+            arr["ann_start"] = np.asarray(self.ann_start, dtype=np.int64)
+            arr["ann_count"] = np.asarray(self.ann_count, dtype=np.int64)
+        else:
+            # 标注按 image_id 稳定排序，每张图对应一段连续区间
+            order = np.argsort(arr["image_id"], kind="stable")
+            for name in ("id", "image_id", "category_id", "iscrowd", "area", "score", "bbox", "seg_size", "flags"):
+                arr[name] = arr[name][order]
+            for prefix in ("counts", "extra"):
+                arr[f"{prefix}_off"], arr[f"{prefix}_data"] = _take_ragged(arr[f"{prefix}_off"], arr[f"{prefix}_data"], order)
+            lo = np.searchsorted(arr["image_id"], arr["img_id"], side="left")
+            hi = np.searchsorted(arr["image_id"], arr["img_id"], side="right")
+            arr["ann_start"], arr["ann_count"] = lo.astype(np.int64), (hi - lo).astype(np.int64)
+        return AnnotationStore(arr)
+
+
+def _take_ragged(off: np.ndarray, data: np.ndarray, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Gather rows of a (offsets, bytes) ragged column."""
+    lens = (off[1:] - off[:-1])[rows]
+    new_off = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(lens, out=new_off[1:])
+    idx = np.repeat(off[:-1][rows] - new_off[:-1], lens) + np.arange(new_off[-1], dtype=np.int64)
+    return new_off, np.asarray(data)[idx]
+
+
+class AnnRecord(Mapping):
+    """Read-only dict view of one annotation row."""
+    __slots__ = ("_s", "_i", "_f")
+
+    def __init__(self, store: "AnnotationStore", i: int):
+        self._s = store
+        self._i = i
+        self._f = int(store.flags[i])
+
+    def _extra(self) -> Dict[str, Any]:
+        a, b = self._s.extra_off[self._i], self._s.extra_off[self._i + 1]
+        return json.loads(self._s.extra_data[a:b].tobytes()) if b > a else {}
+
+    def _core_keys(self) -> List[str]:
+        f = self._f
+        keys = ["id", "image_id"]
+        keys += [k for k, bit in (("category_id", HAS_CATEGORY), ("segmentation", HAS_SEG), ("area", HAS_AREA),
+                                  ("bbox", HAS_BBOX), ("iscrowd", HAS_ISCROWD), ("score", HAS_SCORE)) if f & bit]
+        return keys
+
+    def __getitem__(self, key: str) -> Any:
+        s, i, f = self._s, self._i, self._f
+        if key == "id":
+            return int(s.id[i])
+        if key == "image_id":
+            return int(s.image_id[i])
+        if key == "category_id" and f & HAS_CATEGORY:
+            return int(s.category_id[i])
+        if key == "iscrowd" and f & HAS_ISCROWD:
+            return int(s.iscrowd[i])
+        if key == "area" and f & HAS_AREA:
+            return _num(s.area[i], f & AREA_INT)
+        if key == "score" and f & HAS_SCORE:
+            return _num(s.score[i], f & SCORE_INT)
+        if key == "bbox" and f & HAS_BBOX:
+            return [_num(v, f & BBOX_INT) for v in s.bbox[i].tolist()]
+        if key == "segmentation" and f & HAS_SEG:
+            a, b = s.counts_off[i], s.counts_off[i + 1]
+            return {"size": s.seg_size[i].tolist(), "counts": s.counts_data[a:b].tobytes().decode("ascii")}
+        return self._extra()[key]
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._core_keys() or key in self._extra()
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._core_keys() + list(self._extra()))
+
+    def __len__(self) -> int:
+        return len(self._core_keys()) + len(self._extra())
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {k: self[k] for k in self}
+
+
+class AnnList(Sequence):
+    """The annotations of one image (a contiguous row range of the annotation table)."""
+    __slots__ = ("_s", "_start", "_n")
+
+    def __init__(self, store: "AnnotationStore", start: int, n: int):
+        self._s = store
+        self._start = start
+        self._n = n
+
+    def __len__(self) -> int:
+        return self._n
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return [self[j] for j in range(*k.indices(self._n))]
+        if k < 0:
+            k += self._n
+        if not 0 <= k < self._n:
+            raise IndexError(k)
+        return AnnRecord(self._s, self._start + k)
+
+
+class ImageRecord(Mapping):
+    """Read-only view of one merged record: {"id", "file_path", "width", "height", "annotations"}."""
+    __slots__ = ("_s", "_j")
+    _KEYS = ("id", "file_path", "width", "height", "annotations")
+
+    def __init__(self, store: "AnnotationStore", j: int):
+        self._s = store
+        self._j = j
+
+    def __getitem__(self, key: str) -> Any:
+        s, j = self._s, self._j
+        if key == "id":
+            return int(s.img_id[j])
+        if key == "file_path":
+            return s.file_path(j)
+        if key in ("width", "height"):
+            v = int(getattr(s, key)[j])
+            return v if v >= 0 else None
+        if key == "annotations":
+            return AnnList(s, int(s.ann_start[j]), int(s.ann_count[j]))
+        raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._KEYS)
+
+    def __len__(self) -> int:
+        return len(self._KEYS)
+
+    def to_dict(self) -> Dict[str, Any]:
+        d = dict(self)
+        d["annotations"] = [a.to_dict() for a in d["annotations"]]
+        return d
+
+
+class AnnotationStore(Sequence):
+    """Sequence of ImageRecord over the column arrays (see module docstring)."""
+
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        missing = [c for c in IMAGE_COLUMNS + ANN_COLUMNS if c not in arrays]
+        if missing:
+            raise ValueError(f"Annotation store is missing columns: {missing}")
+        self.arrays = arrays
+        for name, a in arrays.items():
+            setattr(self, name, a)
+
+    # ---- build ----
+    @classmethod
+    def from_items(cls, items: Iterable[Dict[str, Any]]) -> "AnnotationStore":
+        b = StoreBuilder()
+        for it in items:
+            b.add_item(it)
+        return b.finish()
+
+    @classmethod
+    def from_coco(cls, path: str, base_dir: str) -> "AnnotationStore":
+        """Stream a COCO instance file straight into columns (combine.py's merge, without dicts)."""
+        from coco_stream import iter_coco_arrays
+        b = StoreBuilder()
+        for key, obj in iter_coco_arrays(path):
+            if key == "images":
+                b.add_image(obj, base_dir)
+            else:
+                b.add_annotation(obj)
+        return b.finish()
+
+    # ---- access ----
+    def __len__(self) -> int:
+        return len(self.img_id)
+
+    def __getitem__(self, j):
+        if isinstance(j, slice):
+            return [self[k] for k in range(*j.indices(len(self)))]
+        if j < 0:
+            j += len(self)
+        if not 0 <= j < len(self):
+            raise IndexError(j)
+        return ImageRecord(self, j)
+
+    @property
+    def num_annotations(self) -> int:
+        return int(self.ann_count.sum())
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in self.arrays.values())
+
+    def file_path(self, j: int) -> str:
+        return self.path_data[self.path_off[j]:self.path_off[j + 1]].tobytes().decode("utf-8")
+
+    def file_paths(self) -> List[str]:
+        data = self.path_data.tobytes().decode("utf-8")
+        if data.isascii():                      # 字节偏移即字符偏移
+            off = self.path_off.tolist()
+            return [data[off[j]:off[j + 1]] for j in range(len(self))]
+        return [self.file_path(j) for j in range(len(self))]
+
+    def take(self, rows: Iterable[int], file_paths: Optional[List[str]] = None) -> "AnnotationStore":
+        """New store with the given image rows (and optionally new paths); annotation columns are shared."""
+        rows = np.asarray(list(rows), dtype=np.int64)
+        arr = dict(self.arrays)
+        for name in ("img_id", "width", "height", "ann_start", "ann_count"):
+            arr[name] = np.asarray(self.arrays[name])[rows]
+        if file_paths is None:
+            arr["path_off"], arr["path_data"] = _take_ragged(np.asarray(self.path_off), self.path_data, rows)
+        else:
+            if len(file_paths) != len(rows):
+                raise ValueError("file_paths must match rows")
+            enc = [p.encode("utf-8") for p in file_paths]
+            arr["path_off"] = np.zeros(len(enc) + 1, dtype=np.int64)
+            np.cumsum([len(e) for e in enc], out=arr["path_off"][1:])
+            arr["path_data"] = np.frombuffer(b"".join(enc), dtype=np.uint8)
+        return AnnotationStore(arr)
+
+    # ---- persistence ----
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        meta = {"format": STORE_FORMAT, "version": STORE_VERSION,
+                "images": len(self), "annotations": int(len(self.id))}
+        if path.endswith(".npz"):
+            tmp = path + ".tmp.npz"
+            np.savez(tmp, meta=np.array(json.dumps(meta)), **self.arrays)
+            os.replace(tmp, path)
+            return
+        tmp = path + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for name, a in self.arrays.items():
+            np.save(os.path.join(tmp, f"{name}.npy"), np.ascontiguousarray(a))
+        with open(os.path.join(tmp, META_FILE), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "AnnotationStore":
+        """Directory stores are memory-mapped (mmap=True); .npz stores are read into memory."""
+        if path.endswith(".npz"):
+            with np.load(path) as z:
+                meta = json.loads(str(z["meta"]))
+                arrays = {k: z[k] for k in z.files if k != "meta"}
+        else:
+            with open(os.path.join(path, META_FILE), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r" if mmap else None)
+                      for name in IMAGE_COLUMNS + ANN_COLUMNS}
+        if meta.get("format") != STORE_FORMAT or meta.get("version") != STORE_VERSION:
+            raise ValueError(f"Unsupported annotation store {path}: {meta}")
+        return cls(arrays)
+
+
+def load_records(path: str) -> Any:
+    """Merged records from a store (ImageRecord views) or a JSON / JSONL file (dicts)."""
+    if is_store_path(path):
+        return AnnotationStore.load(path)
+    import fast_json
+    if path.endswith(".jsonl"):
+        return list(fast_json.iter_jsonl(path))
+    return fast_json.load(path)
+
+
+# -------------------- conversion entry point --------------------
+INPUT_JSON = "/root/openset/dataset_processed/output_json/output_images_annotations.json"   # merged JSON / JSONL
+OUTPUT_STORE = "/root/openset/dataset_processed/output_json/output_images_annotations.annstore"
+
+
+def main():
+    items = load_records(INPUT_JSON)
+    store = AnnotationStore.from_items(items)
+    store.save(OUTPUT_STORE)
+    print(f"[OK] {len(store)} images, {store.num_annotations} annotations, "
+          f"{store.nbytes / 1e6:.1f} MB of columns -> {OUTPUT_STORE}")
+
+
+if __name__ == "__main__":
+    main()
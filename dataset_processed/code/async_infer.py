@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Asyncio inference driver: stream Alpaca JSONL rows (process_json / generate_test_json / AID generate_json output,
+plain or compact) to an OpenAI-compatible chat endpoint (vLLM `serve`, mock_openai_server.py, ...), stdlib only.
+
+- 请求：instruction + "\\n" + input（与 LLaMA-Factory alpaca 拼接一致），每个 <image> 处插入 images 中对应的图像
+  （image_shards 重写过的数据集改用 image_refs 中的预处理像素，以 PNG 内嵌）
+  （IMAGE_MODE="data_url" 内嵌 base64；"file_url" 只传 file:// 路径，需服务端允许本地路径；"none" 不传图像）
+- 并发：自适应在途窗口（AIMD）——连续成功且近期 p50 延迟低于 TARGET_LATENCY_S 时窗口 +1，
+  最近 OUTCOME_WINDOW 个结果中过载信号（429 / 超时 / 连接错误）的比例达到 CONGESTION_RATE 时减半，
+  一个近期 p50 延迟内最多减半一次（零星的 429 只靠重试处理，不缩窗口）；范围 [MIN_CONCURRENCY, MAX_CONCURRENCY]。
+  chat 接口一次只接收一个会话，批处理由服务端（vLLM 连续批处理）完成，客户端通过在途窗口决定批的大小
+- 重试：连接错误 / 超时 / 429 / 5xx 指数退避 + 抖动，优先使用 Retry-After；超过 MAX_RETRIES 记录 error
+- 输出：与 vllm_infer 相同的 {"prompt", "predict", "label"}，另含 "images" 与行号 "row"，完成即追加写入；
+  重跑时跳过已成功的行（断点续跑），ORDERED_OUTPUT=True 时结束后按 row 重写为输入顺序
+  （每行一条，可按行与数据集对齐；visualize_final_test_image / evaluate_predictions 可直接读取）
+- 缓存：USE_CACHE=True 时请求前按 (图像内容哈希, 完整提示哈希, 模型 ID + 生成参数) 查 prediction_cache，
+  命中直接写出不发请求（"cached": true），成功的回答写回缓存；失败行不缓存；同一 (图像, 提示) 已在途时等待其结果
+"""
+import asyncio
+import base64
+import io
+import mimetypes
+import os
+import random
+import ssl
+import time
+from array import array
+from collections import deque
+from typing import Any, Deque, Dict, Iterator, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+import numpy as np
+
+import fast_json
+from compact_dataset import iter_alpaca_rows
+from image_shards import REFS_FIELD, load_ref, parse_ref, row_images
+from prediction_cache import PredictionCache, format_stats
+
+# -------------------- Hard-coded paths --------------------
+INPUT_JSONL = "/root/openset/llama_factory/LLaMA-Factory/data/test_rm_dataset.jsonl"
+OUTPUT_JSONL = "/root/openset/llama_factory/LLaMA-Factory/outputs/async_infer/generated_predictions.jsonl"
+
+# -------------------- Endpoint --------------------
+BASE_URL = "http://127.0.0.1:8000/v1"
+MODEL = "Qwen/Qwen2.5-VL-7B-Instruct"
+API_KEY = os.environ.get("OPENAI_API_KEY", "EMPTY")
+MAX_TOKENS = 512
+TEMPERATURE = 0.0
+IMAGE_MODE = "data_url"       # "data_url" | "file_url" | "none"
+
+# -------------------- Concurrency / retries --------------------
+CONCURRENCY = 16              # 初始在途窗口
+MIN_CONCURRENCY = 1
+MAX_CONCURRENCY = 128
+TARGET_LATENCY_S = 30.0       # 近期 p50 延迟低于该值时才扩大窗口
+LATENCY_WINDOW = 64           # 计算近期 p50 的样本数
+OUTCOME_WINDOW = 128          # 计算近期过载比例的结果数
+CONGESTION_RATE = 0.05        # 近期过载比例达到该值才减半窗口
+REQUEST_TIMEOUT_S = 300.0
+MAX_RETRIES = 5
+BACKOFF_BASE_S = 0.5
+BACKOFF_MAX_S = 30.0
+LIMIT: Optional[int] = None   # 只处理前 N 行（调试 / 基准）
+
+RESUME = True
+ORDERED_OUTPUT = True
+FLUSH_EVERY = 64              # 每写入 N 行 flush 一次
+USE_CACHE = True
+CACHE_PATH = "/root/openset/cache/prediction_cache.sqlite"
+
+_RETRYABLE = {408, 409, 429, 500, 502, 503, 504}
+_OVERLOAD = {408, 429}
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, body: bytes, retry_after: Optional[float] = None):
+        super().__init__(f"HTTP {status}: {body[:200]!r}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+# -------------------- Minimal keep-alive HTTP/1.1 client --------------------
+class HTTPClient:
+    """POST JSON over a pool of keep-alive connections to one host (http / https)."""
+
+    def __init__(self, base_url: str, headers: Dict[str, str]):
+        u = urlsplit(base_url)
+        self.host = u.hostname or "127.0.0.1"
+        self.port = u.port or (443 if u.scheme == "https" else 80)
+        self.ssl = ssl.create_default_context() if u.scheme == "https" else None
+        self.prefix = u.path.rstrip("/")
+        self.headers = headers
+        self._idle: List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+
+    async def close(self) -> None:
+        for _, w in self._idle:
+            w.close()
+        self._idle = []
+
+    async def _request(self, conn, path: str, body: bytes) -> Tuple[int, Dict[str, str], bytes]:
+        reader, writer = conn
+        head = [f"POST {self.prefix}{path} HTTP/1.1", f"Host: {self.host}:{self.port}",
+                "Content-Type: application/json", f"Content-Length: {len(body)}", "Connection: keep-alive"]
+        head += [f"{k}: {v}" for k, v in self.headers.items()]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError("connection closed by server")
+        status = int(status_line.split()[1])
+        headers: Dict[str, str] = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            k, _, v = line.decode("latin-1").partition(":")
+            headers[k.strip().lower()] = v.strip()
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            parts = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                parts.append(await reader.readexactly(size))
+                await reader.readline()
+            data = b"".join(parts)
+        else:
+            data = await reader.readexactly(int(headers.get("content-length", 0) or 0))
+        return status, headers, data
+
+    async def post(self, path: str, body: bytes, timeout: float) -> Tuple[int, Dict[str, str], bytes]:
+        conn = self._idle.pop() if self._idle else None
+        if conn is None or conn[1].is_closing():
+            conn = await asyncio.wait_for(asyncio.open_connection(self.host, self.port, ssl=self.ssl), timeout)
+        try:
+            status, headers, data = await asyncio.wait_for(self._request(conn, path, body), timeout)
+        except BaseException:
+            conn[1].close()
+            raise
+        if headers.get("connection", "").lower() == "close":
+            conn[1].close()
+        else:
+            self._idle.append(conn)
+        return status, headers, data
+
+
+# -------------------- Adaptive in-flight window --------------------
+class AdaptiveLimiter:
+    """AIMD window on the number of requests in flight."""
+
+    def __init__(self, start: int = CONCURRENCY, low: int = MIN_CONCURRENCY, high: int = MAX_CONCURRENCY):
+        self.window = max(low, min(high, start))
+        self.low = low
+        self.high = high
+        self.inflight = 0
+        self.peak = self.window
+        self._ok_streak = 0
+        self._recent: List[float] = []
+        self._outcomes: Deque[bool] = deque(maxlen=OUTCOME_WINDOW)    # True = 过载信号
+        self._congested = 0
+        self._last_cut = 0.0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self) -> None:
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.inflight < self.window)
+            self.inflight += 1
+
+    async def release(self) -> None:
+        async with self._cond:
+            self.inflight -= 1
+            self._cond.notify_all()
+
+    def _record(self, congested: bool) -> float:
+        """Add one outcome; returns the congestion rate over the recent outcomes (at least one window's worth)."""
+        if len(self._outcomes) == self._outcomes.maxlen:
+            self._congested -= self._outcomes[0]
+        self._outcomes.append(congested)
+        self._congested += congested
+        return self._congested / max(len(self._outcomes), min(self.window, OUTCOME_WINDOW))
+
+    def on_success(self, latency: float) -> None:
+        self._record(False)
+        self._recent.append(latency)
+        if len(self._recent) > LATENCY_WINDOW:
+            self._recent.pop(0)
+        self._ok_streak += 1
+        # 每个窗口的成功请求后加 1（加性增）
+        if self._ok_streak >= self.window and self.window < self.high:
+            if float(np.median(self._recent)) < TARGET_LATENCY_S:
+                self.window += 1
+                self.peak = max(self.peak, self.window)
+            self._ok_streak = 0
+
+    def on_congestion(self) -> None:
+        if self._record(True) < CONGESTION_RATE:
+            return                                          # 零星过载：交给重试，不缩窗口
+        now = time.monotonic()
+        if now - self._last_cut < (float(np.median(self._recent)) if self._recent else 0.0):
+            return                                          # 同一批在途请求的多个失败只算一次
+        self.window = max(self.low, self.window // 2)       # 乘性减
+        self._ok_streak = 0
+        self._last_cut = now
+
+
+# -------------------- Request building --------------------
+def _image_part(path: str) -> Dict[str, Any]:
+    if parse_ref(path) is not None:             # image_shards 引用：已预处理的像素编码为 PNG 内嵌（服务端读不到分片）
+        buf = io.BytesIO()
+        load_ref(path)[0].save(buf, format="PNG", compress_level=1)
+        data = base64.b64encode(buf.getvalue()).decode("ascii")
+        return {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{data}"}}
+    if IMAGE_MODE == "file_url":
+        return {"type": "image_url", "image_url": {"url": "file://" + os.path.abspath(path)}}
+    mime = mimetypes.guess_type(path)[0] or "image/png"
+    with open(path, "rb") as f:
+        data = base64.b64encode(f.read()).decode("ascii")
+    return {"type": "image_url", "image_url": {"url": f"data:{mime};base64,{data}"}}
+
+
+def build_prompt(row: Dict[str, Any]) -> str:
+    inst, inp = row.get("instruction", ""), row.get("input", "")
+    return f"{inst}\n{inp}" if inp else inst
+
+
+def build_messages(prompt: str, images: List[str]) -> List[Dict[str, Any]]:
+    """Text split at each <image>; the i-th placeholder becomes images[i] (missing placeholders: images first)."""
+    if IMAGE_MODE == "none" or not images:
+        return [{"role": "user", "content": prompt.replace("<image>", "")}]
+    pieces = prompt.split("<image>")
+    content: List[Dict[str, Any]] = []
+    extra = images[len(pieces) - 1:]
+    content.extend(_image_part(p) for p in extra)
+    for i, text in enumerate(pieces):
+        if text.strip():
+            content.append({"type": "text", "text": text})
+        if i < len(pieces) - 1 and i < len(images):
+            content.append(_image_part(images[i]))
+    return [{"role": "user", "content": content}]
+
+
+# -------------------- Resumable output --------------------
+def _truncate_partial_line(path: str) -> None:
+    """Drop a half-written last line left by an interrupted run."""
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        pos = size
+        while pos > 0:
+            step = min(1 << 16, pos)
+            f.seek(pos - step)
+            chunk = f.read(step)
+            i = chunk.rfind(b"\n")
+            if i >= 0:
+                f.truncate(pos - step + i + 1)
+                return
+            pos -= step
+        f.truncate(0)
+
+
+def _scan_output(path: str) -> Iterator[Tuple[int, int, bool]]:
+    """(row, byte offset, ok) for every line of an output file."""
+    offset = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if line.strip():
+                try:
+                    r = fast_json.loads(line)
+                    yield int(r["row"]), offset, not r.get("error")
+                except (ValueError, KeyError, TypeError):
+                    pass
+            offset += len(line)
+
+
+def load_done(path: str) -> Set[int]:
+    if not os.path.exists(path):
+        return set()
+    _truncate_partial_line(path)
+    return {row for row, _, ok in _scan_output(path) if ok}
+
+
+def rewrite_ordered(path: str) -> int:
+    """Rewrite in row order, one line per row: the last successful attempt, else the last failed one."""
+    rows, offs, oks = array("q"), array("q"), array("b")
+    for row, off, ok in _scan_output(path):
+        rows.append(row)
+        offs.append(off)
+        oks.append(ok)
+    r = np.frombuffer(rows, dtype=np.int64)
+    o = np.frombuffer(offs, dtype=np.int64)
+    k = np.frombuffer(oks, dtype=np.int8)
+    order = np.lexsort((np.arange(len(r)), k, r))          # 同一 row 内：失败在前、成功在后，再按写入顺序
+    last = np.r_[r[order][1:] != r[order][:-1], True] if len(r) else np.zeros(0, dtype=bool)
+    pick = o[order][last]
+    tmp = path + ".tmp"
+    with open(path, "rb") as src, open(tmp, "wb") as dst:
+        for off in pick.tolist():
+            src.seek(off)
+            dst.write(src.readline())
+    os.replace(tmp, path)
+    return len(pick)
+
+
+# -------------------- Driver --------------------
+class InferenceRun:
+    def __init__(self, input_path: str = INPUT_JSONL, output_path: str = OUTPUT_JSONL, base_url: str = BASE_URL,
+                 model: str = MODEL, concurrency: int = CONCURRENCY, limit: Optional[int] = LIMIT,
+                 cache_path: Optional[str] = None):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.base_url = base_url
+        self.model = model
+        self.concurrency = concurrency
+        self.limit = limit
+        self.cache_path = cache_path if cache_path is not None else (CACHE_PATH if USE_CACHE else None)
+        self.cache: Optional[PredictionCache] = None
+        self.inflight: Dict[Tuple[Tuple[str, ...], str], asyncio.Future] = {}
+        self.cache_model = f"{model}|max_tokens={MAX_TOKENS}|temperature={TEMPERATURE}|images={IMAGE_MODE}"
+        self.latencies = array("d")
+        self.stats = {"submitted": 0, "ok": 0, "failed": 0, "retries": 0, "skipped": 0, "cached": 0,
+                      "completion_tokens": 0}
+
+    async def _call(self, client: HTTPClient, limiter: AdaptiveLimiter, idx: int, row: Dict[str, Any], out) -> None:
+        images = row_images(row)
+        prompt = build_prompt(row)
+        rec: Dict[str, Any] = {"prompt": prompt, "predict": "", "label": row.get("output", ""),
+                               "images": list(row.get("images") or []), "row": idx}
+        if row.get(REFS_FIELD):
+            rec[REFS_FIELD] = images
+        try:
+            cached = None
+            key = (tuple(images), prompt)
+            if self.cache is not None:
+                cached = await asyncio.to_thread(self.cache.lookup, images, prompt, self.cache_model)
+                if cached is None and key in self.inflight:      # 相同请求在途：等它的结果（失败时再自己请求）
+                    cached = await self.inflight[key]
+            if cached is not None:
+                rec["predict"] = cached
+                rec["cached"] = True
+                self.stats["cached"] += 1
+            elif self.cache is None:
+                await self._request(client, limiter, rec, prompt, images)
+            else:
+                waiter = self.inflight.setdefault(key, asyncio.get_running_loop().create_future())
+                try:
+                    await self._request(client, limiter, rec, prompt, images)
+                    if not rec.get("error"):
+                        await asyncio.to_thread(self.cache.store, images, prompt, self.cache_model, rec["predict"])
+                finally:
+                    if self.inflight.get(key) is waiter:
+                        del self.inflight[key]
+                        waiter.set_result(None if rec.get("error") else rec["predict"])
+        except OSError as e:          # 图像读取失败
+            rec["error"] = f"{type(e).__name__}: {e}"
+        finally:
+            await limiter.release()
+        self.stats["failed" if rec.get("error") else "ok"] += 1
+        out.write(fast_json.dumps(rec) + b"\n")
+        if (self.stats["ok"] + self.stats["failed"]) % FLUSH_EVERY == 0:
+            out.flush()
+
+    async def _request(self, client: HTTPClient, limiter: AdaptiveLimiter, rec: Dict[str, Any], prompt: str,
+                       images: List[str]) -> None:
+        messages = await asyncio.to_thread(build_messages, prompt, images)    # 读图 + base64 不阻塞事件循环
+        body = fast_json.dumps({"model": self.model, "messages": messages,
+                                "max_tokens": MAX_TOKENS, "temperature": TEMPERATURE})
+        for attempt in range(MAX_RETRIES + 1):
+            t0 = time.perf_counter()
+            delay = None
+            try:
+                status, headers, data = await client.post("/chat/completions", body, REQUEST_TIMEOUT_S)
+                if status != 200:
+                    ra = headers.get("retry-after")
+                    raise HTTPError(status, data, float(ra) if ra and ra.replace(".", "", 1).isdigit() else None)
+                resp = fast_json.loads(data)
+                rec["predict"] = resp["choices"][0]["message"].get("content") or ""
+                rec.pop("error", None)
+                self.stats["completion_tokens"] += int((resp.get("usage") or {}).get("completion_tokens") or 0)
+                latency = time.perf_counter() - t0
+                self.latencies.append(latency)
+                limiter.on_success(latency)
+                break
+            except HTTPError as e:
+                rec["error"] = str(e)
+                if e.status not in _RETRYABLE:
+                    break
+                delay = e.retry_after
+                if e.status in _OVERLOAD:
+                    limiter.on_congestion()
+            except (asyncio.TimeoutError, ConnectionError, OSError, asyncio.IncompleteReadError) as e:
+                rec["error"] = f"{type(e).__name__}: {e}"
+                limiter.on_congestion()
+            except (ValueError, KeyError, IndexError, TypeError) as e:
+                rec["error"] = f"bad response: {type(e).__name__}: {e}"
+                break
+            if attempt == MAX_RETRIES:
+                break
+            self.stats["retries"] += 1
+            backoff = min(BACKOFF_MAX_S, BACKOFF_BASE_S * 2 ** attempt) * random.uniform(0.5, 1.0)
+            await asyncio.sleep(max(backoff, delay or 0.0))
+
+    async def run(self) -> Dict[str, Any]:
+        os.makedirs(os.path.dirname(self.output_path) or ".", exist_ok=True)
+        done = load_done(self.output_path) if RESUME else set()
+        if done:
+            print(f"[INFO] Resuming: {len(done)} rows already done in {self.output_path}")
+        client = HTTPClient(self.base_url, {"Authorization": f"Bearer {API_KEY}"})
+        if self.cache_path:
+            self.cache = PredictionCache(self.cache_path)
+        limiter = AdaptiveLimiter(self.concurrency)
+        tasks: Set[asyncio.Task] = set()
+        t0 = time.perf_counter()
+        with open(self.output_path, "ab" if RESUME else "wb") as out:
+            try:
+                for idx, row in enumerate(iter_alpaca_rows(self.input_path)):
+                    if self.limit is not None and idx >= self.limit:
+                        break
+                    if idx in done:
+                        self.stats["skipped"] += 1
+                        continue
+                    await limiter.acquire()
+                    task = asyncio.create_task(self._call(client, limiter, idx, row, out))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                    self.stats["submitted"] += 1
+                if tasks:
+                    await asyncio.gather(*tasks)
+            finally:
+                await client.close()
+                if self.cache is not None:
+                    print(f"[INFO] Prediction cache: {format_stats(self.cache.stats())}")
+                    self.cache.close()
+        elapsed = time.perf_counter() - t0
+        if ORDERED_OUTPUT and (self.stats["submitted"] or done):
+            rewrite_ordered(self.output_path)
+        return self.summary(elapsed, limiter)
+
+    def summary(self, elapsed: float, limiter: AdaptiveLimiter) -> Dict[str, Any]:
+        lat = np.frombuffer(self.latencies, dtype=np.float64)
+        pct = {f"p{q}": round(float(np.percentile(lat, q)), 4) if len(lat) else None for q in (50, 90, 95, 99)}
+        return {**self.stats, "elapsed_s": round(elapsed, 3),
+                "rows_per_s": round(self.stats["ok"] / elapsed, 2) if elapsed > 0 else None,
+                "latency_s": {**pct, "max": round(float(lat.max()), 4) if len(lat) else None},
+                "window_final": limiter.window, "window_peak": limiter.peak}
+
+
+def format_summary(s: Dict[str, Any]) -> str:
+    lat = s["latency_s"]
+    return (f"ok {s['ok']} | failed {s['failed']} | retries {s['retries']} | skipped {s['skipped']} | "
+            f"cached {s['cached']} | "
+            f"{s['elapsed_s']:.1f}s, {s['rows_per_s']} rows/s | latency p50 {lat['p50']} p95 {lat['p95']} "
+            f"p99 {lat['p99']} max {lat['max']} | window {s['window_final']} (peak {s['window_peak']})")
+
+
+def main():
+    summary = asyncio.run(InferenceRun().run())
+    print(f"[TIME] {format_summary(summary)}")
+    print(f"[SAVE] Predictions: {OUTPUT_JSONL}")
+
+
+if __name__ == "__main__":
+    main()
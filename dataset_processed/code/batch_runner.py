@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shared JSONL batch driver for the rendering scripts (visualize_final_test_image / visualize_dino_batch).
+
+- iter_chunks：单次顺序读取 JSONL，按 chunk_size 行打包，附带已读字节数（用于进度）
+- run_chunks：进程池按输入顺序返回各块结果，最多 2*workers 块在途；workers<=1 时串行
+- Progress：每 every_s 秒打印一次 记录数 / 百分比 / 速率 / ETA
+- safe_filename：去掉输出文件名中的路径分隔符与非法字符（记录 id 等外部字符串拼进输出名前使用）
+"""
+import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Deque, Dict, Iterator, List, Tuple
+
+Chunk = List[Tuple[int, str]]
+
+_UNSAFE_FILENAME = re.compile(r'[\\/:*?"<>|\x00-\x1f]+')
+
+
+def safe_filename(name: str) -> str:
+    """name with path separators / characters invalid in file names replaced by '_'."""
+    return _UNSAFE_FILENAME.sub("_", name).strip(" .") or "_"
+
+
+def iter_chunks(path: str, chunk_size: int) -> Iterator[Tuple[Chunk, int]]:
+    """Single pass over the JSONL: yields (chunk of (line_no, line), byte offset after the chunk)."""
+    chunk: Chunk = []
+    offset = 0
+    with open(path, "rb") as f:
+        for line_no, line in enumerate(f, 1):
+            offset += len(line)
+            raw_line = line.decode("utf-8", errors="replace").strip()
+            if not raw_line:
+                continue
+            chunk.append((line_no, raw_line))
+            if len(chunk) >= chunk_size:
+                yield chunk, offset
+                chunk = []
+    if chunk:
+        yield chunk, offset
+
+
+def run_chunks(
+    fn: Callable[..., List[Dict[str, Any]]], chunks: Iterator[Tuple[Chunk, int]], workers: int, *args: Any
+) -> Iterator[Tuple[List[Dict[str, Any]], int]]:
+    """Yields (fn(chunk, *args), byte offset) in input order, keeping at most 2*workers chunks in flight."""
+    if workers <= 1:
+        for chunk, offset in chunks:
+            yield fn(chunk, *args), offset
+        return
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        pending: Deque = deque()
+        for chunk, offset in chunks:
+            pending.append((ex.submit(fn, chunk, *args), offset))
+            if len(pending) >= 2 * workers:
+                fut, off = pending.popleft()
+                yield fut.result(), off
+        while pending:
+            fut, off = pending.popleft()
+            yield fut.result(), off
+
+
+class Progress:
+    def __init__(self, total_bytes: int, every_s: float):
+        self.total_bytes = max(1, total_bytes)
+        self.every_s = every_s
+        self.t0 = self.last_report = time.perf_counter()
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.t0
+
+    def update(self, records: int, offset: int) -> None:
+        now = time.perf_counter()
+        if now - self.last_report < self.every_s:
+            return
+        self.last_report = now
+        frac = offset / self.total_bytes
+        rate = records / (now - self.t0)
+        eta = (now - self.t0) * (1 - frac) / frac if frac > 0 else 0.0
+        print(f"Processing {records} records | {frac * 100:.1f}% | {rate:.1f} rec/s | ETA {eta:.0f}s", flush=True)
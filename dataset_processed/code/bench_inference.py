@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark async_infer.py against mock_openai_server.py on a CPU-only machine: throughput and tail latency
+for several initial windows, with and without injected failures. Rows are generate_test_json.py prompts over
+small generated images; every output must be parseable by prediction_parser and be in input order.
+A final cold / warm pair measures the prediction cache (the warm run must not send any request).
+"""
+import asyncio
+import os
+import shutil
+import tempfile
+from typing import Any, Dict, List, Optional
+
+from PIL import Image
+
+import async_infer
+import fast_json
+import mock_openai_server
+from generate_test_json import build_instruction
+from prediction_parser import parse_raw_prediction
+
+NUM_ROWS = 2000
+NUM_IMAGES = 16               # 行之间循环使用的小图数量
+LATENCY_MS = 50.0
+JITTER_SIGMA = 0.6
+SLOTS = 64
+WINDOWS = [4, 16, 64]         # 初始在途窗口
+FAIL_RATE = 0.02              # 最后一轮注入的 503 比例（另有同样比例的 429）
+
+
+def make_rows(tmp: str) -> str:
+    paths = []
+    for i in range(NUM_IMAGES):
+        p = os.path.join(tmp, f"tile_{i:03d}.png")
+        Image.new("RGB", (64, 64), (i * 15 % 256, 90, 160)).save(p)
+        paths.append(p)
+    rows: List[Dict[str, Any]] = []
+    for i in range(NUM_ROWS):
+        p = paths[i % NUM_IMAGES]
+        rows.append({"instruction": build_instruction(p), "input": f"The image path is: {p}", "output": "",
+                     "images": [p]})
+    path = os.path.join(tmp, "rows.jsonl")
+    fast_json.write_jsonl(rows, path)
+    return path
+
+
+def check_output(path: str) -> bool:
+    rows = list(fast_json.iter_jsonl(path))
+    in_order = [r["row"] for r in rows] == list(range(NUM_ROWS))
+    parsed = all(parse_raw_prediction(r["predict"])[1] for r in rows if not r.get("error"))
+    return in_order and parsed
+
+
+def run_once(input_path: str, out_path: str, base_url: str, window: int,
+             cache_path: Optional[str] = None) -> Dict[str, Any]:
+    if os.path.exists(out_path):
+        os.remove(out_path)
+    run = async_infer.InferenceRun(input_path, out_path, base_url, mock_openai_server.MODEL, window,
+                                   cache_path=cache_path)
+    return asyncio.run(run.run())
+
+
+def main():
+    tmp = tempfile.mkdtemp(prefix="bench_infer_")
+    async_infer.BACKOFF_BASE_S = 0.05
+    async_infer.FLUSH_EVERY = 256
+    async_infer.USE_CACHE = False
+    try:
+        input_path = make_rows(tmp)
+        out_path = os.path.join(tmp, "preds.jsonl")
+        failed = False
+        configs = [(w, 0.0) for w in WINDOWS] + [(WINDOWS[-1], FAIL_RATE)]
+        for window, fail_rate in configs:
+            server, thread = mock_openai_server.start_in_thread(
+                port=0, latency_ms=LATENCY_MS, jitter_sigma=JITTER_SIGMA, slots=SLOTS,
+                fail_rate=fail_rate, rate_limit_rate=fail_rate)
+            mock_openai_server.RETRY_AFTER_S = 0
+            try:
+                summary = run_once(input_path, out_path, f"http://{server.host}:{server.port}/v1", window)
+            finally:
+                mock_openai_server.stop_thread(server, thread)
+            ok = check_output(out_path)
+            failed |= not ok
+            print(f"[BENCH] window {window:>3} fail {fail_rate:.2f} | {async_infer.format_summary(summary)} | "
+                  f"output {'OK' if ok else 'MISMATCH'}")
+        server, thread = mock_openai_server.start_in_thread(
+            port=0, latency_ms=LATENCY_MS, jitter_sigma=JITTER_SIGMA, slots=SLOTS)
+        cache_path = os.path.join(tmp, "cache.sqlite")
+        try:
+            for label in ("cold", "warm"):
+                before = server.stats["requests"]
+                summary = run_once(input_path, out_path, f"http://{server.host}:{server.port}/v1", WINDOWS[-1],
+                                   cache_path=cache_path)
+                sent = server.stats["requests"] - before
+                ok = check_output(out_path) and (label == "cold" or sent == 0)
+                failed |= not ok
+                print(f"[BENCH] cache {label} | {async_infer.format_summary(summary)} | requests {sent} | "
+                      f"output {'OK' if ok else 'MISMATCH'}")
+        finally:
+            mock_openai_server.stop_thread(server, thread)
+        if failed:
+            raise SystemExit(1)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark the fast_json backends (orjson / msgspec / stdlib json) on the pipeline's JSON shapes:
+COCO load, merged-record pretty/compact dump and Alpaca JSONL writing.
+Every backend must round-trip to the same objects.
+"""
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+import fast_json
+from process_json import build_instruction
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sample_json")
+COCO_JSON = os.path.join(SAMPLE_DIR, "sample.json")
+MERGED_JSON = os.path.join(SAMPLE_DIR, "output_sample_annotations.json")
+TARGET_IMAGES = 20_000      # 样例循环放大到该图像数后计时
+REPEATS = 3                 # 取最快的一次
+
+
+def scale_coco(coco: Dict[str, Any], n_images: int) -> Dict[str, Any]:
+    images, anns = [], []
+    reps = n_images // max(1, len(coco["images"])) + 1
+    for r in range(reps):
+        off = r * 10_000_000
+        images += [{**img, "id": img["id"] + off} for img in coco["images"]]
+        anns += [{**a, "id": a["id"] + off, "image_id": a["image_id"] + off} for a in coco["annotations"]]
+    return {"images": images[:n_images], "annotations": anns, "categories": coco.get("categories", [])}
+
+
+def scale_list(items: List[Any], n: int) -> List[Any]:
+    return (items * (n // max(1, len(items)) + 1))[:n]
+
+
+def bench(fn: Callable[[], Any]) -> float:
+    best = float("inf")
+    for _ in range(REPEATS):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    with open(COCO_JSON, "r", encoding="utf-8") as f:
+        coco = scale_coco(json.load(f), TARGET_IMAGES)
+    with open(MERGED_JSON, "r", encoding="utf-8") as f:
+        merged = scale_list(json.load(f), TARGET_IMAGES)
+    inst = build_instruction()
+    rows = [{"instruction": inst, "input": json.dumps(m["annotations"], ensure_ascii=False), "output": "category0001",
+             "images": [m["file_path"]]} for m in merged]
+    print(f"[LOAD] {len(coco['images'])} images / {len(coco['annotations'])} annotations, {len(rows)} rows; "
+          f"backends: {', '.join(fast_json.available_backends())}")
+
+    tmp = tempfile.mkdtemp(prefix="bench_json_")
+    coco_path = os.path.join(tmp, "coco.json")
+    jsonl_path = os.path.join(tmp, "rows.jsonl")
+    with open(coco_path, "w", encoding="utf-8") as f:
+        json.dump(coco, f, ensure_ascii=False, indent=2)
+    mb = os.path.getsize(coco_path) / 1e6
+
+    failed = False
+    for name in fast_json.available_backends():
+        be = fast_json.get_backend(name)
+        results = {
+            "load coco": bench(lambda: be.load(coco_path)),
+            "dump pretty": bench(lambda: be.dump(merged, os.path.join(tmp, "m.json"), pretty=True)),
+            "dump compact": bench(lambda: be.dump(merged, os.path.join(tmp, "m.json"))),
+            "jsonl rows": bench(lambda: be.write_jsonl(rows, jsonl_path)),
+        }
+        ok = be.load(coco_path) == coco and list(be.iter_jsonl(jsonl_path)) == rows
+        failed |= not ok
+        line = " | ".join(f"{k} {v:6.3f}s" for k, v in results.items())
+        print(f"[BENCH] {name:<8} {line} | {mb / results['load coco']:.0f} MB/s load | round-trip {'OK' if ok else 'MISMATCH'}")
+
+    shutil.rmtree(tmp, ignore_errors=True)
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark visualize.MaskCompositor against the per-instance overlay_mask_on_image / draw_segment_id
+path (visualize.composite_sequential) on synthetic SAM-like images, and check pixel equality.
+
+- 每张图 NUM_SEGMENTS 个随机椭圆 mask（互相重叠）；另含一张 RLE 尺寸不一致的图（部分 mask 为半分辨率）
+- 两条路径的输出逐像素比较（含编号文字），任一不一致则退出码为 1
+"""
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+from PIL import Image
+from pycocotools import mask as maskUtils
+
+from visualize import ALPHA, DRAW_ID, MaskCompositor, composite_sequential
+
+IMAGE_SIZE = (1024, 1024)   # (W, H)
+NUM_SEGMENTS = 150
+NUM_IMAGES = 3
+REPEATS = 3                 # 取最快的一次
+SEED = 0
+
+
+def random_anns(rng: np.random.Generator, w: int, h: int, n: int, mixed_sizes: bool = False) -> List[Dict[str, Any]]:
+    anns = []
+    for k in range(n):
+        sw, sh = (w // 2, h // 2) if mixed_sizes and k % 3 == 0 else (w, h)
+        yy, xx = np.ogrid[:sh, :sw]
+        cx, cy = rng.uniform(0, sw), rng.uniform(0, sh)
+        rx, ry = rng.uniform(4, sw / 6), rng.uniform(4, sh / 6)
+        m = (((xx - cx) / rx) ** 2 + ((yy - cy) / ry) ** 2 <= 1).astype(np.uint8)
+        rle = maskUtils.encode(np.asfortranarray(m))
+        anns.append({"id": k + 1, "segmentation": {"size": rle["size"], "counts": rle["counts"].decode("ascii")}})
+    return anns
+
+
+def make_cases() -> List[Tuple[Image.Image, List[Dict[str, Any]]]]:
+    rng = np.random.default_rng(SEED)
+    w, h = IMAGE_SIZE
+    cases = []
+    for i in range(NUM_IMAGES + 1):
+        img = Image.fromarray(rng.integers(0, 256, (h, w, 3), dtype=np.uint8), mode="RGB")
+        cases.append((img, random_anns(rng, w, h, NUM_SEGMENTS, mixed_sizes=(i == NUM_IMAGES))))
+    return cases
+
+
+def bench(fn: Callable, cases: List[Tuple[Image.Image, List[Dict[str, Any]]]]) -> float:
+    best = float("inf")
+    for _ in range(REPEATS):
+        t0 = time.perf_counter()
+        for img, anns in cases:
+            fn(img, anns)
+        best = min(best, time.perf_counter() - t0)
+    return best / len(cases)
+
+
+def main():
+    cases = make_cases()
+    compositor = MaskCompositor(ALPHA)
+    mismatches = 0
+    for i, (img, anns) in enumerate(cases):
+        ref = np.asarray(composite_sequential(img, anns, ALPHA))
+        new = compositor.composite(img, anns, DRAW_ID)
+        if not np.array_equal(ref, new):
+            mismatches += 1
+            print(f"[MISMATCH] image {i}: {int((ref != new).any(axis=2).sum())} pixels differ")
+    print(f"[CHECK] {len(cases) - mismatches}/{len(cases)} images pixel-identical")
+
+    ref_s = bench(lambda img, anns: composite_sequential(img, anns, ALPHA), cases)
+    new_s = bench(lambda img, anns: compositor.composite(img, anns, DRAW_ID), cases)
+    print(f"[BENCH] {IMAGE_SIZE[0]}x{IMAGE_SIZE[1]}, {NUM_SEGMENTS} segments")
+    print(f"[BENCH] sequential : {ref_s * 1000:.1f} ms/image")
+    print(f"[BENCH] compositor : {new_s * 1000:.1f} ms/image ({ref_s / new_s:.1f}x)")
+    if mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark a combined single-pass label scanner against prediction_parser.parse_raw_prediction
+(multi-pass, one regex list at a time) on a corpus of raw predictions, and check that both return
+identical results for every corpus item (raw, and pre-cleaned).
+
+- 扫描器：所有字段标签合成一个零宽多分支正则，一次 finditer 找出候选起点，再按字段优先级做锚定匹配
+- 该扫描器在 CPython re 上比逐个正则更慢（每个位置都要尝试全部分支，无法用字面前缀跳过），
+  因此 prediction_parser 保留多分支逐个 search 的实现；速度以运行输出为准
+"""
+import json
+import os
+import re
+import time
+from typing import Callable, List, Optional, Tuple
+
+from prediction_parser import (DESC_AFTER_LEVEL2_REGEX, DESC_IMAGE_SHOWS_REGEX, DESC_REGEXES, IMG_PATH_REGEXES,
+                               LEVEL1_REGEXES, LEVEL2_REGEXES, clean_markdown_spans, parse_raw_prediction)
+
+CORPUS_JSONL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sample_json", "prediction_corpus.jsonl")
+TARGET_RECORDS = 200_000    # 语料循环放大到该条数后计时
+REPEATS = 3                 # 取最快的一次
+
+
+# -------------------- Combined single-pass scanner --------------------
+# 每个字段的正则按优先级排列；(标签, 字段序号, 优先级) 的标签为该正则匹配起点处必然出现的文本
+_FIELD_PATTERNS: List[List[re.Pattern]] = [
+    IMG_PATH_REGEXES, LEVEL1_REGEXES, LEVEL2_REGEXES,
+    DESC_REGEXES + [DESC_AFTER_LEVEL2_REGEX, DESC_IMAGE_SHOWS_REGEX],
+]
+_LABELS: List[Tuple[str, int, int]] = [
+    (r"\(/", 0, 0), (r"image", 0, 1),
+    (r"level-1", 1, 0), (r"belongs\s+to", 1, 1),
+    (r"level-2", 2, 0), (r"falls\s+under", 2, 1),
+    (r"the\s+reason", 3, 0), (r"reason", 3, 1), (r"because", 3, 2), (r"specifically,", 3, 3), (r"the\s+image", 3, 4),
+]
+_SCAN = re.compile("(?=" + "|".join(f"({label})" for label, _, _ in _LABELS) + ")", re.IGNORECASE)
+
+
+def parse_raw_prediction_scanner(raw: str) -> Tuple[Optional[str], Optional[str], Optional[str], str]:
+    """One finditer over all field labels; per field the highest-priority match wins."""
+    raw = clean_markdown_spans(raw)
+    best: List[Optional[Tuple[int, re.Match]]] = [None] * len(_FIELD_PATTERNS)
+    for hit in _SCAN.finditer(raw):
+        _, field, prio = _LABELS[hit.lastindex - 1]
+        if best[field] is not None and best[field][0] <= prio:
+            continue
+        m = _FIELD_PATTERNS[field][prio].match(raw, hit.start())
+        if m:
+            best[field] = (prio, m)
+    img_path = best[0][1].group(1).strip() if best[0] else None
+    level1 = clean_markdown_spans(best[1][1].group(1).strip()) if best[1] else ""
+    level2 = clean_markdown_spans(best[2][1].group(1).strip()) if best[2] else ""
+    desc = best[3][1].group(1).strip() if best[3] else ""
+    desc = clean_markdown_spans(re.sub(r"\s+", " ", desc).strip())
+    return img_path, level1 or None, level2 or None, desc
+
+
+def load_corpus(path: str) -> List[str]:
+    texts = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                obj = json.loads(line)
+                texts.append(obj.get("predict") or "")
+    return texts
+
+
+def check_equivalence(texts: List[str]) -> int:
+    mismatches = 0
+    for i, t in enumerate(texts):
+        for variant in (t, clean_markdown_spans(t)):
+            ref = parse_raw_prediction(variant)
+            new = parse_raw_prediction_scanner(variant)
+            if ref != new:
+                mismatches += 1
+                print(f"[MISMATCH] item {i}:\n  parser : {ref}\n  scanner: {new}")
+    return mismatches
+
+
+def bench(fn: Callable, texts: List[str]) -> float:
+    best = float("inf")
+    for _ in range(REPEATS):
+        t0 = time.perf_counter()
+        for t in texts:
+            fn(t)
+        best = min(best, time.perf_counter() - t0)
+    return len(texts) / best
+
+
+def main():
+    corpus = load_corpus(CORPUS_JSONL)
+    print(f"[LOAD] {len(corpus)} corpus items from {CORPUS_JSONL}")
+
+    mismatches = check_equivalence(corpus)
+    print(f"[CHECK] {2 * len(corpus) - mismatches}/{2 * len(corpus)} identical results")
+
+    texts = (corpus * (TARGET_RECORDS // max(1, len(corpus)) + 1))[:TARGET_RECORDS]
+    ref_rate = bench(parse_raw_prediction, texts)
+    new_rate = bench(parse_raw_prediction_scanner, texts)
+    print(f"[BENCH] multi-pass parser: {ref_rate:,.0f} records/s")
+    print(f"[BENCH] combined scanner : {new_rate:,.0f} records/s ({new_rate / ref_rate:.2f}x)")
+    if mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
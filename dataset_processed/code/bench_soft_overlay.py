@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark visualize_new.make_soft_overlay (truncated separable windows) against the original full-frame
+implementation below on random DINO seed points, and check that both agree within the truncation tolerance.
+
+- 容差：窗口外被截断的高斯尾部 ≤ exp(-HEAT_TRUNCATE_SIGMA²/2)，归一化后再乘以 max_alpha / 颜色差
+"""
+import math
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from visualize_new import HEAT_TRUNCATE_SIGMA, make_soft_overlay
+
+SIZE = (2048, 2048)         # (W, H)
+NUM_POINTS = 200
+MAX_ALPHA = 0.45
+REPEATS = 1                 # 参考实现很慢，默认只计时一次
+SEED = 0
+
+_LIGHT_C1 = np.array([180, 210, 255], dtype=np.float32) / 255.0
+_LIGHT_C2 = np.array([255, 200, 220], dtype=np.float32) / 255.0
+
+
+# -------------------- Reference (full-frame) implementation --------------------
+def _light_colormap(v: np.ndarray) -> np.ndarray:
+    return _LIGHT_C1 * (1.0 - v[..., None]) + _LIGHT_C2 * v[..., None]
+
+
+def make_soft_overlay_reference(
+    disp_W: int,
+    disp_H: int,
+    points: List[Dict],
+    max_alpha: float = 0.45,
+) -> np.ndarray:
+    """原始实现：整幅 mgrid 上逐点计算高斯，逐行着色。"""
+    yy, xx = np.mgrid[0:disp_H, 0:disp_W]
+    heat = np.zeros((disp_H, disp_W), dtype=np.float32)
+
+    sigma = max(disp_W, disp_H) / 18.0
+    two_sigma2 = 2.0 * (sigma ** 2)
+
+    for m in points:
+        (cx, cy) = m["xy"]
+        score = float(m.get("score", 1.0))
+        amp = max(0.25, min(1.0, score))
+        g = np.exp(-((xx - cx) ** 2 + (yy - cy) ** 2) / two_sigma2) * amp
+        heat = np.maximum(heat, g)
+
+    if heat.max() > 0:
+        heat_norm = heat / heat.max()
+    else:
+        heat_norm = heat
+
+    rgba = np.zeros((disp_H, disp_W, 4), dtype=np.float32)
+    for y in range(disp_H):
+        rgb_row = _light_colormap(heat_norm[y, :])
+        rgba[y, :, :3] = rgb_row
+    rgba[:, :, 3] = heat_norm * max_alpha
+    return rgba
+
+
+def random_points(rng: np.random.Generator, w: int, h: int, n: int) -> List[Dict]:
+    return [{"xy": (float(rng.uniform(0, w)), float(rng.uniform(0, h))), "score": float(rng.uniform(0, 1))}
+            for _ in range(n)]
+
+
+def bench(fn: Callable[[], np.ndarray]) -> float:
+    best = float("inf")
+    for _ in range(REPEATS):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    w, h = SIZE
+    points = random_points(np.random.default_rng(SEED), w, h, NUM_POINTS)
+    ref = make_soft_overlay_reference(w, h, points, MAX_ALPHA)
+    new = make_soft_overlay(w, h, points, MAX_ALPHA)
+    diff = float(np.abs(ref - new).max())
+    tol = math.exp(-HEAT_TRUNCATE_SIGMA ** 2 / 2) + 1e-5
+    print(f"[CHECK] max |reference - windowed| = {diff:.2e} (tolerance {tol:.2e})")
+
+    ref_s = bench(lambda: make_soft_overlay_reference(w, h, points, MAX_ALPHA))
+    new_s = bench(lambda: make_soft_overlay(w, h, points, MAX_ALPHA))
+    print(f"[BENCH] {w}x{h}, {NUM_POINTS} points")
+    print(f"[BENCH] reference: {ref_s * 1000:.0f} ms")
+    print(f"[BENCH] windowed : {new_s * 1000:.0f} ms ({ref_s / new_s:.1f}x)")
+    if diff > tol:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
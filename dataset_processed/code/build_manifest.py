@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental-build helpers for combine.py -> rename.py -> process_json.py.
+
+- stage stamp：记录某一步输入文件的 (size, mtime_ns) 与参数；输入、参数都未变且输出存在时整步跳过
+- NameManifest：original_path -> 稳定的 imageNNNNNN 文件名与 categoryNNNN，并记录源图内容哈希
+  （stat 未变时沿用上次哈希，只对变化的文件重新读盘）和该图标注子集的哈希 ann_hash；名字一经分配永不复用
+  process_json 按 ann_hash 判断哪些图像的 input payload 需要重新编码
+"""
+import hashlib
+import json
+import os
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+MANIFEST_VERSION = 1
+HASH_CHUNK = 1 << 20
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def file_signature(path: str) -> Optional[List[int]]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def hash_file(path: str) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_CHUNK), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _plain(obj: Any) -> Any:
+    # ann_store 的只读视图（Mapping / Sequence）按 dict / list 参与哈希
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    return list(obj)
+
+
+def hash_obj(obj: Any) -> str:
+    """Content hash of a JSON-serializable object (key order independent)."""
+    # orjson 快一个数量级；两种序列化结果不同，换后端只会让已记录的哈希失效一次
+    if orjson is not None:
+        data = orjson.dumps(obj, default=_plain, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+    else:
+        data = json.dumps(obj, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=_plain).encode("utf-8")
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def record_hash(item: Any) -> str:
+    """Hash of an image record's annotation subset and metadata (everything except file_path)."""
+    return hash_obj({k: v for k, v in item.items() if k != "file_path"})
+
+
+def _read_json(path: str) -> Optional[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"[WARN] Ignoring unreadable build state {path}: {e}")
+        return None
+
+
+def _write_json_atomic(obj: Any, path: str) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+# -------------------- stage stamps --------------------
+def stamp_path_for(output_path: str) -> str:
+    d, base = os.path.split(output_path)
+    return os.path.join(d, f".{base}.stamp.json")
+
+
+def _stamp(inputs: Iterable[str], params: Dict[str, Any]) -> Dict[str, Any]:
+    return {"version": MANIFEST_VERSION,
+            "inputs": {p: file_signature(p) for p in inputs},
+            "params": json.loads(json.dumps(params, default=str))}
+
+
+def stage_is_current(stamp_path: str, inputs: Iterable[str], outputs: Iterable[str], params: Dict[str, Any]) -> bool:
+    old = _read_json(stamp_path)
+    if old is None or old != _stamp(inputs, params):
+        return False
+    return all(os.path.exists(p) for p in outputs)
+
+
+def write_stage_stamp(stamp_path: str, inputs: Iterable[str], params: Dict[str, Any]) -> None:
+    _write_json_atomic(_stamp(inputs, params), stamp_path)
+
+
+# -------------------- stable names --------------------
+class NameManifest:
+    """
+    {"version", "img_digits", "next_image", "next_category",
+     "categories": {category_name: "category0001"},
+     "images": {original_path: {"name", "category", "sig": [size, mtime_ns], "hash", "ann_hash"}}}
+    """
+
+    def __init__(self, path: str, image_prefix: str = "image", category_prefix: str = "category"):
+        self.path = path
+        self.image_prefix = image_prefix
+        self.category_prefix = category_prefix
+        data = _read_json(path) or {}
+        if data and data.get("version") != MANIFEST_VERSION:
+            raise ValueError(f"Unsupported build manifest version in {path}: {data.get('version')}")
+        self.img_digits: Optional[int] = data.get("img_digits")
+        self.next_image: int = data.get("next_image", 1)
+        self.next_category: int = data.get("next_category", 1)
+        self.categories: Dict[str, str] = data.get("categories", {})
+        self.images: Dict[str, Dict[str, Any]] = data.get("images", {})
+
+    def __len__(self) -> int:
+        return len(self.images)
+
+    def category_id(self, category: str) -> str:
+        cat_id = self.categories.get(category)
+        if cat_id is None:
+            cat_id = f"{self.category_prefix}{str(self.next_category).zfill(4)}"
+            self.categories[category] = cat_id
+            self.next_category += 1
+        return cat_id
+
+    def assign_categories(self, categories: Iterable[str]) -> Dict[str, str]:
+        """New categories get the next free ids in sorted order (same as a full build on an empty manifest)."""
+        return {cat: self.category_id(cat) for cat in sorted(set(categories))}
+
+    def image_name(self, original_path: str, ext: str) -> Tuple[str, bool]:
+        """Returns (file name, is_new). Existing images keep their name even if the extension changes."""
+        entry = self.images.get(original_path)
+        if entry is not None:
+            return entry["name"], False
+        name = f"{self.image_prefix}{str(self.next_image).zfill(self.img_digits or 6)}{ext}"
+        self.next_image += 1
+        self.images[original_path] = {"name": name}
+        return name, True
+
+    def mark_present(self, paths: Iterable[str]) -> int:
+        """Flag the images of the current input; returns how many known images are no longer present."""
+        present = set(paths)
+        removed = 0
+        for p, entry in self.images.items():
+            entry["present"] = p in present
+            removed += not entry["present"]
+        return removed
+
+    def sources_unchanged(self) -> bool:
+        """True when every present source image still has its recorded (size, mtime_ns)."""
+        return all(file_signature(p) == e.get("sig") for p, e in self.images.items() if e.get("present"))
+
+    def refresh_hashes(self, paths: List[str], workers: int = 16) -> List[str]:
+        """Re-hash source images whose stat changed (stat and hashing in parallel); returns the paths whose content changed."""
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+            sigs = list(ex.map(file_signature, paths))
+            todo = []
+            for p, sig in zip(paths, sigs):
+                if sig is None:
+                    raise FileNotFoundError(f"Source image not found: {p}")
+                entry = self.images[p]
+                if entry.get("sig") != sig or "hash" not in entry:
+                    todo.append((p, sig))
+            changed = []
+            for (p, sig), h in zip(todo, ex.map(lambda t: hash_file(t[0]), todo)):
+                entry = self.images[p]
+                if entry.get("hash") != h:
+                    changed.append(p)
+                entry["sig"], entry["hash"] = sig, h
+        return changed
+
+    def ann_hashes_by_name(self) -> Dict[str, str]:
+        """Renamed file name -> ann_hash, for the images of the current input."""
+        return {e["name"]: e["ann_hash"] for e in self.images.values() if e.get("present") and "ann_hash" in e}
+
+    def save(self) -> None:
+        _write_json_atomic({
+            "version": MANIFEST_VERSION,
+            "img_digits": self.img_digits,
+            "next_image": self.next_image,
+            "next_category": self.next_category,
+            "categories": self.categories,
+            "images": self.images,
+        }, self.path)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Check coco_stream.iter_coco_arrays against json.load at tiny chunk sizes.
+
+- 对真实标注文件 CHECK_JSON 以 chunk_size = 1..MAX_CHUNK 逐一流式解析，与 json.load 的 images / annotations 比较
+- 另含若干手写用例：数字在 "." / "e" / 符号处被 chunk 截断、空数组、被跳过的非数组顶层值
+- 任一不一致则退出码为 1
+"""
+import json
+import os
+import tempfile
+from typing import Any, Dict, List, Tuple
+
+from coco_stream import iter_coco_arrays
+
+CHECK_JSON = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sample_json", "sample.json")
+MAX_CHUNK = 16
+KEYS = ("images", "annotations")
+
+INLINE_CASES = [
+    '{"images": [1, 2.5e10, 12.5, -3, 1E-7, 0.25e+3, 100], "annotations": []}',
+    '{"info": {"v": 1.5e2}, "images": [{"id": 7, "area": 12.75}], "licenses": [3.5, 4], "annotations": [-0.5]}',
+    '{"annotations": [{"bbox": [10.5, 2e3, 33, 4.25E-2]}], "images": [123456789]}',
+]
+
+
+def expected(doc: Dict[str, Any]) -> List[Tuple[str, Any]]:
+    """(key, element) pairs in file order, as iter_coco_arrays yields them."""
+    return [(k, el) for k, v in doc.items() if k in KEYS and isinstance(v, list) for el in v]
+
+
+def check_file(path: str) -> int:
+    with open(path, "r", encoding="utf-8") as f:
+        want = expected(json.load(f))
+    failures = 0
+    for chunk_size in range(1, MAX_CHUNK + 1):
+        try:
+            got = list(iter_coco_arrays(path, KEYS, chunk_size=chunk_size))
+        except ValueError as e:
+            got = f"ValueError: {e}"
+        if got != want:
+            failures += 1
+            print(f"[MISMATCH] {path} chunk_size={chunk_size}: {got if isinstance(got, str) else len(got)} "
+                  f"vs {len(want)} elements")
+    return failures
+
+
+def main():
+    failures = check_file(CHECK_JSON)
+    print(f"[CHECK] {CHECK_JSON}: chunk_size 1..{MAX_CHUNK}, {failures} mismatches")
+    with tempfile.TemporaryDirectory() as d:
+        for i, text in enumerate(INLINE_CASES):
+            path = os.path.join(d, f"case_{i}.json")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+            n = check_file(path)
+            print(f"[CHECK] inline case {i}: {n} mismatches")
+            failures += n
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming helpers for very large COCO instance files (e.g. SAM dumps of several GB).
+
+- iter_coco_arrays: 增量解析顶层 "images" / "annotations" 数组，一次只持有一个元素
+- AnnotationGrouper: 按 image_id 聚合标注；内存中超过上限后顺序落盘，结束时按落盘量
+  ceil(落盘条数 / 上限) 决定按 image_id 哈希分桶的数目，逐桶聚合后按输入序号归并，图像保持输入顺序
+"""
+import heapq
+import json
+import math
+import os
+import shutil
+import tempfile
+from typing import IO, Any, Dict, Iterator, List, Optional, Tuple
+
+CHUNK_SIZE = 1 << 20          # 每次从文件读取的字符数
+_WHITESPACE = " \t\r\n"
+_NUMBER_CHARS = frozenset("0123456789+-.eE")
+_DECODER = json.JSONDecoder()
+
+
+class _ChunkReader:
+    """Minimal pull tokenizer over a text stream, decoding one JSON value at a time."""
+
+    def __init__(self, f: IO[str], chunk_size: int = CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        # 丢弃已消费的前缀，缓冲区大小只与单个元素相关
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Skip whitespace and return the next character ('' at EOF)."""
+        while True:
+            buf, pos = self.buf, self.pos
+            while pos < len(buf) and buf[pos] in _WHITESPACE:
+                pos += 1
+            self.pos = pos
+            if pos < len(buf):
+                return buf[pos]
+            if not self._fill():
+                return ""
+
+    def next_char(self) -> str:
+        c = self.peek()
+        if c:
+            self.pos += 1
+        return c
+
+    def expect(self, ch: str) -> None:
+        c = self.next_char()
+        if c != ch:
+            raise ValueError(f"Malformed JSON: expected {ch!r}, got {c or 'EOF'!r}")
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                obj, end = _DECODER.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # 元素跨越了 chunk 边界：补读后重试
+                if self._fill():
+                    continue
+                raise
+            # 数字后到缓冲区末尾只剩数字字符时（"12" | "5"、"12." | "5"、"2.5e" | "10"）可能只解析了前缀，补读后重新解码
+            if (isinstance(obj, (int, float)) and not self.eof
+                    and all(c in _NUMBER_CHARS for c in self.buf[end:]) and self._fill()):
+                continue
+            self.pos = end
+            return obj
+
+
+def iter_coco_arrays(
+    path: str,
+    keys: Tuple[str, ...] = ("images", "annotations"),
+    chunk_size: int = CHUNK_SIZE,
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Yield (key, element) for every element of the top-level arrays named in `keys`,
+    in file order. Other top-level values are parsed and discarded (arrays element by element).
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        r = _ChunkReader(f, chunk_size)
+        r.expect("{")
+        if r.peek() == "}":
+            return
+        while True:
+            key = r.value()
+            r.expect(":")
+            if r.peek() == "[":
+                r.next_char()
+                if r.peek() == "]":
+                    r.next_char()
+                else:
+                    while True:
+                        item = r.value()
+                        if key in keys:
+                            yield key, item
+                        c = r.next_char()
+                        if c == "]":
+                            break
+                        if c != ",":
+                            raise ValueError(f"Malformed JSON in array '{key}': got {c or 'EOF'!r}")
+            else:
+                r.value()
+            c = r.next_char()
+            if c == "}":
+                break
+            if c != ",":
+                raise ValueError(f"Malformed JSON after key '{key}': got {c or 'EOF'!r}")
+
+
+class AnnotationGrouper:
+    """
+    Group images and annotations by image_id with bounded memory; images come out in input order.
+
+    Records are kept in memory until `max_buffered` have accumulated; after that every record is
+    appended to one spill file in arrival order. groups() then partitions the spill file by image_id
+    into ceil(spilled / max_buffered) buckets, so each bucket fits the same memory bound (up to
+    hash skew), groups each bucket into a run sorted by input sequence number, and merges the runs.
+    """
+
+    def __init__(self, max_buffered: int = 200_000, spill_dir: Optional[str] = None):
+        self.max_buffered = max_buffered
+        self.spill_dir = spill_dir
+        self.images: List[Tuple[int, Dict[str, Any]]] = []
+        self.anns: Dict[int, List[Dict[str, Any]]] = {}
+        self.buffered = 0
+        self.spilled_records = 0
+        self.seq = 0
+        self._tmpdir: Optional[str] = None
+        self._spill_f: Optional[IO[str]] = None
+        self._open: List[IO[str]] = []
+
+    @property
+    def spilled(self) -> bool:
+        return self._spill_f is not None
+
+    def add_image(self, img: Dict[str, Any]) -> None:
+        self.seq += 1
+        if self.spilled:
+            self._write(["i", self.seq, img])
+            return
+        self.images.append((self.seq, img))
+        self._count()
+
+    def add_annotation(self, ann: Dict[str, Any]) -> None:
+        if self.spilled:
+            self._write(["a", 0, ann])
+            return
+        self.anns.setdefault(int(ann.get("image_id")), []).append(ann)
+        self._count()
+
+    def _count(self) -> None:
+        self.buffered += 1
+        if self.buffered > self.max_buffered:
+            self._spill()
+
+    def _write(self, row: list) -> None:
+        self._spill_f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        self.spilled_records += 1
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self._tmpdir, name)
+
+    def _spill(self) -> None:
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, exist_ok=True)
+        self._tmpdir = tempfile.mkdtemp(prefix="coco_spill_", dir=self.spill_dir)
+        self._spill_f = open(self._path("spill.jsonl"), "w", encoding="utf-8")
+        self._open.append(self._spill_f)
+        print(f"[SPILL] {self.buffered} buffered records -> {self._tmpdir}")
+        for seq, img in self.images:
+            self._write(["i", seq, img])
+        for anns in self.anns.values():
+            for ann in anns:
+                self._write(["a", 0, ann])
+        self.images = []
+        self.anns = {}
+        self.buffered = 0
+
+    def _partition(self) -> int:
+        """Split the spill file by image_id into ceil(spilled / max_buffered) buckets; returns the count."""
+        self._spill_f.close()
+        n = max(1, math.ceil(self.spilled_records / max(1, self.max_buffered)))
+        print(f"[SPILL] {self.spilled_records} spilled records -> {n} buckets")
+        buckets = [open(self._path(f"bucket_{i:04d}.jsonl"), "w", encoding="utf-8") for i in range(n)]
+        self._open.extend(buckets)
+        with open(self._path("spill.jsonl"), "r", encoding="utf-8") as f:
+            for line in f:
+                kind, _, obj = json.loads(line)
+                img_id = int(obj["id"] if kind == "i" else obj.get("image_id"))
+                buckets[img_id % n].write(line)
+        for b in buckets:
+            b.close()
+        os.remove(self._path("spill.jsonl"))
+        return n
+
+    def _group_bucket(self, i: int) -> str:
+        """Group one bucket into a run file of [seq, image, annotations] lines sorted by seq."""
+        images: List[Tuple[int, Dict[str, Any]]] = []
+        anns: Dict[int, List[Dict[str, Any]]] = {}
+        bucket = self._path(f"bucket_{i:04d}.jsonl")
+        with open(bucket, "r", encoding="utf-8") as f:
+            for line in f:
+                kind, seq, obj = json.loads(line)
+                if kind == "i":
+                    images.append((seq, obj))
+                else:
+                    anns.setdefault(int(obj.get("image_id")), []).append(obj)
+        images.sort(key=lambda x: x[0])
+        run = self._path(f"run_{i:04d}.jsonl")
+        with open(run, "w", encoding="utf-8") as f:
+            for seq, img in images:
+                f.write(json.dumps([seq, img, anns.get(int(img["id"]), [])], ensure_ascii=False) + "\n")
+        os.remove(bucket)
+        return run
+
+    def _iter_run(self, path: str) -> Iterator[list]:
+        f = open(path, "r", encoding="utf-8")
+        self._open.append(f)
+        with f:
+            for line in f:
+                yield json.loads(line)
+
+    def groups(self) -> Iterator[Tuple[Dict[str, Any], List[Dict[str, Any]]]]:
+        """Yield (image, annotations) for every image that was added, in input order."""
+        if not self.spilled:
+            for _, img in self.images:
+                yield img, self.anns.get(int(img["id"]), [])
+            return
+
+        runs = [self._group_bucket(i) for i in range(self._partition())]
+        for _, img, anns in heapq.merge(*(self._iter_run(p) for p in runs), key=lambda r: r[0]):
+            yield img, anns
+
+    def close(self) -> None:
+        for f in self._open:
+            if not f.closed:
+                f.close()
+        if self._tmpdir and os.path.isdir(self._tmpdir):
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
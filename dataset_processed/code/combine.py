@@ -1,16 +1,35 @@
 # -*- coding: utf-8 -*-
-import json
 import os
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional, Tuple
+
+import fast_json
+from ann_store import AnnotationStore, signature_file
+from build_manifest import stage_is_current, stamp_path_for, write_stage_stamp
+from coco_stream import AnnotationGrouper, iter_coco_arrays
 
 INPUT_JSON = "/root/openset/dataset/instance_object_only.json"          # Modify to your own instance_object_only.json path
 IMG_BASE_DIR = "/root/openset/dataset/flat_out"                         # Modify to your own flat_out image directory
 OUTPUT_JSON = "/root/openset/dataset_processed/output_json/output_images_annotations.json"    # Modify to your own output path of this file
 
+# Streaming mode for multi-GB instance files: parse incrementally, write one merged record per line (JSONL)
+STREAMING = False
+OUTPUT_JSONL = "/root/openset/dataset_processed/output_json/output_images_annotations.jsonl"
+MAX_BUFFERED_RECORDS = 200_000      # images + annotations held in memory before spilling to disk (also sizes
+                                    # the on-disk image_id partitions: ceil(spilled / MAX_BUFFERED_RECORDS) buckets)
+SPILL_DIR: Optional[str] = None     # None -> system temp dir
+PRETTY_JSON = True                  # indent=2 output; False writes compact JSON (smaller, faster to write and parse)
+
+# Columnar mode: stream INPUT_JSON straight into an annotation store (ann_store.py; NumPy columns, memory-mapped
+# by rename.py / process_json.py) instead of a list of dicts; takes precedence over STREAMING
+COLUMNAR = False
+OUTPUT_STORE = "/root/openset/dataset_processed/output_json/output_images_annotations.annstore"
+
+# Incremental build: skip this step when INPUT_JSON (size, mtime) and the settings are unchanged
+INCREMENTAL = False
+
 
 def load_input_json(path: str) -> Dict[str, Any]:
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    return fast_json.load(path)
 
 
 def build_ann_index(annotations: List[Dict[str, Any]]) -> Dict[int, List[Dict[str, Any]]]:
@@ -27,6 +46,17 @@ def to_file_path(file_name: str, base_dir: str) -> str:
     return os.path.join(base_dir, file_name)
 
 
+def build_merged_item(img: Dict[str, Any], anns: List[Dict[str, Any]], base_dir: str) -> Dict[str, Any]:
+    """生成 file_path，保留其它图像元数据。"""
+    return {
+        "id": int(img["id"]),
+        "file_path": to_file_path(img["file_name"], base_dir),
+        "width": img.get("width"),
+        "height": img.get("height"),
+        "annotations": anns
+    }
+
+
 def merge_images_and_annotations(data: Dict[str, Any], base_dir: str) -> List[Dict[str, Any]]:
     """核心合并：对每个 image, 挂上它的 annotations, 并把 file_name -> file_path。"""
     images = data.get("images", [])
@@ -36,14 +66,7 @@ def merge_images_and_annotations(data: Dict[str, Any], base_dir: str) -> List[Di
     merged: List[Dict[str, Any]] = []
     for img in images:
         img_id = int(img["id"])
-        # 生成 file_path，保留其它图像元数据
-        item = {
-            "id": img_id,
-            "file_path": to_file_path(img["file_name"], base_dir),
-            "width": img.get("width"),
-            "height": img.get("height"),
-            "annotations": ann_index.get(img_id, [])
-        }
+        item = build_merged_item(img, ann_index.get(img_id, []), base_dir)
         merged.append(item)
         print(f"Merged image {img_id} with {len(item['annotations'])} annotations.")
     return merged
@@ -51,16 +74,69 @@ def merge_images_and_annotations(data: Dict[str, Any], base_dir: str) -> List[Di
 
 def save_json(obj: Any, path: str) -> None:
     os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(obj, f, ensure_ascii=False, indent=2)
+    fast_json.dump(obj, path, pretty=PRETTY_JSON)
+
+
+def merge_streaming(
+    input_path: str,
+    base_dir: str,
+    output_path: str,
+    max_buffered: int = MAX_BUFFERED_RECORDS,
+    spill_dir: Optional[str] = SPILL_DIR,
+) -> Tuple[int, int]:
+    """
+    Streaming variant of load_input_json + merge_images_and_annotations + save_json.
+    Peak memory is bounded by max_buffered (and by one spill bucket at merge time); images keep input order.
+    Returns (num_images, num_annotations).
+    """
+    grouper = AnnotationGrouper(max_buffered=max_buffered, spill_dir=spill_dir)
+    n_images = n_anns = 0
+    try:
+        for key, obj in iter_coco_arrays(input_path):
+            if key == "images":
+                grouper.add_image(obj)
+            else:
+                grouper.add_annotation(obj)
+
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        with open(output_path, "wb") as f:
+            for img, anns in grouper.groups():
+                item = build_merged_item(img, anns, base_dir)
+                f.write(fast_json.dumps(item) + b"\n")
+                n_images += 1
+                n_anns += len(anns)
+                if n_images % 10000 == 0:
+                    print(f"  merged {n_images} images ...")
+    finally:
+        grouper.close()
+    return n_images, n_anns
 
 
 def main():
-    data = load_input_json(INPUT_JSON)
-    merged = merge_images_and_annotations(data, IMG_BASE_DIR)
-    save_json(merged, OUTPUT_JSON)
-    total_anns = sum(len(x["annotations"]) for x in merged)
-    print(f"[OK] Combined Confirmed: {len(merged)} images, {total_anns} annotations -> {OUTPUT_JSON}")
+    output = OUTPUT_STORE if COLUMNAR else OUTPUT_JSONL if STREAMING else OUTPUT_JSON
+    stamp = stamp_path_for(output)
+    params = {"img_base_dir": IMG_BASE_DIR, "streaming": STREAMING}
+    if INCREMENTAL and stage_is_current(stamp, [INPUT_JSON], [signature_file(output)], params):
+        print(f"[SKIP] {INPUT_JSON} unchanged since last build -> {output}")
+        return
+
+    if COLUMNAR:
+        store = AnnotationStore.from_coco(INPUT_JSON, IMG_BASE_DIR)
+        store.save(OUTPUT_STORE)
+        print(f"[OK] Combined Confirmed: {len(store)} images, {store.num_annotations} annotations "
+              f"({store.nbytes / 1e6:.1f} MB of columns) -> {OUTPUT_STORE}")
+    elif STREAMING:
+        n_images, n_anns = merge_streaming(INPUT_JSON, IMG_BASE_DIR, OUTPUT_JSONL)
+        print(f"[OK] Combined Confirmed: {n_images} images, {n_anns} annotations -> {OUTPUT_JSONL}")
+    else:
+        data = load_input_json(INPUT_JSON)
+        merged = merge_images_and_annotations(data, IMG_BASE_DIR)
+        save_json(merged, OUTPUT_JSON)
+        total_anns = sum(len(x["annotations"]) for x in merged)
+        print(f"[OK] Combined Confirmed: {len(merged)} images, {total_anns} annotations -> {OUTPUT_JSON}")
+
+    if INCREMENTAL:
+        write_stage_stamp(stamp, [INPUT_JSON], params)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compact Alpaca JSONL: prompt templates are stored once in a header line, records only keep
+per-record fields and a reference to the template.
+
+    {"format": "compact-alpaca", "version": 1, "templates": {"instruction": "...{image_path}..."}}
+    {"instruction": {"$t": "instruction"}, "input": "...", "output": "...", "images": [...], "$v": {"image_path": "..."}}
+
+- 字段值为 {"$t": name} 时展开为 templates[name]，其中的 "{var}" 用该行 "$v" 中的值替换（纯字符串替换，不解析其它花括号）
+- iter_alpaca_rows 同时支持普通 Alpaca JSONL 与 compact 格式，逐行流式展开
+- 直接运行本脚本：把 INPUT_JSONL 展开为标准 Alpaca JSONL（OUTPUT_JSONL 可以是命名管道，供训练/推理边读边展开）
+"""
+import json
+import os
+from typing import Any, Dict, IO, Iterator, Optional
+
+FORMAT_NAME = "compact-alpaca"
+FORMAT_VERSION = 1
+
+INPUT_JSONL = "/root/openset/llama_factory/LLaMA-Factory/data/rs_open_tag_infer_new.compact.jsonl"
+OUTPUT_JSONL = "/root/openset/llama_factory/LLaMA-Factory/data/rs_open_tag_infer_new.jsonl"
+
+
+def compact_path(path: str) -> str:
+    """'x/data.jsonl' -> 'x/data.compact.jsonl'"""
+    base, ext = os.path.splitext(path)
+    return f"{base}.compact{ext or '.jsonl'}"
+
+
+def render_template(template: str, variables: Optional[Dict[str, str]]) -> str:
+    if variables:
+        for k, v in variables.items():
+            template = template.replace("{" + k + "}", v)
+    return template
+
+
+class CompactWriter:
+    """Writes the header once, then one compact record per write() call."""
+
+    def __init__(self, path: str, templates: Dict[str, str], ensure_ascii: bool = False):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.templates = templates
+        self.ensure_ascii = ensure_ascii
+        self.count = 0
+        self._f: IO[str] = open(path, "w", encoding="utf-8")
+        header = {"format": FORMAT_NAME, "version": FORMAT_VERSION, "templates": templates}
+        self._f.write(json.dumps(header, ensure_ascii=ensure_ascii) + "\n")
+
+    def write(self, fields: Dict[str, Any], variables: Optional[Dict[str, str]] = None) -> None:
+        """`fields` values may be template references made with ref(name)."""
+        row = dict(fields)
+        if variables:
+            row["$v"] = variables
+        self._f.write(json.dumps(row, ensure_ascii=self.ensure_ascii) + "\n")
+        self.count += 1
+
+    @staticmethod
+    def ref(name: str) -> Dict[str, str]:
+        return {"$t": name}
+
+    def close(self) -> None:
+        self._f.close()
+
+    def __enter__(self) -> "CompactWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def expand_row(row: Dict[str, Any], templates: Dict[str, str]) -> Dict[str, Any]:
+    variables = row.get("$v")
+    out = {}
+    for k, v in row.items():
+        if k == "$v":
+            continue
+        if isinstance(v, dict) and "$t" in v:
+            v = render_template(templates[v["$t"]], variables)
+        out[k] = v
+    return out
+
+
+def is_header(row: Any) -> bool:
+    return isinstance(row, dict) and row.get("format") == FORMAT_NAME
+
+
+def header_templates(row: Dict[str, Any], path: str = "") -> Dict[str, str]:
+    if row.get("version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported {FORMAT_NAME} version {row.get('version')} in {path}")
+    return row["templates"]
+
+
+def read_templates(path: str) -> Optional[Dict[str, str]]:
+    """Templates of a compact file (from its first non-empty line); None for plain Alpaca JSONL."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                return None
+            return header_templates(row, path) if is_header(row) else None
+    return None
+
+
+def iter_alpaca_rows(path: str) -> Iterator[Dict[str, Any]]:
+    """Stream standard Alpaca rows from either a plain or a compact JSONL file."""
+    with open(path, "r", encoding="utf-8") as f:
+        templates = None
+        first = True
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            if first:
+                first = False
+                if is_header(row):
+                    templates = header_templates(row, path)
+                    continue
+            yield expand_row(row, templates) if templates is not None else row
+
+
+def expand_to_jsonl(src: str, dst: str) -> int:
+    """Expand a (compact or plain) dataset to standard Alpaca JSONL; returns the record count."""
+    os.makedirs(os.path.dirname(dst) or ".", exist_ok=True)
+    n = 0
+    with open(dst, "w", encoding="utf-8") as f:
+        for row in iter_alpaca_rows(src):
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            n += 1
+    return n
+
+
+def main():
+    n = expand_to_jsonl(INPUT_JSONL, OUTPUT_JSONL)
+    src_mb = os.path.getsize(INPUT_JSONL) / (1 << 20)
+    print(f"[OK] Expanded {n} records: {INPUT_JSONL} ({src_mb:.1f} MB) -> {OUTPUT_JSONL}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+Deterministic train/val/test split + shard writer for Alpaca JSONL datasets (plain or compact).
+
+- 划分：按 images[0] 的加盐哈希（SEED）决定；STRATIFY=True 时在每个类别（output）内按哈希排序后按比例切分，
+  各类别在各 split 中的占比与 SPLITS 一致；False 时按哈希阈值划分（图像所属 split 与其它记录无关）
+- 分片：split 内按 (类别, 哈希) 排序后轮转分配到 NUM_SHARDS 个分片，分片大小相差不超过 1，类别分布一致
+- 打乱：分片内按另一个加盐哈希排序（确定性打乱，与输入顺序无关）；外存实现——记录先按哈希区间落盘为子桶，
+  每个子桶不超过 SHARD_MEMORY_MB，逐桶排序后拼接，内存占用与数据集大小无关；落盘时最多同时打开
+  MAX_OPEN_FILES 个子桶文件（LRU，关闭后以追加方式重开）
+- 各分片并行写出；相同输入与 SEED 的重跑输出逐字节一致
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, IO, List, Optional, Tuple
+
+import numpy as np
+
+import fast_json
+from compact_dataset import iter_alpaca_rows
+
+INPUT_JSONL = "/root/openset/llama_factory/LLaMA-Factory/data/rs_open_tag_infer_new.jsonl"
+OUTPUT_DIR = "/root/openset/llama_factory/LLaMA-Factory/data/rs_open_tag_splits"
+
+SPLITS = {"train": 0.90, "val": 0.05, "test": 0.05}   # 比例之和为 1
+NUM_SHARDS = {"train": 8, "val": 1, "test": 1}
+SEED = "landcover-mvt"
+STRATIFY = True
+SHARD_MEMORY_MB = 512     # 单个子桶的内存排序上限
+WORKERS = None            # 并行写分片的进程数；None -> os.cpu_count()
+MAX_OPEN_FILES = 256      # 落盘时同时打开的子桶文件数上限
+
+_HASH_HEX = 16            # 子桶中每行前缀：16 位十六进制排序键 + "\t"
+
+
+def stable_hash(key: str, salt: str) -> int:
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8, key=salt.encode("utf-8")[:64]).digest()
+    return int.from_bytes(digest, "big")
+
+
+def record_key(row: Dict[str, Any]) -> str:
+    images = row.get("images")
+    if not images:
+        raise ValueError(f"Record has no images: {str(row)[:200]}")
+    return images[0]
+
+
+def assign_splits(cat: np.ndarray, h: np.ndarray, fractions: List[float], stratify: bool) -> np.ndarray:
+    cum = np.cumsum(fractions)[:-1]
+    if not stratify:
+        u = h.astype(np.float64) / 2.0 ** 64
+        return np.searchsorted(cum, u, side="right").astype(np.int16)
+    order = np.lexsort((h, cat))
+    cat_sorted = cat[order]
+    starts = np.flatnonzero(np.r_[True, cat_sorted[1:] != cat_sorted[:-1]])
+    sizes = np.diff(np.r_[starts, len(cat_sorted)])
+    rank = np.arange(len(order)) - np.repeat(starts, sizes)
+    n = np.repeat(sizes, sizes)
+    split_sorted = np.zeros(len(order), dtype=np.int16)
+    for c in cum:
+        split_sorted += rank >= np.rint(c * n)
+    split = np.empty_like(split_sorted)
+    split[order] = split_sorted
+    return split
+
+
+def assign_shards(split: np.ndarray, cat: np.ndarray, h: np.ndarray, num_shards: List[int]) -> np.ndarray:
+    shard = np.zeros(len(split), dtype=np.int32)
+    for s, n in enumerate(num_shards):
+        idx = np.flatnonzero(split == s)
+        order = idx[np.lexsort((h[idx], cat[idx]))]
+        shard[order] = np.arange(len(order)) % n
+    return shard
+
+
+def _finalize_shard(parts: List[str], out_path: str) -> int:
+    """Sort each sub-bucket by its key prefix and concatenate (buckets are hash ranges, so the result is sorted)."""
+    n = 0
+    tmp = out_path + ".part"
+    with open(tmp, "wb") as out:
+        for p in parts:
+            if not os.path.exists(p):
+                continue
+            with open(p, "rb") as f:
+                lines = f.readlines()
+            lines.sort(key=lambda l: l[:_HASH_HEX])
+            for line in lines:
+                out.write(line[_HASH_HEX + 1:])
+            n += len(lines)
+            os.remove(p)
+    os.replace(tmp, out_path)
+    return n
+
+
+def write_splits(
+    input_path: str,
+    output_dir: str,
+    splits: Dict[str, float] = SPLITS,
+    num_shards: Dict[str, int] = NUM_SHARDS,
+    seed: str = SEED,
+    stratify: bool = STRATIFY,
+    workers: Optional[int] = WORKERS,
+    shard_memory_mb: int = SHARD_MEMORY_MB,
+) -> Dict[str, Any]:
+    names = list(splits)
+    fractions = [float(splits[k]) for k in names]
+    if abs(sum(fractions) - 1.0) > 1e-6:
+        raise ValueError(f"SPLITS must sum to 1, got {sum(fractions)}")
+    shards = [int(num_shards.get(k, 1)) for k in names]
+    stem = os.path.splitext(os.path.basename(input_path))[0]
+
+    # 1) 第一遍：每条记录只保留 (类别编号, 两个哈希, 字节数)
+    categories: Dict[str, int] = {}
+    cat, h_split, h_order, nbytes = array("i"), array("Q"), array("Q"), array("q")
+    for row in iter_alpaca_rows(input_path):
+        key = record_key(row)
+        cat.append(categories.setdefault(str(row.get("output", "")), len(categories)))
+        h_split.append(stable_hash(key, seed + ":split"))
+        h_order.append(stable_hash(key, seed + ":order"))
+        nbytes.append(len(fast_json.dumps(row)) + _HASH_HEX + 2)
+    cat_names = sorted(categories)          # 类别编号按名称排序，结果与输入顺序无关
+    remap = np.zeros(len(cat_names), dtype=np.int32)
+    for i, c in enumerate(cat_names):
+        remap[categories[c]] = i
+    cat_a = remap[np.frombuffer(cat, dtype=np.int32)]
+    hs = np.frombuffer(h_split, dtype=np.uint64)
+    split = assign_splits(cat_a, hs, fractions, stratify)
+    shard = assign_shards(split, cat_a, hs, shards)
+    print(f"[SPLIT] {len(cat)} records, {len(categories)} categories from {input_path}")
+
+    # 每个分片的子桶数：按估计字节数使每个子桶不超过内存上限
+    limit = max(1, shard_memory_mb) << 20
+    shard_bytes: Dict[Tuple[int, int], int] = {}
+    for s, k, b in zip(split.tolist(), shard.tolist(), nbytes.tolist()):
+        shard_bytes[(s, k)] = shard_bytes.get((s, k), 0) + b
+    subs = {sk: -(-b // limit) for sk, b in shard_bytes.items()}
+
+    # 2) 第二遍：记录落盘到 (split, shard, 子桶)，行首写排序键
+    tmpdir = tempfile.mkdtemp(prefix="splits_", dir=output_dir if os.path.isdir(output_dir) else None)
+    handles: "OrderedDict[Tuple[int, int, int], IO[bytes]]" = OrderedDict()
+
+    def part_path(s: int, k: int, j: int) -> str:
+        return os.path.join(tmpdir, f"{s}-{k:05d}-{j:04d}.jsonl")
+
+    try:
+        for i, row in enumerate(iter_alpaca_rows(input_path)):
+            s, k, ho = int(split[i]), int(shard[i]), h_order[i]
+            j = (ho * subs[(s, k)]) >> 64
+            f = handles.get((s, k, j))
+            if f is None:
+                if len(handles) >= MAX_OPEN_FILES:
+                    handles.popitem(last=False)[1].close()
+                f = handles[(s, k, j)] = open(part_path(s, k, j), "ab")
+            else:
+                handles.move_to_end((s, k, j))
+            f.write(b"%016x\t" % ho + fast_json.dumps(row) + b"\n")
+        for f in handles.values():
+            f.close()
+
+        # 3) 并行排序拼接各分片
+        jobs = []
+        for s, name in enumerate(names):
+            os.makedirs(os.path.join(output_dir, name), exist_ok=True)
+            for k in range(shards[s]):
+                out = os.path.join(output_dir, name, f"{stem}-{k:05d}-of-{shards[s]:05d}.jsonl")
+                parts = [part_path(s, k, j) for j in range(subs.get((s, k), 0))]
+                jobs.append((s, out, parts))
+        workers = workers or os.cpu_count() or 1
+        if workers <= 1:
+            counts = [_finalize_shard(parts, out) for _, out, parts in jobs]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as ex:
+                counts = list(ex.map(_finalize_shard, [p for _, _, p in jobs], [o for _, o, _ in jobs]))
+    finally:
+        for f in handles.values():
+            f.close()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    # 4) manifest
+    manifest: Dict[str, Any] = {"input": input_path, "seed": seed, "stratify": stratify, "splits": {}}
+    for s, name in enumerate(names):
+        per_cat = np.bincount(cat_a[split == s], minlength=len(cat_names))
+        manifest["splits"][name] = {
+            "fraction": fractions[s],
+            "records": int((split == s).sum()),
+            "shards": [{"path": out, "records": n} for (js, out, _), n in zip(jobs, counts) if js == s],
+            "categories": {c: int(per_cat[i]) for i, c in enumerate(cat_names) if per_cat[i]},
+        }
+    with open(os.path.join(output_dir, "splits_manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def main():
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    manifest = write_splits(INPUT_JSONL, OUTPUT_DIR)
+    for name, info in manifest["splits"].items():
+        print(f"[SAVE] {name}: {info['records']} records in {len(info['shards'])} shards, "
+              f"{len(info['categories'])} categories -> {os.path.join(OUTPUT_DIR, name)}")
+
+
+if __name__ == "__main__":
+    main()
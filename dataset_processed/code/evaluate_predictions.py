@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Streaming evaluation of generated_predictions.jsonl against the implicit ground truth of the
+dataset scripts.
+
+Ground truth (LABEL_SOURCE):
+- None                          -> 预测行自带的 "label" 字段（LLaMA-Factory vllm_infer 输出）
+- Alpaca JSONL (process_json / generate_json / generate_test_json 输出) -> images[0] + output
+- image_category_mapping.json (rename.py)                           -> new_path + category
+- aid_label_index.json (AID process_rename.py)                      -> file + label
+- 其它 JSONL：每行 {"image"|"path": ..., "label": ...}
+
+JOIN:
+- "inline": 使用预测行的 "label"
+- "row"   : 预测第 i 行与 Alpaca JSONL 第 i 条数据行对齐（vllm_infer 保持数据集顺序），常数内存；
+            标签文件的空行与 compact 文件头不计为数据行，compact 模板照常展开，无法解析的标签行计为无标签
+- "path"  : 按图像路径（退化为 basename）查找标签
+
+TASK:
+- "taxonomy": 解析 Level-1/Level-2 名称 -> taxonomy 代码，分别统计
+- "category": 预测中的 categoryNNNN
+- "aid"     : 预测中的整数标签 1..30
+
+Accumulators hold one confusion matrix per level (size depends only on the number of classes),
+so memory does not grow with the number of predictions. Shards are scored on a process pool and merged;
+save_npz / load_npz allow merging shards scored elsewhere. With USE_INDEX each shard reads only its own
+contiguous, byte-balanced line range (jsonl_index sidecar); otherwise shard = line_no % NUM_SHARDS and every
+shard scans the whole file.
+"""
+import json
+import os
+import re
+from multiprocessing import Pool
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from compact_dataset import expand_row, is_header, iter_alpaca_rows, read_templates
+from jsonl_index import JsonlIndex
+from prediction_parser import parse_raw_prediction
+from taxonomy_index import get_taxonomy_index
+
+# -------------------- Hard-coded paths --------------------
+PREDICTIONS_JSONL = "/root/openset/llama_factory/LLaMA-Factory/outputs/no-finetune-pixtral_test_2025-09-14/generated_predictions.jsonl"
+LABEL_SOURCE: Optional[str] = None
+JOIN = "inline"          # "inline" | "row" | "path"
+TASK = "taxonomy"        # "taxonomy" | "category" | "aid"
+NUM_SHARDS = os.cpu_count() or 1
+USE_INDEX = True         # 预测（及 JOIN="row" 的标签）文件旁建立/复用 .idx 行偏移索引
+REPORT_JSON = os.path.join(os.path.dirname(PREDICTIONS_JSONL), "eval_report.json")
+
+NO_PREDICTION = "__none__"   # 预测无法解析时计入的列
+
+CATEGORY_REGEX = re.compile(r"category\d{4}", re.IGNORECASE)
+AID_LABEL_REGEX = re.compile(r"\b([1-9]|[12]\d|30)\b")
+PROMPT_PATH_REGEXES = [
+    re.compile(r'"path"\s*:\s*"([^"]+)"'),                                       # process_json 的 image_meta.path
+    re.compile(r"(/[^\s\"'()]+\.(?:png|jpg|jpeg|bmp|gif|tif|tiff))", re.IGNORECASE),
+]
+
+
+class ConfusionAccumulator:
+    """Confusion matrix over a growing class list; rows = ground truth, cols = prediction."""
+
+    def __init__(self, classes: Optional[List[str]] = None):
+        self.classes: List[str] = []
+        self.index: Dict[str, int] = {}
+        self.matrix = np.zeros((8, 8), dtype=np.int64)
+        for c in classes or []:
+            self._idx(c)
+
+    def _idx(self, label: str) -> int:
+        i = self.index.get(label)
+        if i is None:
+            i = self.index[label] = len(self.classes)
+            self.classes.append(label)
+            if i >= self.matrix.shape[0]:
+                n = self.matrix.shape[0] * 2
+                grown = np.zeros((n, n), dtype=np.int64)
+                grown[:i, :i] = self.matrix[:i, :i]
+                self.matrix = grown
+        return i
+
+    def update(self, true: str, pred: Optional[str]) -> None:
+        i = self._idx(true)
+        j = self._idx(pred if pred is not None else NO_PREDICTION)
+        self.matrix[i, j] += 1          # 先取索引：_idx 可能扩容 self.matrix
+
+    @property
+    def confusion(self) -> np.ndarray:
+        n = len(self.classes)
+        return self.matrix[:n, :n]
+
+    def merge(self, other: "ConfusionAccumulator") -> "ConfusionAccumulator":
+        idx = np.array([self._idx(c) for c in other.classes], dtype=np.intp)
+        self.matrix[np.ix_(idx, idx)] += other.confusion
+        return self
+
+    def report(self) -> Dict[str, Any]:
+        m = self.confusion
+        total = int(m.sum())
+        correct = int(np.trace(m))
+        tp = np.diag(m)
+        pred_sum = m.sum(axis=0)
+        true_sum = m.sum(axis=1)
+        per_class = {}
+        for i, c in enumerate(self.classes):
+            if c == NO_PREDICTION:
+                continue
+            p = float(tp[i] / pred_sum[i]) if pred_sum[i] else 0.0
+            r = float(tp[i] / true_sum[i]) if true_sum[i] else 0.0
+            per_class[c] = {"precision": p, "recall": r, "f1": 2 * p * r / (p + r) if p + r else 0.0,
+                            "support": int(true_sum[i])}
+        no_pred = self.index.get(NO_PREDICTION)
+        return {
+            "total": total,
+            "accuracy": correct / total if total else 0.0,
+            "unparsed": int(pred_sum[no_pred]) if no_pred is not None else 0,
+            "per_class": per_class,
+            "classes": list(self.classes),
+            "confusion": m.tolist(),
+        }
+
+
+def merge_results(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    out: Dict[str, Any] = {"counts": {}, "levels": {}}
+    for res in results:
+        for k, v in res["counts"].items():
+            out["counts"][k] = out["counts"].get(k, 0) + v
+        for level, acc in res["levels"].items():
+            if level in out["levels"]:
+                out["levels"][level].merge(acc)
+            else:
+                out["levels"][level] = ConfusionAccumulator().merge(acc)
+    return out
+
+
+def save_npz(result: Dict[str, Any], path: str) -> None:
+    arrays = {"counts": np.array(json.dumps(result["counts"]))}
+    for level, acc in result["levels"].items():
+        arrays[f"{level}__classes"] = np.array(acc.classes)
+        arrays[f"{level}__confusion"] = acc.confusion
+    np.savez_compressed(path, **arrays)
+
+
+def load_npz(path: str) -> Dict[str, Any]:
+    with np.load(path) as z:
+        result: Dict[str, Any] = {"counts": json.loads(str(z["counts"])), "levels": {}}
+        for key in z.files:
+            if key.endswith("__classes"):
+                level = key[: -len("__classes")]
+                acc = ConfusionAccumulator([str(c) for c in z[key]])
+                acc.matrix[: len(acc.classes), : len(acc.classes)] = z[f"{level}__confusion"]
+                result["levels"][level] = acc
+    return result
+
+
+# -------------------- Label sources --------------------
+def iter_label_source(path: str) -> Iterator[Tuple[str, str]]:
+    """Yields (image_path, label) from any of the supported ground-truth files."""
+    if path.endswith(".jsonl"):
+        for row in iter_alpaca_rows(path):
+            if "images" in row:
+                yield row["images"][0], str(row.get("output", ""))
+            else:
+                yield row.get("image") or row.get("path"), str(row["label"])
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict) and "samples" in data:
+        for it in data["samples"]:
+            yield it["file"], str(it["label"])
+    else:
+        for it in data:
+            yield it["new_path"], str(it["category"])
+
+
+def build_label_map(path: str) -> Dict[str, str]:
+    labels: Dict[str, str] = {}
+    for img, label in iter_label_source(path):
+        labels[img] = label
+        labels.setdefault(os.path.basename(img), label)
+    return labels
+
+
+# -------------------- Prediction extraction --------------------
+def prediction_image_path(row: Dict[str, Any], parsed_path: Optional[str]) -> Optional[str]:
+    images = row.get("images")
+    if images:
+        return images[0]
+    if parsed_path:
+        return parsed_path
+    prompt = row.get("prompt") or ""
+    for pat in PROMPT_PATH_REGEXES:
+        m = pat.search(prompt)
+        if m:
+            return m.group(1)
+    return None
+
+
+def extract(row: Dict[str, Any], task: str) -> Tuple[Dict[str, Optional[str]], Optional[str]]:
+    """Returns ({level: predicted label}, image path from the prediction row)."""
+    raw = row.get("predict") or row.get("raw_prediction") or row.get("text") or ""
+    if not isinstance(raw, str):
+        raw = ""
+    if task == "taxonomy":
+        img_path, level1, level2, _ = parse_raw_prediction(raw)
+        norm = get_taxonomy_index().normalize_prediction(level1, level2)
+        return {"level1": norm["level1_code"], "level2": norm["level2_code"]}, prediction_image_path(row, img_path)
+    if task == "category":
+        m = CATEGORY_REGEX.search(raw)
+        return {"label": m.group(0).lower() if m else None}, prediction_image_path(row, None)
+    m = AID_LABEL_REGEX.search(raw)
+    return {"label": m.group(1) if m else None}, prediction_image_path(row, None)
+
+
+def truth_levels(label: str, task: str) -> Dict[str, Optional[str]]:
+    if task != "taxonomy":
+        return {"label": label.strip().lower() if task == "category" else label.strip()}
+    ix = get_taxonomy_index()
+    code2 = ix.lookup("level2", label)
+    if code2 is not None:
+        return {"level1": ix.parent[code2], "level2": code2}
+    return {"level1": ix.lookup("level1", label), "level2": None}
+
+
+# -------------------- Sharded scoring --------------------
+_LABEL_MAP: Optional[Dict[str, str]] = None   # path join 的标签表；子进程由 _init_worker 设置（不依赖 fork 继承）
+_CONFIG_KEYS = ("PREDICTIONS_JSONL", "LABEL_SOURCE", "JOIN", "TASK", "USE_INDEX")
+
+
+def _init_worker(config: Dict[str, Any], label_map: Optional[Dict[str, str]]) -> None:
+    """Pool initializer: the parent's (possibly overridden) config and label map, also under spawn / forkserver."""
+    global _LABEL_MAP
+    globals().update(config)
+    _LABEL_MAP = label_map
+
+
+def _truth_labels(lines: Iterable[str], templates: Optional[Dict[str, str]]) -> Iterator[Optional[str]]:
+    """Label of each data row in `lines` (None if the row does not parse); blank lines and the compact header are skipped."""
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            t = json.loads(line)
+        except json.JSONDecodeError:
+            yield None
+            continue
+        if not isinstance(t, dict):
+            yield None
+            continue
+        if is_header(t):
+            continue
+        if templates is not None:
+            t = expand_row(t, templates)
+        yield str(t.get("output", t.get("label", "")))
+
+
+def _parse_row(line: str, label: Optional[str]) -> Tuple[Dict[str, Any], Optional[str]]:
+    try:
+        return json.loads(line), label
+    except json.JSONDecodeError:
+        return {}, label
+
+
+def _iter_rows(shard: int, num_shards: int) -> Iterator[Tuple[Dict[str, Any], Optional[str]]]:
+    """Yields (prediction row or {} if unparsable, row-aligned label) for this shard's lines."""
+    if USE_INDEX:
+        yield from _iter_rows_indexed(shard, num_shards)
+        return
+    truth_f = open(LABEL_SOURCE, "r", encoding="utf-8") if JOIN == "row" else None
+    truth = _truth_labels(truth_f, read_templates(LABEL_SOURCE)) if truth_f is not None else None
+    try:
+        with open(PREDICTIONS_JSONL, "r", encoding="utf-8") as f:
+            for i, line in enumerate(f):
+                label = next(truth, None) if truth is not None else None
+                if i % num_shards != shard or not line.strip():
+                    continue
+                yield _parse_row(line, label)
+    finally:
+        if truth_f is not None:
+            truth_f.close()
+
+
+def _iter_rows_indexed(shard: int, num_shards: int) -> Iterator[Tuple[Dict[str, Any], Optional[str]]]:
+    """Same as _iter_rows, but reads only this shard's contiguous line range."""
+    pred_idx = JsonlIndex.open(PREDICTIONS_JSONL)
+    start, end = pred_idx.shard_ranges(num_shards)[shard]
+    truth = None
+    if JOIN == "row":
+        truth_idx = JsonlIndex.open(LABEL_SOURCE)
+        templates = read_templates(LABEL_SOURCE)
+        # 第 start 条数据行所在的物理行（跳过空行与 compact 文件头）
+        data_rows = truth_idx.nonempty_rows()
+        if templates is not None:
+            data_rows = data_rows[1:]
+        t_start = int(data_rows[start]) if start < len(data_rows) else len(truth_idx)
+        truth = _truth_labels((line.decode("utf-8") for _, line in truth_idx.iter_range(t_start, len(truth_idx))),
+                              templates)
+    for _, line in pred_idx.iter_range(start, end):
+        label = next(truth, None) if truth is not None else None
+        line = line.decode("utf-8")
+        if line.strip():
+            yield _parse_row(line, label)
+
+
+def score_shard(shard: int, num_shards: int = 1) -> Dict[str, Any]:
+    counts = {"predictions": 0, "scored": 0, "unlabeled": 0, "invalid_json": 0}
+    levels: Dict[str, ConfusionAccumulator] = {}
+    for row, label in _iter_rows(shard, num_shards):
+        counts["predictions"] += 1
+        if not row:
+            counts["invalid_json"] += 1
+            continue
+        pred, img_path = extract(row, TASK)
+        if JOIN == "inline":
+            label = row.get("label")
+        elif JOIN == "path":
+            label = None
+            if img_path:
+                label = _LABEL_MAP.get(img_path) or _LABEL_MAP.get(os.path.basename(img_path))
+        if not label:
+            counts["unlabeled"] += 1
+            continue
+        counts["scored"] += 1
+        for level, true in truth_levels(str(label), TASK).items():
+            if true is not None:
+                levels.setdefault(level, ConfusionAccumulator()).update(true, pred.get(level))
+    return {"counts": counts, "levels": levels}
+
+
+def _score_shard_args(args: Tuple[int, int]) -> Dict[str, Any]:
+    return score_shard(*args)
+
+
+def evaluate(num_shards: int = NUM_SHARDS) -> Dict[str, Any]:
+    global _LABEL_MAP
+    if JOIN in ("row", "path") and not LABEL_SOURCE:
+        raise ValueError(f"JOIN='{JOIN}' requires LABEL_SOURCE")
+    if JOIN == "path":
+        _LABEL_MAP = build_label_map(LABEL_SOURCE)
+        print(f"[LOAD] {len(_LABEL_MAP)} label keys from {LABEL_SOURCE}")
+
+    if USE_INDEX:   # 在启动子进程前建好索引，各分片只做 mmap 读取
+        JsonlIndex.open(PREDICTIONS_JSONL)
+        if JOIN == "row":
+            JsonlIndex.open(LABEL_SOURCE)
+
+    jobs = [(i, num_shards) for i in range(num_shards)]
+    if num_shards <= 1:
+        results = [score_shard(0, 1)]
+    else:
+        config = {k: globals()[k] for k in _CONFIG_KEYS}
+        with Pool(num_shards, initializer=_init_worker, initargs=(config, _LABEL_MAP)) as pool:
+            results = pool.map(_score_shard_args, jobs)
+    return merge_results(results)
+
+
+def main():
+    if not os.path.exists(PREDICTIONS_JSONL):
+        raise FileNotFoundError(f"JSONL file not found: {PREDICTIONS_JSONL}")
+    result = evaluate()
+    report = {"predictions": PREDICTIONS_JSONL, "task": TASK, "join": JOIN, "label_source": LABEL_SOURCE,
+              "counts": result["counts"],
+              "levels": {level: acc.report() for level, acc in result["levels"].items()}}
+
+    os.makedirs(os.path.dirname(REPORT_JSON) or ".", exist_ok=True)
+    with open(REPORT_JSON, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    c = result["counts"]
+    print(f"[EVAL] {c['predictions']} predictions, {c['scored']} scored, {c['unlabeled']} unlabeled, "
+          f"{c['invalid_json']} invalid JSON")
+    for level, rep in report["levels"].items():
+        print(f"  {level}: top-1 accuracy {rep['accuracy']:.4f} over {rep['total']} ({rep['unparsed']} unparsed)")
+    print(f"[SAVE] Report written to: {REPORT_JSON}")
+
+
+if __name__ == "__main__":
+    main()
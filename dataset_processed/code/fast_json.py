@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Shared JSON (de)serialization with the fastest installed backend: orjson > msgspec > stdlib json.
+
+- 所有编码结果为 UTF-8 bytes（不转义非 ASCII）；pretty=True 时缩进 2 空格，否则紧凑输出
+- JSONL 以二进制逐行写出
+- 各后端接受相同的输入：非 str 的 dict 键（int / float / bool / None）转为字符串，NumPy 数组与标量
+  转为列表 / Python 数值（orjson 用 OPT_NON_STR_KEYS | OPT_SERIALIZE_NUMPY，其余后端用同一转换函数），
+  其它不可序列化的对象一律 TypeError
+注意：模型可见的文本（如 process_json 的 input payload）仍由 stdlib json.dumps 生成，
+各后端的分隔符/浮点格式不同，换后端会改变 prompt 内容。
+"""
+import json
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+PREFERRED_BACKENDS = ("orjson", "msgspec", "json")
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+_AVAILABLE = {"orjson": orjson is not None, "msgspec": msgspec is not None, "json": True}
+
+
+def available_backends() -> List[str]:
+    return [b for b in PREFERRED_BACKENDS if _AVAILABLE[b]]
+
+
+def _to_builtin(obj: Any) -> Any:
+    # NumPy 数组 / 标量（orjson 原生不支持的 dtype、非连续数组也走这里）
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class Backend:
+    def __init__(self, name: str):
+        if not _AVAILABLE.get(name):
+            raise ValueError(f"JSON backend not available: {name}")
+        self.name = name
+        if name == "orjson":
+            opts = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+            self._dumps = lambda o: orjson.dumps(o, default=_to_builtin, option=opts)
+            self._dumps_pretty = lambda o: orjson.dumps(o, default=_to_builtin, option=opts | orjson.OPT_INDENT_2)
+            self.loads = orjson.loads
+        elif name == "msgspec":
+            enc = msgspec.json.Encoder(enc_hook=_to_builtin)
+            dec = msgspec.json.Decoder()
+            self._dumps = enc.encode
+            self._dumps_pretty = lambda o: msgspec.json.format(enc.encode(o), indent=2)
+            self.loads = dec.decode
+        else:
+            self._dumps = lambda o: json.dumps(o, ensure_ascii=False, separators=(",", ":"),
+                                               default=_to_builtin).encode("utf-8")
+            self._dumps_pretty = lambda o: json.dumps(o, ensure_ascii=False, indent=2,
+                                                      default=_to_builtin).encode("utf-8")
+            self.loads = json.loads
+
+    def dumps(self, obj: Any, pretty: bool = False) -> bytes:
+        return self._dumps_pretty(obj) if pretty else self._dumps(obj)
+
+    def load(self, path: str) -> Any:
+        with open(path, "rb") as f:
+            return self.loads(f.read())
+
+    def dump(self, obj: Any, path: str, pretty: bool = False) -> None:
+        with open(path, "wb") as f:
+            f.write(self.dumps(obj, pretty))
+
+    def iter_jsonl(self, path: str) -> Iterator[Any]:
+        with open(path, "rb") as f:
+            for line in f:
+                if line.strip():
+                    yield self.loads(line)
+
+    def write_jsonl(self, rows: Iterable[Dict[str, Any]], path: str) -> int:
+        n = 0
+        with open(path, "wb") as f:
+            for r in rows:
+                f.write(self._dumps(r) + b"\n")
+                n += 1
+        return n
+
+
+def get_backend(name: Optional[str] = None) -> Backend:
+    return Backend(name or available_backends()[0])
+
+
+_default = get_backend()
+BACKEND = _default.name
+loads = _default.loads
+dumps = _default.dumps
+load = _default.load
+dump = _default.dump
+iter_jsonl = _default.iter_jsonl
+write_jsonl = _default.write_jsonl
+
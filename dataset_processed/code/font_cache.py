@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Shared font registry for the visualization scripts.
+
+- find_font_path: 每组候选字体只探测一次文件系统
+- load_font: (path, size) -> FreeTypeFont 的 LRU 缓存
+- text_width: 单词宽度记忆表，供 wrap_text 做加法估算
+"""
+import os
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from PIL import ImageFont
+
+DEFAULT_FONT_CANDIDATES: Tuple[str, ...] = (
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/freefont/FreeSans.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
+)
+FONT_CACHE_SIZE = 256       # 不同 (path, size) 组合的缓存上限
+WIDTH_CACHE_SIZE = 1 << 16  # (font, word) 宽度缓存上限
+
+
+@lru_cache(maxsize=None)
+def find_font_path(candidates: Tuple[str, ...] = DEFAULT_FONT_CANDIDATES) -> Optional[str]:
+    """First candidate that exists and loads as TrueType, or None."""
+    for path in candidates:
+        if os.path.exists(path):
+            try:
+                ImageFont.truetype(path, 10)
+                return path
+            except Exception:
+                pass
+    return None
+
+
+@lru_cache(maxsize=FONT_CACHE_SIZE)
+def load_font(path: str, size: int) -> ImageFont.FreeTypeFont:
+    return ImageFont.truetype(path, size)
+
+
+@lru_cache(maxsize=None)
+def _default_font() -> ImageFont.ImageFont:
+    return ImageFont.load_default()
+
+
+def get_font(size: int, candidates: Tuple[str, ...] = DEFAULT_FONT_CANDIDATES) -> ImageFont.ImageFont:
+    """Cached equivalent of "try each candidate, else ImageFont.load_default()"."""
+    path = find_font_path(candidates)
+    return load_font(path, size) if path else _default_font()
+
+
+@lru_cache(maxsize=WIDTH_CACHE_SIZE)
+def text_width(font: ImageFont.ImageFont, text: str) -> float:
+    """Same value as ImageDraw.textlength(text, font) on an RGB image."""
+    if isinstance(font, ImageFont.FreeTypeFont):
+        return font.getlength(text, "L")
+    return font.getlength(text)
@@ -1,12 +1,22 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import json
+from functools import lru_cache
 from pathlib import Path
 from typing import Dict, List
 
+from compact_dataset import CompactWriter, compact_path
+from image_scan import ImageScanner
+
 # Hard-coded input/output paths
 IMAGE_DIR = Path("/root/openset/dataset_eval/Test_processed")  
 OUTPUT_PATH = Path("/root/openset/llama_factory/LLaMA-Factory/data/test_rm_dataset.jsonl")
+# True: 写 compact 格式（指令模板只在文件头存一次），输出到 *.compact.jsonl；用 compact_dataset.py 展开
+COMPACT_OUTPUT = False
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff"}
+# None | "header" | "decode"：损坏 / 截断 / mode 不支持的图像打印 [BAD] 并跳过（image_scan.py）
+VALIDATE_IMAGES = "header"
+SCAN_CACHE = OUTPUT_PATH.parent / ".test_rm_image_scan.json"   # 文件未变时复用校验结果；None 关闭
 
 TAXONOMY: Dict[str, Dict] = {
     "01": {"name": "Cultivated Land", "subs": {"011": "Paddy field", "012": "Irrigated land", "013": "Dry land"}},
@@ -24,6 +34,7 @@ TAXONOMY: Dict[str, Dict] = {
 }
 
 
+@lru_cache(maxsize=None)
 def build_taxonomy_text() -> str:
     lines: List[str] = []
     for lvl1_code in sorted(TAXONOMY.keys()):
@@ -58,13 +69,36 @@ def build_instruction(image_path: str) -> str:
 
 
 def list_images(img_dir: Path) -> List[Path]:
-    return [p for p in sorted(img_dir.iterdir()) if p.is_file() and p.suffix.lower() in {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff"}]
+    scanner = ImageScanner(VALIDATE_IMAGES, str(SCAN_CACHE) if SCAN_CACHE else None)
+    found = scanner.scan_dirs([str(img_dir)], IMAGE_EXTS)[str(img_dir)]
+    scanner.save_cache()
+    if scanner.bad:
+        print(f"[WARN] Skipped {len(scanner.bad)} unreadable images in {img_dir}")
+    return [Path(r["path"]) for r in found]
+
+def write_compact(images: List[Path], out_path: str) -> None:
+    templates = {
+        "instruction": build_instruction("{image_path}"),
+        "input": "The image path is: {image_path}",
+    }
+    with CompactWriter(out_path, templates, ensure_ascii=True) as w:
+        for p in images:
+            abs_path = str(p.resolve())
+            w.write({"instruction": w.ref("instruction"), "input": w.ref("input"), "output": "", "images": [abs_path]},
+                    {"image_path": abs_path})
+
 
 def main():
     IMAGE_DIR.mkdir(parents=True, exist_ok=True)
     OUTPUT_PATH.parent.mkdir(parents=True, exist_ok=True)
     images = list_images(IMAGE_DIR)
 
+    if COMPACT_OUTPUT:
+        out_path = compact_path(str(OUTPUT_PATH))
+        write_compact(images, out_path)
+        print(f"[OK] Generated {len(images)} compact samples at {out_path}")
+        return
+
     with OUTPUT_PATH.open("w", encoding="utf-8") as f:
         for p in images:
             abs_path = str(p.resolve())
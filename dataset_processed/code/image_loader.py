@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Shared RGB image loading for the visualization scripts.
+
+- 给定目标尺寸时，JPEG 走 draft 模式（DCT 缩放 1/2、1/4、1/8 解码），解码结果不小于目标尺寸，
+  再由调用方做最终重采样；TIFF / PNG 等格式不支持，照常全尺寸解码
+- 进程内小型 LRU：同一张图以多种样式渲染时只解码一次（命中时返回副本，调用方可随意修改）；
+  每张图只读一次的批量脚本传 cache=False，不占缓存内存、也不复制
+- 返回值同时给出原始尺寸，布局/坐标映射应以原始尺寸为准
+- image_shards 引用（"<SHARD_DIR>#<条目号>"）直接从预处理分片读取（已缩放，原始尺寸取自索引）
+"""
+import os
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from PIL import Image
+
+from image_shards import load_ref, parse_ref
+
+IMAGE_CACHE_ENTRIES = 4   # LRU 容量（张）；0 关闭缓存
+
+_cache: "OrderedDict[Tuple, Tuple[Image.Image, Tuple[int, int]]]" = OrderedDict()
+
+
+def _file_key(path: str) -> Tuple[str, int, int]:
+    st = os.stat(path)
+    return os.path.abspath(path), st.st_mtime_ns, st.st_size
+
+
+def _cache_get(key: Tuple) -> Optional[Tuple[Image.Image, Tuple[int, int]]]:
+    hit = _cache.get(key)
+    if hit is not None:
+        _cache.move_to_end(key)
+    return hit
+
+
+def _cache_put(key: Tuple, value: Tuple[Image.Image, Tuple[int, int]]) -> None:
+    if IMAGE_CACHE_ENTRIES <= 0:
+        return
+    _cache[key] = value
+    _cache.move_to_end(key)
+    while len(_cache) > IMAGE_CACHE_ENTRIES:
+        _cache.popitem(last=False)
+
+
+def _resolve_target(
+    orig: Tuple[int, int],
+    target_size: Optional[Tuple[int, int]],
+    scale: Optional[float],
+    max_side: Optional[int],
+) -> Optional[Tuple[int, int]]:
+    W, H = orig
+    if scale is not None:
+        return max(1, int(W * scale)), max(1, int(H * scale))
+    if max_side is not None:
+        if max(W, H) <= max_side:
+            return None
+        s = max_side / float(max(W, H))
+        return max(1, int(round(W * s))), max(1, int(round(H * s)))
+    return target_size
+
+
+def load_rgb(
+    path: str,
+    target_size: Optional[Tuple[int, int]] = None,
+    scale: Optional[float] = None,
+    max_side: Optional[int] = None,
+    cache: bool = True,
+) -> Tuple[Image.Image, Tuple[int, int]]:
+    """
+    Returns (RGB image, original (W, H)). The target is target_size, or scale times the
+    original size, or the original scaled so its longer side is max_side. With a target a
+    JPEG may come back reduced by a power of two, never smaller than the target.
+    cache=False bypasses the LRU and returns the decode itself (no copy).
+    """
+    if parse_ref(path) is not None:
+        return load_ref(path)                 # 只读内存映射上的图像，修改时 PIL 自动复制
+    use_cache = cache and IMAGE_CACHE_ENTRIES > 0
+    if use_cache:
+        fkey = _file_key(path)
+        hit = _cache_get((fkey, None))        # 全尺寸解码结果满足任何目标
+        if hit is not None:
+            return hit[0].copy(), hit[1]
+
+    with Image.open(path) as im:
+        orig = im.size
+        target = _resolve_target(orig, target_size, scale, max_side)
+        if target is not None:
+            if use_cache:
+                hit = _cache_get((fkey, target))
+                if hit is not None:
+                    return hit[0].copy(), hit[1]
+            if im.format == "JPEG":
+                im.draft("RGB", target)
+        img = im.convert("RGB")
+
+    if not use_cache:
+        return img, orig
+    _cache_put((fkey, None if img.size == orig else target), (img, orig))
+    return img.copy(), orig
+
+
+def clear_image_cache() -> None:
+    _cache.clear()
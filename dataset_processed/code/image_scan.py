@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel image listing + validation shared by generate_test_json.py and the AID scripts.
+
+- 目录枚举：os.scandir（一次调用拿到文件类型与 stat），多个目录在线程池中并行
+- 校验（进程池）：
+  "header" —— 只读文件头得到宽高 / mode / 格式；JPEG 检查 EOI 标记、PNG 检查 IEND，缺失时再完整解码确认是否截断
+  "decode" —— 完整解码每张图
+  None     —— 不打开图像（宽高为 None）
+- 结果缓存：path -> (size, mtime_ns, 校验级别, width, height, mode, format, error)，文件未变时不再打开
+- 损坏 / 不支持的图像打印 [BAD] 并从结果中排除
+- 超大图像：探测时不受 PIL 解压炸弹上限影响（只读文件头，不完整解码），像素数超过调用方 max_pixels 的图像
+  打印 [SKIP] 记入 too_large 并排除；max_pixels=None 时保留（大幅场景影像由 tile_scenes 窗口读取）
+"""
+import contextlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from PIL import Image
+
+CACHE_VERSION = 2            # 2：超大图像不再记为错误
+IO_WORKERS = 16              # scandir / stat 线程数
+VALIDATE_WORKERS = None      # 校验进程数；None -> os.cpu_count()
+VALIDATE_CHUNK = 64
+TAIL_BYTES = 64
+# convert("RGB") 能正确处理的 mode；16 位 / 浮点（"I;16" / "I" / "F"）会被截断，视为不支持
+ALLOWED_MODES = {"1", "L", "LA", "P", "PA", "RGB", "RGBA", "RGBX", "CMYK", "YCbCr"}
+
+# PIL 的 Image.open 对超过 2 * MAX_IMAGE_PIXELS 的图像抛 DecompressionBombError；默认沿用同一上限
+MAX_PIXELS: Optional[int] = 2 * Image.MAX_IMAGE_PIXELS if Image.MAX_IMAGE_PIXELS else None
+
+_LEVELS = {None: 0, "header": 1, "decode": 2}
+
+
+@contextlib.contextmanager
+def pixel_limit(max_pixels: Optional[int]) -> Iterator[None]:
+    """Temporarily set PIL's decompression-bomb limit (Image.MAX_IMAGE_PIXELS; None disables the check)."""
+    old = Image.MAX_IMAGE_PIXELS
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    try:
+        yield
+    finally:
+        Image.MAX_IMAGE_PIXELS = old
+
+
+def _tail_ok(path: str, fmt: Optional[str]) -> bool:
+    if fmt not in ("JPEG", "MPO", "PNG"):
+        return True
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - TAIL_BYTES))
+        tail = f.read().rstrip(b"\x00\r\n ")
+    if fmt == "PNG":
+        return b"IEND" in tail
+    return tail.endswith(b"\xff\xd9")
+
+
+def probe_image(path: str, validate: Optional[str] = "header") -> Dict[str, Any]:
+    """{"width", "height", "mode", "format", "error"}; error is None for a usable image."""
+    info: Dict[str, Any] = {"width": None, "height": None, "mode": None, "format": None, "error": None}
+    if validate is None:
+        return info
+    try:
+        with pixel_limit(None), Image.open(path) as im:
+            info.update(width=im.width, height=im.height, mode=im.mode, format=im.format)
+            # 文件尾缺少结束标记时才完整解码（部分正常 JPEG 在 EOI 后有填充数据）；超大图像只读文件头
+            huge = MAX_PIXELS is not None and im.width * im.height > MAX_PIXELS
+            if not huge and (validate == "decode" or not _tail_ok(path, im.format)):
+                im.load()
+        if not (info["width"] and info["height"]):
+            info["error"] = f"invalid size {info['width']}x{info['height']}"
+        elif info["mode"] not in ALLOWED_MODES:
+            info["error"] = f"unsupported mode {info['mode']}"
+    except Exception as e:
+        info["error"] = f"{type(e).__name__}: {e}"
+    return info
+
+
+def _probe_many(paths: List[str], validate: Optional[str]) -> List[Dict[str, Any]]:
+    return [probe_image(p, validate) for p in paths]
+
+
+def _scandir(dir_path: str, exts: Optional[Iterable[str]]) -> List[Tuple[str, int, int]]:
+    """(path, size, mtime_ns) of the regular files in one directory, sorted by name."""
+    exts = {e.lower() for e in exts} if exts else None
+    out = []
+    try:
+        with os.scandir(dir_path) as it:
+            for e in it:
+                if exts is not None and os.path.splitext(e.name)[1].lower() not in exts:
+                    continue
+                if e.is_file():
+                    st = e.stat()
+                    out.append((e.path, st.st_size, st.st_mtime_ns))
+    except FileNotFoundError:
+        return []
+    out.sort(key=lambda t: os.path.basename(t[0]))
+    return out
+
+
+def _stat(path: str) -> Optional[Tuple[str, int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (path, st.st_size, st.st_mtime_ns) if os.path.isfile(path) else None
+
+
+class ImageScanner:
+    def __init__(self, validate: Optional[str] = "header", cache_path: Optional[str] = None,
+                 io_workers: int = IO_WORKERS, validate_workers: Optional[int] = VALIDATE_WORKERS,
+                 max_pixels: Optional[int] = MAX_PIXELS):
+        if validate not in _LEVELS:
+            raise ValueError(f"validate must be one of {list(_LEVELS)}")
+        self.validate = validate
+        self.cache_path = cache_path
+        self.io_workers = io_workers
+        self.validate_workers = validate_workers or os.cpu_count() or 1
+        self.max_pixels = max_pixels
+        self.cache: Dict[str, List[Any]] = self._load_cache()
+        self.bad: List[Dict[str, Any]] = []
+        self.too_large: List[Dict[str, Any]] = []
+
+    def _load_cache(self) -> Dict[str, List[Any]]:
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data.get("entries", {}) if data.get("version") == CACHE_VERSION else {}
+        except (OSError, ValueError) as e:
+            print(f"[WARN] Ignoring unreadable image scan cache {self.cache_path}: {e}")
+            return {}
+
+    def save_cache(self) -> None:
+        if not self.cache_path:
+            return
+        os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+        tmp = self.cache_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": CACHE_VERSION, "entries": self.cache}, f, ensure_ascii=False)
+        os.replace(tmp, self.cache_path)
+
+    def _resolve(self, files: List[Tuple[str, int, int]]) -> List[Dict[str, Any]]:
+        """Validate files not covered by the cache; returns the good records, collects bad ones in self.bad."""
+        level = _LEVELS[self.validate]
+        todo = [p for p, size, mtime in files
+                if (c := self.cache.get(p)) is None or c[0] != size or c[1] != mtime or c[2] < level]
+        if todo:
+            chunks = [todo[i:i + VALIDATE_CHUNK] for i in range(0, len(todo), VALIDATE_CHUNK)]
+            if self.validate is None or self.validate_workers <= 1 or len(chunks) == 1:
+                results = [_probe_many(c, self.validate) for c in chunks]
+            else:
+                with ProcessPoolExecutor(max_workers=self.validate_workers) as ex:
+                    results = list(ex.map(_probe_many, chunks, [self.validate] * len(chunks)))
+            sig = {p: (size, mtime) for p, size, mtime in files}
+            for p, info in zip(todo, (i for r in results for i in r)):
+                self.cache[p] = [*sig[p], level, info["width"], info["height"], info["mode"], info["format"], info["error"]]
+
+        good = []
+        for p, size, mtime in files:
+            _, _, _, w, h, mode, fmt, err = self.cache[p]
+            rec = {"path": p, "size": size, "mtime_ns": mtime, "width": w, "height": h, "mode": mode, "format": fmt}
+            if err:
+                rec["error"] = err
+                self.bad.append(rec)
+                print(f"[BAD] {p}: {err}")
+            elif self.max_pixels is not None and w and h and w * h > self.max_pixels:
+                self.too_large.append(rec)
+                print(f"[SKIP] {p}: {w}x{h} exceeds max_pixels={self.max_pixels}")
+            else:
+                good.append(rec)
+        return good
+
+    def scan_dirs(self, dirs: List[str], exts: Optional[Iterable[str]] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """dir -> good image records (name order); directories are listed in parallel."""
+        with ThreadPoolExecutor(max_workers=max(1, self.io_workers)) as ex:
+            listed = list(ex.map(lambda d: _scandir(d, exts), dirs))
+        flat = self._resolve([t for files in listed for t in files])
+        by_path = {r["path"]: r for r in flat}
+        return {d: [by_path[p] for p, _, _ in files if p in by_path] for d, files in zip(dirs, listed)}
+
+    def check_files(self, paths: List[str]) -> Dict[str, Dict[str, Any]]:
+        """path -> good image record for existing, valid files (stat in parallel); missing files are skipped."""
+        with ThreadPoolExecutor(max_workers=max(1, self.io_workers)) as ex:
+            stats = [s for s in ex.map(_stat, paths) if s is not None]
+        missing = len(paths) - len(stats)
+        if missing:
+            print(f"[WARN] {missing} listed files do not exist")
+        return {r["path"]: r for r in self._resolve(stats)}
+
+
+def scan_images(
+    dirs: List[str], exts: Optional[Iterable[str]] = None, validate: Optional[str] = "header",
+    cache_path: Optional[str] = None, max_pixels: Optional[int] = MAX_PIXELS,
+) -> Tuple[Dict[str, List[Dict[str, Any]]], List[Dict[str, Any]]]:
+    """One-shot helper: (dir -> good records, bad records); the cache is saved afterwards."""
+    scanner = ImageScanner(validate, cache_path, max_pixels=max_pixels)
+    result = scanner.scan_dirs(dirs, exts)
+    scanner.save_cache()
+    return result, scanner.bad
@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Precomputed image preprocessing cache: every image referenced by the Alpaca datasets (process_json /
+generate_test_json / AID generate_json, plain or compact JSONL) is decoded and resized to the model's pixel
+budget once, stored as raw RGB uint8 in memory-mappable shards, and the datasets are rewritten to reference it.
+
+- 尺寸：与 LLaMA-Factory 的 image_max_pixels / image_min_pixels 预处理一致（等比缩放，int 截断）；
+  PIXEL_FACTOR 设为 28 等时改用 Qwen2-VL smart_resize（边长取整到倍数），直接得到处理器的输入尺寸
+- 存储（SHARD_DIR）：
+    shard-00000.u8 ...  连续的 HxWx3 uint8 像素，单个分片不超过 SHARD_BYTES
+    index.npy           每个条目 (shard, offset, height, width, src_height, src_width)；height=0 表示解码失败
+    manifest.json       尺寸配置 + 每个条目的来源 (path, size, mtime_ns)，最后写入（中断的运行不会留下半个索引）
+- 增量：配置相同时，来源文件未变的条目直接复用，新增 / 修改过的图像写入新分片（旧分片只读、不改写）
+- 并行：宽高来自 image_scan 的文件头校验（带缓存），据此预先分配偏移；进程池各自解码 + 缩放，
+  直接写入分片文件的对应位置，像素不经过进程间传输。默认全尺寸解码后缩放（与 LLaMA-Factory 像素一致）；
+  JPEG_DRAFT=True 时让 JPEG 在解码阶段按 2 的幂缩小，更快但像素与 LLaMA-Factory 略有不同
+- 重写：<name>.jsonl -> <name>.shards.jsonl，images 原样保留（LLaMA-Factory / vllm_infer 照常读取原图），
+  对应的 "<SHARD_DIR>#<条目号>" 引用写在 image_refs（与 images 等长，未能预处理的图保留原路径）；
+  compact 表头原样保留。image_refs 只供本仓库使用：async_infer 优先发送 image_refs（row_images），
+  image_loader.load_rgb / prediction_cache 可直接读取引用，自定义训练加载器用 open_store(dir).array(i) 得到零拷贝的 HxWx3 视图
+"""
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+import fast_json
+from image_scan import ImageScanner
+
+# -------------------- Hard-coded paths --------------------
+INPUT_JSONLS = [
+    "/root/openset/llama_factory/LLaMA-Factory/data/rs_open_tag_infer_new.jsonl",   # process_json.py
+    "/root/openset/llama_factory/LLaMA-Factory/data/test_rm_dataset.jsonl",         # generate_test_json.py
+    "/root/openset/llama_factory/LLaMA-Factory/data/0909AID_dataset.jsonl",         # AID generate_json.py
+]
+SHARD_DIR = "/root/openset/cache/image_shards/max768"
+
+# -------------------- Resize config --------------------
+MAX_PIXELS = 768 * 768        # LLaMA-Factory image_max_pixels 默认值
+MIN_PIXELS = 32 * 32          # LLaMA-Factory image_min_pixels 默认值
+PIXEL_FACTOR: Optional[int] = None   # None -> LLaMA-Factory 等比缩放；28 -> Qwen2-VL smart_resize
+RESAMPLE = "bicubic"
+JPEG_DRAFT = False            # True -> JPEG 用 draft 在解码时缩小（更快，像素与 LLaMA-Factory 不完全一致）
+
+SHARD_BYTES = 1 << 30
+WORKERS = None                # 进程数；None -> os.cpu_count()，1 -> 串行
+CHUNK = 16                    # 每个任务的图像数
+VALIDATE_IMAGES = "header"    # 传给 image_scan：得到宽高并排除损坏图像
+SCAN_CACHE = os.path.join(SHARD_DIR, ".image_scan_cache.json")
+
+MANIFEST_VERSION = 1
+INDEX_NAME = "index.npy"
+MANIFEST_NAME = "manifest.json"
+REF_SEP = "#"
+REFS_FIELD = "image_refs"
+INDEX_DTYPE = np.dtype([("shard", "<i4"), ("offset", "<i8"), ("height", "<i4"), ("width", "<i4"),
+                        ("src_height", "<i4"), ("src_width", "<i4")])
+
+_RESAMPLE = {"nearest": Image.NEAREST, "bilinear": Image.BILINEAR, "bicubic": Image.BICUBIC,
+             "lanczos": Image.LANCZOS}
+
+
+def shard_name(i: int) -> str:
+    return f"shard-{i:05d}.u8"
+
+
+def shards_path(path: str) -> str:
+    """'x/data.jsonl' -> 'x/data.shards.jsonl'"""
+    base, ext = os.path.splitext(path)
+    return f"{base}.shards{ext or '.jsonl'}"
+
+
+def config() -> Dict[str, Any]:
+    return {"max_pixels": MAX_PIXELS, "min_pixels": MIN_PIXELS, "pixel_factor": PIXEL_FACTOR,
+            "resample": RESAMPLE, "jpeg_draft": JPEG_DRAFT, "mode": "RGB"}
+
+
+def target_size(width: int, height: int) -> Tuple[int, int]:
+    """(width, height) after preprocessing with the current config."""
+    if PIXEL_FACTOR:
+        f = PIXEL_FACTOR
+        h = max(f, round(height / f) * f)
+        w = max(f, round(width / f) * f)
+        if h * w > MAX_PIXELS:
+            beta = math.sqrt(height * width / MAX_PIXELS)
+            h = max(f, math.floor(height / beta / f) * f)
+            w = max(f, math.floor(width / beta / f) * f)
+        elif h * w < MIN_PIXELS:
+            beta = math.sqrt(MIN_PIXELS / (height * width))
+            h = math.ceil(height * beta / f) * f
+            w = math.ceil(width * beta / f) * f
+        return w, h
+    if width * height > MAX_PIXELS:
+        s = math.sqrt(MAX_PIXELS / (width * height))
+        width, height = int(width * s), int(height * s)
+    if width * height < MIN_PIXELS:
+        s = math.sqrt(MIN_PIXELS / (width * height))
+        width, height = int(width * s), int(height * s)
+    return max(1, width), max(1, height)
+
+
+# -------------------- References / reading --------------------
+def make_ref(shard_dir: str, entry: int) -> str:
+    return f"{shard_dir}{REF_SEP}{entry}"
+
+
+def parse_ref(ref: str) -> Optional[Tuple[str, int]]:
+    """(shard dir, entry) for a "<dir>#<entry>" reference, None for an ordinary path."""
+    head, sep, tail = ref.rpartition(REF_SEP)
+    if not sep or not tail.isdigit():
+        return None
+    if head in _stores or os.path.isfile(os.path.join(head, INDEX_NAME)):
+        return head, int(tail)
+    return None
+
+
+class ShardStore:
+    """Read side: entries are zero-copy views into read-only memory maps of the shard files."""
+
+    def __init__(self, shard_dir: str):
+        self.shard_dir = shard_dir
+        self.index_path = os.path.join(shard_dir, INDEX_NAME)
+        self.index = np.load(self.index_path)
+        self._maps: Dict[int, np.memmap] = {}
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def _map(self, shard: int) -> np.memmap:
+        mm = self._maps.get(shard)
+        if mm is None:
+            mm = self._maps[shard] = np.memmap(os.path.join(self.shard_dir, shard_name(shard)), dtype=np.uint8,
+                                               mode="r")
+        return mm
+
+    def array(self, entry: int) -> np.ndarray:
+        rec = self.index[entry]
+        h, w = int(rec["height"]), int(rec["width"])
+        if h == 0:
+            raise OSError(f"Entry {entry} of {self.shard_dir} failed to preprocess")
+        off = int(rec["offset"])
+        return self._map(int(rec["shard"]))[off:off + h * w * 3].reshape(h, w, 3)
+
+    def image(self, entry: int) -> Image.Image:
+        return Image.fromarray(self.array(entry))
+
+    def source_size(self, entry: int) -> Tuple[int, int]:
+        rec = self.index[entry]
+        return int(rec["src_width"]), int(rec["src_height"])
+
+
+_stores: Dict[str, ShardStore] = {}
+
+
+def open_store(shard_dir: str) -> ShardStore:
+    """Per-process ShardStore for shard_dir (opened once)."""
+    store = _stores.get(shard_dir)
+    if store is None:
+        store = _stores[shard_dir] = ShardStore(shard_dir)
+    return store
+
+
+def load_ref(ref: str) -> Tuple[Image.Image, Tuple[int, int]]:
+    """(preprocessed RGB image, original (W, H)) for a shard reference."""
+    shard_dir, entry = parse_ref(ref)
+    store = open_store(shard_dir)
+    return store.image(entry), store.source_size(entry)
+
+
+def row_images(row: Dict[str, Any]) -> List[str]:
+    """Images to read for a dataset row: image_refs for rewritten rows, else images."""
+    return list(row.get(REFS_FIELD) or row.get("images") or [])
+
+
+# -------------------- Building --------------------
+def _preprocess_many(jobs: List[Tuple[str, str, int, int, int]]) -> List[Optional[str]]:
+    """Decode + resize each (path, shard file, offset, width, height) into place; returns per-job errors."""
+    errors: List[Optional[str]] = []
+    files: Dict[str, Any] = {}
+    try:
+        for path, shard_path, offset, w, h in jobs:
+            try:
+                with Image.open(path) as im:
+                    if JPEG_DRAFT and im.format == "JPEG":
+                        im.draft("RGB", (w, h))
+                    img = im.convert("RGB")
+                if img.size != (w, h):
+                    img = img.resize((w, h), _RESAMPLE[RESAMPLE])
+                f = files.get(shard_path)
+                if f is None:
+                    f = files[shard_path] = open(shard_path, "r+b")
+                f.seek(offset)
+                f.write(img.tobytes())
+                errors.append(None)
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {e}")
+    finally:
+        for f in files.values():
+            f.close()
+    return errors
+
+
+class ShardBuilder:
+    def __init__(self, shard_dir: str = SHARD_DIR, workers: Optional[int] = WORKERS):
+        self.shard_dir = shard_dir
+        self.workers = workers or os.cpu_count() or 1
+        self.index = np.zeros(0, dtype=INDEX_DTYPE)
+        self.sources: List[List[Any]] = []
+        self.num_shards = 0
+        self._load()
+
+    def _load(self) -> None:
+        manifest_path = os.path.join(self.shard_dir, MANIFEST_NAME)
+        if not os.path.exists(manifest_path):
+            return
+        manifest = fast_json.load(manifest_path)
+        if manifest.get("version") != MANIFEST_VERSION or manifest.get("config") != config():
+            raise ValueError(f"{self.shard_dir} was built with {manifest.get('config')}, current config is "
+                             f"{config()}; use a different SHARD_DIR")
+        self.index = np.load(os.path.join(self.shard_dir, INDEX_NAME))
+        self.sources = manifest["sources"]
+        self.num_shards = manifest["shards"]
+
+    def build(self, paths: List[str]) -> Dict[str, str]:
+        """path -> shard reference for every usable image in paths (existing entries are reused)."""
+        os.makedirs(self.shard_dir, exist_ok=True)
+        scanner = ImageScanner(VALIDATE_IMAGES, SCAN_CACHE)
+        records = scanner.check_files(paths)
+        scanner.save_cache()
+
+        known = {src[0]: i for i, src in enumerate(self.sources) if self.index[i]["height"] > 0}
+        refs: Dict[str, str] = {}
+        todo = []
+        for p in paths:
+            rec = records.get(p)
+            if rec is None:
+                continue
+            i = known.get(p)
+            if i is not None and self.sources[i][1:] == [rec["size"], rec["mtime_ns"]]:
+                refs[p] = make_ref(self.shard_dir, i)
+            else:
+                todo.append(rec)
+        print(f"[INFO] {len(refs)} images reused, {len(todo)} to preprocess, "
+              f"{len(paths) - len(records)} missing / bad")
+        if todo:
+            refs.update(self._append(todo))
+        return refs
+
+    def _append(self, records: List[Dict[str, Any]]) -> Dict[str, str]:
+        entries = np.zeros(len(records), dtype=INDEX_DTYPE)
+        shard, offset = self.num_shards, 0
+        sizes: Dict[int, int] = {}
+        for e, rec in zip(entries, records):
+            w, h = target_size(rec["width"], rec["height"])
+            n = w * h * 3
+            if offset and offset + n > SHARD_BYTES:
+                sizes[shard] = offset
+                shard, offset = shard + 1, 0
+            e["shard"], e["offset"], e["width"], e["height"] = shard, offset, w, h
+            e["src_width"], e["src_height"] = rec["width"], rec["height"]
+            offset += n
+        sizes[shard] = offset
+        for s, size in sizes.items():
+            with open(os.path.join(self.shard_dir, shard_name(s)), "wb") as f:
+                f.truncate(size)
+
+        jobs = [(rec["path"], os.path.join(self.shard_dir, shard_name(int(e["shard"]))), int(e["offset"]),
+                 int(e["width"]), int(e["height"])) for e, rec in zip(entries, records)]
+        chunks = [jobs[i:i + CHUNK] for i in range(0, len(jobs), CHUNK)]
+        t0 = time.perf_counter()
+        if self.workers <= 1 or len(chunks) == 1:
+            results = [_preprocess_many(c) for c in chunks]
+        else:
+            with ProcessPoolExecutor(max_workers=self.workers) as ex:
+                results = list(ex.map(_preprocess_many, chunks))
+        errors = [err for r in results for err in r]
+        for e, rec, err in zip(entries, records, errors):
+            if err:
+                e["height"] = e["width"] = 0
+                print(f"[BAD] {rec['path']}: {err}")
+        total = sum(sizes.values())
+        print(f"[TIME] Preprocessed {len(jobs)} images into {len(sizes)} shard(s), {total / 1e9:.2f} GB "
+              f"in {time.perf_counter() - t0:.1f}s")
+
+        base = len(self.index)
+        self.index = np.concatenate([self.index, entries])
+        self.sources.extend([rec["path"], rec["size"], rec["mtime_ns"]] for rec in records)
+        self.num_shards = shard + 1
+        self._save()
+        return {rec["path"]: make_ref(self.shard_dir, base + i)
+                for i, (rec, err) in enumerate(zip(records, errors)) if not err}
+
+    def _save(self) -> None:
+        index_path = os.path.join(self.shard_dir, INDEX_NAME)
+        with open(index_path + ".tmp", "wb") as f:
+            np.save(f, self.index)
+        os.replace(index_path + ".tmp", index_path)
+        manifest_path = os.path.join(self.shard_dir, MANIFEST_NAME)
+        fast_json.dump({"version": MANIFEST_VERSION, "config": config(), "shards": self.num_shards,
+                        "sources": self.sources}, manifest_path + ".tmp")
+        os.replace(manifest_path + ".tmp", manifest_path)
+        _stores.pop(self.shard_dir, None)
+
+
+# -------------------- Dataset rewrite --------------------
+def collect_images(paths: List[str]) -> List[str]:
+    """Unique image paths of the datasets, in first-seen order."""
+    seen: Dict[str, None] = {}
+    for path in paths:
+        for row in fast_json.iter_jsonl(path):
+            for p in row.get("images") or []:
+                seen.setdefault(p, None)
+    return list(seen)
+
+
+def rewrite_jsonl(src: str, dst: str, refs: Dict[str, str]) -> Tuple[int, int]:
+    """Copy src to dst adding image_refs (shard references) next to images; returns (rows, rows fully replaced)."""
+    rows = replaced = 0
+    tmp = dst + ".tmp"
+    with open(tmp, "wb") as out:
+        for row in fast_json.iter_jsonl(src):
+            images = row.get("images")
+            if images:
+                rows += 1
+                new = [refs.get(p, p) for p in images]
+                if new != images:
+                    row[REFS_FIELD] = new
+                replaced += all(p in refs for p in images)
+            out.write(fast_json.dumps(row) + b"\n")
+    os.replace(tmp, dst)
+    return rows, replaced
+
+
+def main():
+    inputs = [p for p in INPUT_JSONLS if os.path.exists(p)]
+    for p in INPUT_JSONLS:
+        if p not in inputs:
+            print(f"[SKIP] Dataset not found: {p}")
+    if not inputs:
+        raise FileNotFoundError("None of INPUT_JSONLS exists")
+    images = collect_images(inputs)
+    print(f"[LOAD] {len(images)} unique images in {len(inputs)} dataset(s)")
+
+    refs = ShardBuilder(SHARD_DIR, WORKERS).build(images)
+    for src in inputs:
+        dst = shards_path(src)
+        rows, replaced = rewrite_jsonl(src, dst, refs)
+        if replaced < rows:
+            print(f"[WARN] {rows - replaced} rows of {src} keep original paths in {REFS_FIELD} (missing / unreadable)")
+        print(f"[SAVE] {dst}: {replaced}/{rows} rows reference {SHARD_DIR}")
+
+
+if __name__ == "__main__":
+    main()
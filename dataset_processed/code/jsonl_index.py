@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Sidecar byte-offset index for large JSONL files (generated_predictions.jsonl, rs_open_tag_infer_new.jsonl, ...).
+
+<file>.idx 为定长头 + 三个 little-endian uint64 数组，可直接 np.memmap：
+- offsets[n_rows + 1]：每个物理行的起始字节（含空行），行号 = 0 起的物理行序号
+- key_hash / key_row：图像路径及其 basename 的 64-bit 哈希（升序）与所在行号；哈希冲突在读取行后校验
+头部记录源文件 (size, mtime_ns) 与 key_fn 标识（限定名 + KEY_VERSION），任一不一致时视为过期并重建。
+用途：按行号 / 图像路径 O(1) 定位读取、随机抽样、按字节均衡切分为连续行区间供多进程处理。
+"""
+import hashlib
+import os
+import random
+import re
+import struct
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+import fast_json
+
+INDEX_SUFFIX = ".idx"
+INDEX_MAGIC = b"JSONLIDX"
+INDEX_VERSION = 1
+_HEADER = struct.Struct("<8sIIqqqq")     # magic, version, key_fn id, size, mtime_ns, n_rows, n_keys
+HEADER_SIZE = 64
+KEY_VERSION = 1                          # image_key 的取键逻辑变化时递增，使旧索引失效
+
+IMAGE_PATH_REGEXES = [
+    re.compile(r'"path"\s*:\s*"([^"]+)"'),                                       # process_json 的 image_meta.path
+    re.compile(r"(/[^\s\"'()]+\.(?:png|jpg|jpeg|bmp|gif|tif|tiff))", re.IGNORECASE),
+]
+
+
+def image_key(row: Dict[str, Any]) -> Optional[str]:
+    """Image path of a dataset / prediction row: images[0], image / path / file_path, else a path in the prompt."""
+    images = row.get("images")
+    if images and isinstance(images[0], str):
+        return images[0]
+    for k in ("image", "path", "file_path"):
+        if isinstance(row.get(k), str):
+            return row[k]
+    for k in ("prompt", "input", "predict"):
+        text = row.get(k)
+        if isinstance(text, str):
+            for pat in IMAGE_PATH_REGEXES:
+                m = pat.search(text)
+                if m:
+                    return m.group(1)
+    return None
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def key_fn_id(key_fn: Callable[[Dict[str, Any]], Optional[str]]) -> int:
+    """32-bit id of key_fn for the index header (qualified name + KEY_VERSION; module-independent so
+    `python jsonl_index.py` and importers agree)."""
+    name = f"{getattr(key_fn, '__qualname__', repr(key_fn))}:{KEY_VERSION}"
+    return int.from_bytes(hashlib.blake2b(name.encode("utf-8"), digest_size=4).digest(), "little")
+
+
+def index_path_for(path: str) -> str:
+    return path + INDEX_SUFFIX
+
+
+class JsonlIndex:
+    def __init__(self, path: str, offsets: np.ndarray, key_hash: np.ndarray, key_row: np.ndarray,
+                 key_fn: Callable[[Dict[str, Any]], Optional[str]] = image_key):
+        self.path = path
+        self.offsets = offsets
+        self.key_hash = key_hash
+        self.key_row = key_row
+        self.key_fn = key_fn
+        self._f = None
+
+    # ---- build / load ----
+    @classmethod
+    def build(cls, path: str, index_path: Optional[str] = None,
+              key_fn: Callable[[Dict[str, Any]], Optional[str]] = image_key) -> "JsonlIndex":
+        """One streaming pass: line offsets + image keys; the sidecar is written if possible."""
+        st = os.stat(path)
+        offsets = [0]
+        hashes: List[int] = []
+        rows: List[int] = []
+        pos = 0
+        with open(path, "rb") as f:
+            for row, line in enumerate(f):
+                pos += len(line)
+                offsets.append(pos)
+                if not line.strip():
+                    continue
+                try:
+                    obj = fast_json.loads(line)
+                except ValueError:
+                    continue
+                key = key_fn(obj) if isinstance(obj, dict) else None
+                if key:
+                    hashes.append(_hash(key))
+                    rows.append(row)
+                    base = os.path.basename(key)
+                    if base != key:
+                        hashes.append(_hash(base))
+                        rows.append(row)
+        kh = np.array(hashes, dtype=np.uint64)
+        kr = np.array(rows, dtype=np.uint64)
+        order = np.argsort(kh, kind="stable")
+        idx = cls(path, np.array(offsets, dtype=np.uint64), kh[order], kr[order], key_fn)
+
+        index_path = index_path or index_path_for(path)
+        header = _HEADER.pack(INDEX_MAGIC, INDEX_VERSION, key_fn_id(key_fn), st.st_size, st.st_mtime_ns,
+                              len(offsets) - 1, len(kh)).ljust(HEADER_SIZE, b"\0")
+        tmp = index_path + ".tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(header)
+                for a in (idx.offsets, idx.key_hash, idx.key_row):
+                    f.write(a.astype("<u8").tobytes())
+            os.replace(tmp, index_path)
+        except OSError as e:
+            print(f"[WARN] Could not write JSONL index {index_path}: {e}")
+        return idx
+
+    @classmethod
+    def load(cls, path: str, index_path: Optional[str] = None,
+             key_fn: Callable[[Dict[str, Any]], Optional[str]] = image_key) -> Optional["JsonlIndex"]:
+        """Memory-maps the sidecar; None if it is missing, malformed or stale (source size/mtime or key_fn changed)."""
+        index_path = index_path or index_path_for(path)
+        try:
+            st = os.stat(path)
+            with open(index_path, "rb") as f:
+                head = f.read(HEADER_SIZE)
+        except OSError:
+            return None
+        if len(head) < HEADER_SIZE:
+            return None
+        magic, version, fn_id, size, mtime_ns, n_rows, n_keys = _HEADER.unpack_from(head)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION or fn_id != key_fn_id(key_fn):
+            return None
+        if (size, mtime_ns) != (st.st_size, st.st_mtime_ns):
+            return None
+        if os.path.getsize(index_path) != HEADER_SIZE + 8 * (n_rows + 1 + 2 * n_keys):
+            return None
+        mm = np.memmap(index_path, dtype="<u8", mode="r", offset=HEADER_SIZE)
+        return cls(path, mm[:n_rows + 1], mm[n_rows + 1:n_rows + 1 + n_keys], mm[n_rows + 1 + n_keys:], key_fn)
+
+    @classmethod
+    def open(cls, path: str, index_path: Optional[str] = None,
+             key_fn: Callable[[Dict[str, Any]], Optional[str]] = image_key) -> "JsonlIndex":
+        idx = cls.load(path, index_path, key_fn)
+        if idx is None:
+            print(f"[INDEX] Building {index_path or index_path_for(path)} ...")
+            idx = cls.build(path, index_path, key_fn)
+        return idx
+
+    # ---- access ----
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def close(self) -> None:
+        """Closes the read handle and drops the (memory-mapped) arrays; the index is unusable afterwards."""
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+        self.offsets = self.key_hash = self.key_row = None
+
+    def __enter__(self) -> "JsonlIndex":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def line(self, row: int) -> bytes:
+        if self._f is None:
+            self._f = open(self.path, "rb")
+        a, b = int(self.offsets[row]), int(self.offsets[row + 1])
+        self._f.seek(a)
+        return self._f.read(b - a)
+
+    def record(self, row: int) -> Optional[Any]:
+        line = self.line(row)
+        return fast_json.loads(line) if line.strip() else None
+
+    def find(self, key: str) -> List[int]:
+        """Rows whose image path (or its basename) equals `key`, in file order."""
+        h = np.uint64(_hash(key))
+        lo = int(np.searchsorted(self.key_hash, h, side="left"))
+        hi = int(np.searchsorted(self.key_hash, h, side="right"))
+        out = []
+        for row in sorted(int(r) for r in self.key_row[lo:hi]):
+            k = self.key_fn(self.record(row))
+            if k == key or (k and os.path.basename(k) == key):
+                out.append(row)
+        return out
+
+    def get(self, key: str) -> Optional[Any]:
+        """Last record for `key` (later rows win, as when rendering in input order)."""
+        rows = self.find(key)
+        return self.record(rows[-1]) if rows else None
+
+    def nonempty_rows(self) -> np.ndarray:
+        lens = np.diff(self.offsets.astype(np.int64))
+        return np.flatnonzero(lens > 1)
+
+    def sample(self, k: int, seed: Optional[int] = None) -> List[int]:
+        rows = self.nonempty_rows()
+        rng = random.Random(seed)
+        return sorted(int(r) for r in rng.sample(list(rows), min(k, len(rows))))
+
+    def shard_ranges(self, num_shards: int) -> List[Tuple[int, int]]:
+        """Split rows into num_shards contiguous [start, end) ranges of roughly equal byte size."""
+        total = int(self.offsets[-1])
+        cuts = np.searchsorted(self.offsets, np.linspace(0, total, num_shards + 1).astype(np.uint64), side="left")
+        cuts = np.clip(cuts, 0, len(self))
+        cuts[0], cuts[-1] = 0, len(self)
+        return [(int(cuts[i]), int(cuts[i + 1])) for i in range(num_shards)]
+
+    def iter_range(self, start: int, end: int) -> Iterator[Tuple[int, bytes]]:
+        """(row, line) for rows [start, end) with one sequential read from the range's first byte."""
+        with open(self.path, "rb") as f:
+            f.seek(int(self.offsets[start]))
+            for row in range(start, end):
+                yield row, f.readline()
+
+    def iter_rows(self, rows: List[int]) -> Iterator[Tuple[int, bytes]]:
+        for row in rows:
+            yield row, self.line(row)
+
+
+# -------------------- CLI --------------------
+JSONL_PATH = "/root/openset/llama_factory/LLaMA-Factory/outputs/no-finetune-pixtral_test_2025-09-14/generated_predictions.jsonl"
+
+
+def main():
+    idx = JsonlIndex.build(JSONL_PATH)
+    print(f"[OK] {len(idx)} rows, {len(idx.key_hash)} image keys -> {index_path_for(JSONL_PATH)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for an OpenAI-compatible chat endpoint (POST /v1/chat/completions, GET /v1/models), stdlib asyncio only.
+
+- 返回固定模板的回答：taxonomy 提示（generate_test_json.py）-> "The image (<path>) is Level-1 category ..."，
+  可被 prediction_parser / visualize_final_test_image 解析；AID 提示 -> 1..30 的整数；其它 -> categoryNNNN。
+  类别由图像路径（取不到时用提示全文）的哈希决定，重复请求结果一致
+- 延迟：LATENCY_MS * lognormal(JITTER_SIGMA)，模拟长尾；SLOTS 个并发解码槽，超出的请求排队（类似服务端连续批处理的容量上限）
+- 故障注入：FAIL_RATE 的请求返回 503，RATE_LIMIT_RATE 的请求返回 429（带 Retry-After）
+"""
+import asyncio
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from generate_test_json import TAXONOMY
+
+HOST = "127.0.0.1"
+PORT = 8000
+MODEL = "mock-qwen2.5-vl"
+LATENCY_MS = 200.0
+JITTER_SIGMA = 0.5            # lognormal sigma；0 为固定延迟
+SLOTS = 32
+FAIL_RATE = 0.0
+RATE_LIMIT_RATE = 0.0
+RETRY_AFTER_S = 1
+SEED = 0
+
+_PATH_REGEX = re.compile(r"(/[^\s\"'()\[\]]+\.(?:png|jpg|jpeg|bmp|gif|tif|tiff|webp))", re.IGNORECASE)
+_REASONS = [
+    "The image shows regular parcels with uniform texture and clear field boundaries.",
+    "Dense canopy with rough texture and irregular shadows dominates the scene.",
+    "Man-made structures with sharp geometric outlines and road networks are visible.",
+    "Smooth dark surfaces with clear shorelines indicate open water.",
+]
+
+
+def _stable_int(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def canned_response(prompt: str) -> str:
+    m = _PATH_REGEX.search(prompt)
+    key = m.group(1) if m else prompt
+    h = _stable_int(key)
+    if "Level-1" in prompt:
+        codes = sorted(TAXONOMY)
+        c1 = codes[h % len(codes)]
+        subs = TAXONOMY[c1]["subs"]
+        c2 = sorted(subs)[(h >> 8) % len(subs)]
+        path = m.group(1) if m else "unknown.png"
+        return (f"The image ({path}) is Level-1 category {TAXONOMY[c1]['name']}. "
+                f"Specifically, it is Level-2 subclass {subs[c2]}. The reason for this classification is as follows: "
+                f"{_REASONS[(h >> 16) % len(_REASONS)]}")
+    if "[1, 30]" in prompt:
+        return str(h % 30 + 1)
+    return f"category{h % 100 + 1:04d}"
+
+
+def prompt_text(body: Dict[str, Any]) -> str:
+    parts = []
+    for msg in body.get("messages", []):
+        content = msg.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        elif isinstance(content, list):
+            parts.extend(p.get("text", "") for p in content if isinstance(p, dict) and p.get("type") == "text")
+    return "\n".join(parts)
+
+
+class MockServer:
+    def __init__(self, host: str = HOST, port: int = PORT, latency_ms: float = LATENCY_MS,
+                 jitter_sigma: float = JITTER_SIGMA, slots: int = SLOTS, fail_rate: float = FAIL_RATE,
+                 rate_limit_rate: float = RATE_LIMIT_RATE, seed: int = SEED):
+        self.host = host
+        self.port = port
+        self.latency_ms = latency_ms
+        self.jitter_sigma = jitter_sigma
+        self.slots = slots
+        self.fail_rate = fail_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.rng = random.Random(seed)
+        self.stats = {"requests": 0, "completed": 0, "failed": 0, "rate_limited": 0}
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def start(self) -> None:
+        self._sem = asyncio.Semaphore(self.slots)
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self) -> None:
+        await self.start()
+        print(f"[INFO] Mock OpenAI server on http://{self.host}:{self.port}/v1 "
+              f"(latency {self.latency_ms:.0f} ms, sigma {self.jitter_sigma}, slots {self.slots})")
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                method, path, _ = line.decode("latin-1").split(" ", 2)
+                headers: Dict[str, str] = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b"\r\n", b"\n", b""):
+                        break
+                    k, _, v = h.decode("latin-1").partition(":")
+                    headers[k.strip().lower()] = v.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0) or 0))
+                status, payload, extra = await self._route(method, path, body)
+                data = json.dumps(payload).encode("utf-8")
+                head = [f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}",
+                        "Content-Type: application/json", f"Content-Length: {len(data)}"]
+                head += [f"{k}: {v}" for k, v in extra.items()]
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + data)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method: str, path: str, body: bytes) -> Tuple[int, Dict[str, Any], Dict[str, str]]:
+        if method == "GET" and path.rstrip("/").endswith("/models"):
+            return 200, {"object": "list", "data": [{"id": MODEL, "object": "model"}]}, {}
+        if method != "POST" or not path.rstrip("/").endswith("/chat/completions"):
+            return 404, {"error": {"message": f"No route for {method} {path}"}}, {}
+        self.stats["requests"] += 1
+        r = self.rng.random()
+        if r < self.rate_limit_rate:
+            self.stats["rate_limited"] += 1
+            return 429, {"error": {"message": "rate limited"}}, {"Retry-After": str(RETRY_AFTER_S)}
+        try:
+            req = json.loads(body)
+        except ValueError:
+            return 400, {"error": {"message": "invalid JSON"}}, {}
+
+        async with self._sem:
+            delay = self.latency_ms / 1000.0
+            if self.jitter_sigma:
+                delay *= self.rng.lognormvariate(0.0, self.jitter_sigma)
+            await asyncio.sleep(delay)
+        if r < self.rate_limit_rate + self.fail_rate:
+            self.stats["failed"] += 1
+            return 503, {"error": {"message": "injected failure"}}, {}
+
+        prompt = prompt_text(req)
+        content = canned_response(prompt)
+        self.stats["completed"] += 1
+        return 200, {
+            "id": f"chatcmpl-{self.stats['requests']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": req.get("model", MODEL),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(prompt) // 3, "completion_tokens": len(content) // 3,
+                      "total_tokens": (len(prompt) + len(content)) // 3},
+        }, {}
+
+
+def start_in_thread(**kwargs: Any) -> Tuple[MockServer, threading.Thread]:
+    """Run a MockServer on its own event loop in a daemon thread (port=0 picks a free port); stop with stop_thread."""
+    server = MockServer(**kwargs)
+    ready = threading.Event()
+
+    def run() -> None:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        server.loop = loop
+        loop.run_until_complete(server.start())
+        ready.set()
+        loop.run_forever()
+        loop.run_until_complete(server.close())
+        loop.close()
+
+    t = threading.Thread(target=run, daemon=True)
+    t.start()
+    ready.wait()
+    return server, t
+
+
+def stop_thread(server: MockServer, thread: threading.Thread) -> None:
+    """Close a server started by start_in_thread and wait for its thread to exit."""
+    server.loop.call_soon_threadsafe(server.loop.stop)
+    thread.join()
+
+
+def main():
+    asyncio.run(MockServer().serve_forever())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+"""
+Merge per-tile Level-1 / Level-2 predictions (tile_scenes.py -> vllm_infer) back into scene-level land-cover maps.
+
+- 预测逐行流式读取；tile 元数据来源（JOIN）：
+  "row"    —— 与 tile_scenes.py 的提示 JSONL 按行对齐（vllm_infer 保持数据集顺序），常数内存
+  "path"   —— 按预测中的图像路径在 TILE_RECORDS_JSONL 的 .idx 索引中查找（jsonl_index.py）
+  "inline" —— 预测行自带 "tile"
+- 投票：每幅影像一个 CELL_SIZE 像素网格上的 float32 票数数组（np.memmap 落盘，LRU 只保持 MAX_OPEN_SCENES 个打开），
+  每个切片对其覆盖的格子按权重投票；WEIGHTING="center" 时权重随离切片中心的距离线性衰减，重叠区以更靠近中心的切片为准
+- Level-2 在 HIERARCHICAL=True 时只在获胜 Level-1 的子类中取最大票
+- 输出（每幅影像、每个层级）：<stem>_<level>.npy —— uint8 类别栅格（类别 ID = taxonomy 代码的整数值，0 = 无数据，
+  可 np.load(mmap_mode="r")），按行带写出；<stem>_<level>.png 彩色缩略预览；<stem>.json 元数据 / 图例 / 面积统计
+"""
+import colorsys
+import hashlib
+import os
+import shutil
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+import fast_json
+from evaluate_predictions import extract
+from generate_test_json import TAXONOMY
+from jsonl_index import JsonlIndex
+
+# -------------------- Hard-coded paths --------------------
+PREDICTIONS_JSONL = "/root/openset/llama_factory/LLaMA-Factory/outputs/scene_tiles_predict/generated_predictions.jsonl"
+TILE_PROMPTS_JSONL = "/root/openset/llama_factory/LLaMA-Factory/data/scene_tiles.jsonl"              # JOIN="row"
+TILE_RECORDS_JSONL = "/root/openset/dataset_processed/output_json/scene_tile_annotations.jsonl"      # JOIN="path"
+OUTPUT_DIR = "/root/openset/dataset_processed/scene_maps"
+
+JOIN = "row"                  # "row" | "path" | "inline"
+LEVELS = ("level1", "level2")
+CELL_SIZE = 32                # 投票网格的格子边长（像素）
+WEIGHTING = "center"          # "center" | "uniform"
+MIN_WEIGHT = 0.05             # center 权重的下限（切片边缘）
+HIERARCHICAL = True
+FULL_RESOLUTION = True        # False: 栅格按格子分辨率写出（尺寸缩小 CELL_SIZE 倍）
+BAND_ROWS = 1024              # 写全分辨率栅格时每次处理的像素行数
+PREVIEW_MAX_SIDE = 2048
+MAX_OPEN_SCENES = 8
+KEEP_VOTES = False            # True: 保留票数数组（OUTPUT_DIR/.votes），可用于调试或加权再融合
+
+NODATA = 0
+LEVEL1_CODES = sorted(TAXONOMY)
+LEVEL2_CODES = sorted(c for node in TAXONOMY.values() for c in node["subs"])
+PARENT = {c2: c1 for c1, node in TAXONOMY.items() for c2 in node["subs"]}
+CODES = {"level1": LEVEL1_CODES, "level2": LEVEL2_CODES}
+CODE_INDEX = {level: {c: i for i, c in enumerate(codes)} for level, codes in CODES.items()}
+
+
+def class_id(code: str) -> int:
+    return int(code)
+
+
+def build_palette() -> Dict[str, Tuple[int, int, int]]:
+    """Level-1 colours spread over the hue circle; Level-2 shades of the parent's hue."""
+    palette: Dict[str, Tuple[int, int, int]] = {}
+    for i, c1 in enumerate(LEVEL1_CODES):
+        hue = i / len(LEVEL1_CODES)
+        palette[c1] = tuple(int(v * 255) for v in colorsys.hsv_to_rgb(hue, 0.75, 0.9))
+        subs = sorted(TAXONOMY[c1]["subs"])
+        for j, c2 in enumerate(subs):
+            val = 0.55 + 0.45 * (j + 1) / len(subs)
+            palette[c2] = tuple(int(v * 255) for v in colorsys.hsv_to_rgb(hue, 0.35 + 0.5 * j / max(1, len(subs) - 1), val))
+    return palette
+
+
+PALETTE = build_palette()
+
+
+# -------------------- Vote accumulation --------------------
+class SceneVotes:
+    """float32 votes (rows, cols, classes) per level on the CELL_SIZE grid, memory-mapped under work_dir."""
+
+    def __init__(self, scene: str, key: str, width: int, height: int, work_dir: str):
+        self.scene = scene
+        self.key = key
+        self.width = width
+        self.height = height
+        self.rows = -(-height // CELL_SIZE)
+        self.cols = -(-width // CELL_SIZE)
+        self.paths = {level: os.path.join(work_dir, f"{key}.{level}.votes.npy") for level in LEVELS}
+        self.votes: Dict[str, np.ndarray] = {}
+        self.created = False          # 本次运行已建过数组：之后（LRU 关闭后）重新打开才沿用已有票数
+        self.tiles = 0
+        self.voted = 0
+        self.geo: Optional[Dict[str, Any]] = None
+
+    def open(self) -> None:
+        """First open in a run creates zeroed arrays (stale files from earlier runs are overwritten)."""
+        for level, path in self.paths.items():
+            if self.created:
+                self.votes[level] = np.load(path, mmap_mode="r+")
+            else:
+                self.votes[level] = np.lib.format.open_memmap(
+                    path, mode="w+", dtype=np.float32, shape=(self.rows, self.cols, len(CODES[level])))
+        self.created = True
+
+    def close(self) -> None:
+        for v in self.votes.values():
+            v.flush()
+        self.votes = {}
+
+    def weights(self, x: int, y: int, w: int, h: int, r0: int, r1: int, c0: int, c1: int) -> np.ndarray:
+        if WEIGHTING == "uniform":
+            return np.ones((r1 - r0, c1 - c0), dtype=np.float32)
+        cy = (np.arange(r0, r1) + 0.5) * CELL_SIZE
+        cx = (np.arange(c0, c1) + 0.5) * CELL_SIZE
+        wy = 1.0 - np.abs(cy - (y + h / 2.0)) / (h / 2.0)
+        wx = 1.0 - np.abs(cx - (x + w / 2.0)) / (w / 2.0)
+        return np.outer(np.clip(wy, MIN_WEIGHT, 1.0), np.clip(wx, MIN_WEIGHT, 1.0)).astype(np.float32)
+
+    def add(self, tile: Dict[str, Any], codes: Dict[str, Optional[str]]) -> None:
+        x, y, w, h = int(tile["x"]), int(tile["y"]), int(tile["width"]), int(tile["height"])
+        self.tiles += 1
+        if self.geo is None and tile.get("geo"):
+            self.geo = scene_geo(tile["geo"], x, y)
+        if not any(codes.get(level) for level in LEVELS):
+            return
+        r0, r1 = y // CELL_SIZE, min(self.rows, -(-(y + h) // CELL_SIZE))
+        c0, c1 = x // CELL_SIZE, min(self.cols, -(-(x + w) // CELL_SIZE))
+        wgt = self.weights(x, y, w, h, r0, r1, c0, c1)
+        for level in LEVELS:
+            code = codes.get(level)
+            if code is not None:
+                self.votes[level][r0:r1, c0:c1, CODE_INDEX[level][code]] += wgt
+        self.voted += 1
+
+
+def scene_geo(tile_geo: Dict[str, Any], x: int, y: int) -> Dict[str, Any]:
+    """Scene affine transform from a tile's (shifted back by the tile offset)."""
+    a, b, c, d, e, f = tile_geo["transform"]
+    return {**tile_geo, "transform": [a, b, c - a * x - b * y, d, e, f - d * x - e * y]}
+
+
+def tile_codes(codes: Dict[str, Optional[str]]) -> Dict[str, Optional[str]]:
+    """Level-1 falls back to the parent of the Level-2 prediction."""
+    c1, c2 = codes.get("level1"), codes.get("level2")
+    if c1 is None and c2 is not None:
+        c1 = PARENT[c2]
+    return {"level1": c1, "level2": c2}
+
+
+# -------------------- Streaming input --------------------
+def iter_tile_predictions() -> Iterator[Tuple[Optional[Dict[str, Any]], Dict[str, Optional[str]]]]:
+    """(tile metadata or None, {level: taxonomy code or None}) per prediction row."""
+    prompts_f = open(TILE_PROMPTS_JSONL, "rb") if JOIN == "row" else None
+    index = JsonlIndex.open(TILE_RECORDS_JSONL) if JOIN == "path" else None
+    try:
+        with open(PREDICTIONS_JSONL, "rb") as f:
+            for line in f:
+                prompt_line = next(prompts_f, None) if prompts_f is not None else None
+                if not line.strip():
+                    continue
+                try:
+                    row = fast_json.loads(line)
+                except ValueError:
+                    yield None, {}
+                    continue
+                pred, img_path = extract(row, "taxonomy")
+                if JOIN == "row":
+                    tile = fast_json.loads(prompt_line).get("tile") if prompt_line and prompt_line.strip() else None
+                elif JOIN == "path":
+                    rec = index.get(img_path) if img_path else None
+                    tile = rec.get("tile") if rec else None
+                else:
+                    tile = row.get("tile")
+                yield tile, tile_codes(pred)
+    finally:
+        if prompts_f is not None:
+            prompts_f.close()
+        if index is not None:
+            index.close()
+
+
+# -------------------- Output --------------------
+def label_cells(sv: SceneVotes, level: str, parent_cells: Optional[np.ndarray]) -> np.ndarray:
+    """uint8 class IDs on the cell grid (NODATA where no tile voted)."""
+    votes = sv.votes[level]
+    ids = np.array([class_id(c) for c in CODES[level]], dtype=np.uint8)
+    out = np.full((sv.rows, sv.cols), NODATA, dtype=np.uint8)
+    if level == "level2" and HIERARCHICAL and parent_cells is not None:
+        parent_of = np.array([class_id(PARENT[c]) for c in CODES[level]], dtype=np.uint8)
+    for r in range(0, sv.rows, 256):
+        v = np.array(votes[r:r + 256])
+        if level == "level2" and HIERARCHICAL and parent_cells is not None:
+            v = np.where(parent_of[None, None, :] == parent_cells[r:r + 256, :, None], v, 0.0)
+        best = v.argmax(axis=-1)
+        has = v.max(axis=-1) > 0
+        out[r:r + 256][has] = ids[best[has]]
+    return out
+
+
+def write_raster(cells: np.ndarray, sv: SceneVotes, path: str) -> Tuple[int, int]:
+    if not FULL_RESOLUTION:
+        np.save(path, cells)
+        return cells.shape[1], cells.shape[0]
+    raster = np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8, shape=(sv.height, sv.width))
+    for y0 in range(0, sv.height, BAND_ROWS):
+        y1 = min(sv.height, y0 + BAND_ROWS)
+        rows = np.arange(y0, y1) // CELL_SIZE
+        band = cells[rows]
+        raster[y0:y1] = np.repeat(band, CELL_SIZE, axis=1)[:, :sv.width]
+    raster.flush()
+    del raster
+    return sv.width, sv.height
+
+
+def write_preview(cells: np.ndarray, sv: SceneVotes, path: str) -> None:
+    lut = np.zeros((256, 3), dtype=np.uint8)
+    for code, rgb in PALETTE.items():
+        lut[class_id(code)] = rgb
+    img = Image.fromarray(lut[cells], "RGB")
+    scale = min(1.0, PREVIEW_MAX_SIDE / float(max(sv.width, sv.height)))
+    size = (max(1, int(round(sv.width * scale))), max(1, int(round(sv.height * scale))))
+    img.resize(size, Image.NEAREST).save(path)
+
+
+def finalize_scene(sv: SceneVotes) -> Dict[str, Any]:
+    sv.open()
+    meta: Dict[str, Any] = {
+        "scene": sv.scene, "width": sv.width, "height": sv.height, "cell_size": CELL_SIZE,
+        "full_resolution": FULL_RESOLUTION, "tiles": sv.tiles, "voted_tiles": sv.voted, "nodata": NODATA,
+        "weighting": WEIGHTING, "hierarchical": HIERARCHICAL, "levels": {},
+    }
+    if sv.geo is not None:
+        meta["geo"] = sv.geo
+    parent_cells = None
+    for level in LEVELS:
+        cells = label_cells(sv, level, parent_cells)
+        if level == "level1":
+            parent_cells = cells
+        raster_path = os.path.join(OUTPUT_DIR, f"{sv.key}_{level}.npy")
+        preview_path = os.path.join(OUTPUT_DIR, f"{sv.key}_{level}.png")
+        shape = write_raster(cells, sv, raster_path)
+        write_preview(cells, sv, preview_path)
+        counts = np.bincount(cells.ravel(), minlength=256)
+        total = max(1, int(counts.sum()))
+        meta["levels"][level] = {
+            "raster": raster_path, "preview": preview_path, "shape": [shape[1], shape[0]],
+            "legend": {str(class_id(c)): {"code": c, "name": TAXONOMY[c]["name"] if level == "level1" else
+                                          TAXONOMY[PARENT[c]]["subs"][c], "color": list(PALETTE[c])}
+                       for c in CODES[level]},
+            "area_fraction": {str(i): round(int(n) / total, 6) for i, n in enumerate(counts) if n},
+        }
+    sv.close()
+    fast_json.dump(meta, os.path.join(OUTPUT_DIR, f"{sv.key}.json"), pretty=True)
+    return meta
+
+
+def scene_key(scene: str, taken: Dict[str, str]) -> str:
+    key = Path(scene).stem
+    if key in taken and taken[key] != scene:
+        key = f"{key}_{hashlib.blake2b(scene.encode('utf-8'), digest_size=4).hexdigest()}"
+    taken[key] = scene
+    return key
+
+
+def aggregate() -> List[Dict[str, Any]]:
+    work_dir = os.path.join(OUTPUT_DIR, ".votes")
+    os.makedirs(work_dir, exist_ok=True)
+    scenes: Dict[str, SceneVotes] = {}
+    keys: Dict[str, str] = {}
+    open_lru: "OrderedDict[str, SceneVotes]" = OrderedDict()
+    stats = {"predictions": 0, "no_tile": 0, "unparsed": 0}
+
+    for tile, codes in iter_tile_predictions():
+        stats["predictions"] += 1
+        if tile is None:
+            stats["no_tile"] += 1
+            continue
+        if not codes.get("level1"):
+            stats["unparsed"] += 1
+        scene = tile["scene"]
+        sv = scenes.get(scene)
+        if sv is None:
+            sv = scenes[scene] = SceneVotes(scene, scene_key(scene, keys), int(tile["scene_width"]),
+                                            int(tile["scene_height"]), work_dir)
+        if scene not in open_lru:
+            sv.open()
+            open_lru[scene] = sv
+            while len(open_lru) > MAX_OPEN_SCENES:       # 同一影像的切片通常相邻，只保持少量票数数组打开
+                open_lru.popitem(last=False)[1].close()
+        open_lru.move_to_end(scene)
+        sv.add(tile, codes)
+        if stats["predictions"] % 100000 == 0:
+            print(f"  {stats['predictions']} predictions, {len(scenes)} scenes ...")
+    for sv in open_lru.values():
+        sv.close()
+
+    print(f"[LOAD] {stats['predictions']} predictions | no tile metadata {stats['no_tile']} | "
+          f"unparsed label {stats['unparsed']} | {len(scenes)} scenes")
+    metas = [finalize_scene(sv) for sv in scenes.values()]
+    if not KEEP_VOTES:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return metas
+
+
+def main():
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    for meta in aggregate():
+        l1 = meta["levels"].get("level1")
+        print(f"[SAVE] {meta['scene']}: {meta['voted_tiles']}/{meta['tiles']} tiles voted -> "
+              f"{l1['raster'] if l1 else OUTPUT_DIR}")
+
+
+if __name__ == "__main__":
+    main()
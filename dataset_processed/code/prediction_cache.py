@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Persistent prediction / render cache (SQLite, WAL) keyed by (image content hash, rendered prompt hash, model id).
+
+- 键：blake2b(图像内容哈希, 提示哈希, 模型 ID)；提示为最终发给模型的完整文本（process_json / generate_test_json 的
+  build_instruction、AID PROMPT 等的任何变体都会得到不同的键），模型 ID 应包含影响输出的生成参数
+- 图像内容哈希按 (path, size, mtime_ns) 记忆在同一数据库中，文件未变时不再重读；
+  image_shards 引用哈希预处理后的像素（按分片索引文件的 size / mtime 记忆）
+- 值为任意 bytes（预测文本按 UTF-8 存储；visualize_final_test_image 存渲染好的 JPEG）
+- 容量：总字节数（触发器维护）超过 MAX_BYTES 或条目数超过 MAX_ENTRIES 时按 last_access 淘汰最久未用的条目，
+  直到降到上限的 EVICT_TO 比例；命中时的 last_access 更新批量写回
+- 统计：本次会话与累计的 hits / misses / puts / evictions
+- 线程安全（同一连接加锁）；多进程各自打开连接，依靠 WAL + busy_timeout 并发读写
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from image_shards import open_store, parse_ref
+
+CACHE_PATH = "/root/openset/cache/prediction_cache.sqlite"
+MAX_BYTES = 4 << 30           # 值的总字节数上限
+MAX_ENTRIES: Optional[int] = None
+EVICT_TO = 0.9                # 淘汰到上限的该比例，避免每次写入都触发淘汰
+TOUCH_BATCH = 256             # 累积多少次命中后写回 last_access
+BUSY_TIMEOUT_S = 60.0
+HASH_CHUNK = 1 << 20
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY, image_hash TEXT NOT NULL, prompt_hash TEXT NOT NULL, model TEXT NOT NULL,
+    value BLOB NOT NULL, size INTEGER NOT NULL, created REAL NOT NULL, last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_lru ON entries(last_access);
+CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, hash TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+INSERT OR IGNORE INTO counters VALUES ('bytes', 0), ('entries', 0), ('hits', 0), ('misses', 0), ('puts', 0), ('evictions', 0);
+CREATE TRIGGER IF NOT EXISTS entries_ins AFTER INSERT ON entries BEGIN
+    UPDATE counters SET value = value + NEW.size WHERE name = 'bytes';
+    UPDATE counters SET value = value + 1 WHERE name = 'entries';
+END;
+CREATE TRIGGER IF NOT EXISTS entries_del AFTER DELETE ON entries BEGIN
+    UPDATE counters SET value = value - OLD.size WHERE name = 'bytes';
+    UPDATE counters SET value = value - 1 WHERE name = 'entries';
+END;
+"""
+
+
+def _digest(*parts: bytes) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    for p in parts:
+        h.update(len(p).to_bytes(8, "little"))
+        h.update(p)
+    return h.hexdigest()
+
+
+def prompt_hash(prompt: str) -> str:
+    return _digest(prompt.encode("utf-8"))
+
+
+def make_key(image_hash: str, p_hash: str, model: str) -> str:
+    return _digest(image_hash.encode("ascii"), p_hash.encode("ascii"), model.encode("utf-8"))
+
+
+class PredictionCache:
+    def __init__(self, path: str = CACHE_PATH, max_bytes: Optional[int] = MAX_BYTES,
+                 max_entries: Optional[int] = MAX_ENTRIES):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=BUSY_TIMEOUT_S, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._touched: Dict[str, float] = {}
+        self.session = {"hits": 0, "misses": 0, "puts": 0, "evictions": 0}
+        self._flushed = dict(self.session)
+
+    # ---- hashing ----
+    def image_hash(self, path: str) -> str:
+        """Content hash of one image, memoized by (path, size, mtime_ns)."""
+        shard = parse_ref(path)
+        st = os.stat(open_store(shard[0]).index_path if shard else path)
+        with self._lock:
+            row = self._db.execute("SELECT size, mtime_ns, hash FROM files WHERE path = ?", (path,)).fetchone()
+        if row is not None and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            return row[2]
+        h = hashlib.blake2b(digest_size=16)
+        if shard:
+            h.update(open_store(shard[0]).array(shard[1]))
+        else:
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+                    h.update(chunk)
+        digest = h.hexdigest()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                             (path, st.st_size, st.st_mtime_ns, digest))
+        return digest
+
+    def images_hash(self, paths: Sequence[str]) -> str:
+        """Combined content hash of an ordered image list ("" for no images)."""
+        if not paths:
+            return _digest(b"")
+        if len(paths) == 1:
+            return self.image_hash(paths[0])
+        return _digest(*(self.image_hash(p).encode("ascii") for p in paths))
+
+    # ---- get / put ----
+    def get(self, image_hash: str, p_hash: str, model: str) -> Optional[bytes]:
+        key = make_key(image_hash, p_hash, model)
+        with self._lock:
+            row = self._db.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.session["misses"] += 1
+                return None
+            self.session["hits"] += 1
+            self._touched[key] = time.time()
+            if len(self._touched) >= TOUCH_BATCH:
+                self._flush_locked()
+        return bytes(row[0])
+
+    def put(self, image_hash: str, p_hash: str, model: str, value: bytes) -> None:
+        key = make_key(image_hash, p_hash, model)
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._db.execute("INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                 (key, image_hash, p_hash, model, value, len(value), now, now))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self.session["puts"] += 1
+            self._evict_locked()
+
+    def lookup(self, images: Sequence[str], prompt: str, model: str) -> Optional[str]:
+        """Cached prediction text for (images, prompt, model), or None."""
+        value = self.get(self.images_hash(images), prompt_hash(prompt), model)
+        return value.decode("utf-8") if value is not None else None
+
+    def store(self, images: Sequence[str], prompt: str, model: str, prediction: str) -> None:
+        self.put(self.images_hash(images), prompt_hash(prompt), model, prediction.encode("utf-8"))
+
+    # ---- maintenance ----
+    def _counters(self) -> Dict[str, int]:
+        return dict(self._db.execute("SELECT name, value FROM counters").fetchall())
+
+    def _evict_locked(self) -> None:
+        c = self._counters()
+        over_bytes = self.max_bytes is not None and c["bytes"] > self.max_bytes
+        over_entries = self.max_entries is not None and c["entries"] > self.max_entries
+        if not (over_bytes or over_entries):
+            return
+        self._flush_locked()             # 淘汰前写回命中时间，避免淘汰刚用过的条目
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            c = self._counters()       # 其它进程可能已经淘汰过
+            need_bytes = c["bytes"] - int(self.max_bytes * EVICT_TO) if self.max_bytes is not None else 0
+            need_entries = c["entries"] - int(self.max_entries * EVICT_TO) if self.max_entries is not None else 0
+            keys: List[Tuple[str]] = []
+            freed = 0
+            for key, size in self._db.execute("SELECT key, size FROM entries ORDER BY last_access"):
+                if freed >= need_bytes and len(keys) >= need_entries:
+                    break
+                keys.append((key,))
+                freed += size
+            self._db.executemany("DELETE FROM entries WHERE key = ?", keys)
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self.session["evictions"] += len(keys)
+
+    def _flush_locked(self) -> None:
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            if self._touched:
+                self._db.executemany("UPDATE entries SET last_access = ? WHERE key = ?",
+                                     [(t, k) for k, t in self._touched.items()])
+            for name, value in self.session.items():
+                delta = value - self._flushed[name]
+                if delta:
+                    self._db.execute("UPDATE counters SET value = value + ? WHERE name = ?", (delta, name))
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._touched.clear()
+        self._flushed = dict(self.session)
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_locked()
+
+    def stats(self) -> Dict[str, Any]:
+        """Session counters, cumulative counters (including this session) and current size."""
+        with self._lock:
+            c = self._counters()
+            for name, value in self.session.items():
+                c[name] += value - self._flushed[name]
+        lookups = self.session["hits"] + self.session["misses"]
+        return {
+            "session": {**self.session, "hit_rate": round(self.session["hits"] / lookups, 4) if lookups else None},
+            "total": {k: c[k] for k in ("hits", "misses", "puts", "evictions")},
+            "entries": c["entries"], "bytes": c["bytes"], "max_bytes": self.max_bytes, "max_entries": self.max_entries,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush_locked()
+            self._db.close()
+
+
+def format_stats(s: Dict[str, Any]) -> str:
+    ss, tt = s["session"], s["total"]
+    return (f"hits {ss['hits']} / misses {ss['misses']} (hit rate {ss['hit_rate']}) | puts {ss['puts']} | "
+            f"evictions {ss['evictions']} | {s['entries']} entries, {s['bytes'] / 1e6:.1f} MB | "
+            f"total hits {tt['hits']} misses {tt['misses']}")
+
+
+def main():
+    cache = PredictionCache()
+    s = cache.stats()
+    cache.close()
+    db = sqlite3.connect(CACHE_PATH)
+    models: List[Tuple[str, int, int]] = db.execute("SELECT model, COUNT(*), SUM(size) FROM entries GROUP BY model ORDER BY 2 DESC").fetchall()
+    db.close()
+    print(f"[INFO] {CACHE_PATH}: {s['entries']} entries, {s['bytes'] / 1e6:.1f} MB "
+          f"(limit {s['max_bytes'] / 1e6 if s['max_bytes'] else None} MB)")
+    print(f"[INFO] cumulative hits {s['total']['hits']}, misses {s['total']['misses']}, "
+          f"puts {s['total']['puts']}, evictions {s['total']['evictions']}")
+    for model, n, size in models:
+        print(f"  {model}: {n} entries, {size / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Parser for raw MLLM predictions of the form
+
+    "The image (<path>) is Level-1 category [Name]. Specifically, it is Level-2 subclass [Name].
+     The reason for this classification is as follows: [...]"
+
+parse_raw_prediction 按优先级逐个正则 search 各字段（路径、Level-1、Level-2、描述），正则均预编译。
+注：按标签合成单一扫描器（一次多分支扫描 + 锚定匹配）实测比逐个正则更慢，未采用；
+bench_prediction_parser.py 保留该扫描器用于等价校验与计时对比。
+"""
+import re
+from typing import List, Optional, Tuple
+
+# -------------------- Regex helpers (robust to commas, etc.) --------------------
+IMG_PATH_REGEXES = [
+    re.compile(r"\((/[^)]+\.(?:png|jpg|jpeg|bmp|gif|tif|tiff))\)", re.IGNORECASE),
+    re.compile(r"image\s*[:=]\s*(/[^,\s]+\.(?:png|jpg|jpeg|bmp|gif|tif|tiff))", re.IGNORECASE),
+]
+
+LEVEL1_REGEXES = [
+    re.compile(r"Level-1\s*category\s*[: ]\s*(.+?)(?=\.|\n|$)", re.IGNORECASE),
+    re.compile(r"belongs to\s+Level-1\s*category\s+(.+?)(?=\.|,|\n|$)", re.IGNORECASE),
+]
+
+LEVEL2_REGEXES = [
+    re.compile(r"Level-2\s*subclass\s*[: ]\s*(.+?)(?=\.|\n|$)", re.IGNORECASE),
+    re.compile(r"falls under\s+Level-2\s*subclass\s+(.+?)(?=\.|,|\n|$)", re.IGNORECASE),
+]
+
+DESC_REGEXES = [
+    re.compile(r"(?:The\s+reason\s+for\s+this\s+classification\s+is\s+as\s+follows:)\s*(.*)$",
+               re.IGNORECASE | re.DOTALL),
+    re.compile(r"(?:Reason\s*:)\s*(.*)$", re.IGNORECASE | re.DOTALL),
+    re.compile(r"(?:because\s*:?)\s*(.*)$", re.IGNORECASE | re.DOTALL),
+]
+
+DESC_AFTER_LEVEL2_REGEX = re.compile(
+    r"Specifically,\s*it\s+falls\s+under\s+Level-2\s*subclass\s+.+?\.?\s*(.*)$", re.IGNORECASE | re.DOTALL)
+DESC_IMAGE_SHOWS_REGEX = re.compile(r"(The\s+image\s+shows\b.*)$", re.IGNORECASE | re.DOTALL)
+
+_FENCE_HEAD = re.compile(r"^```[\s\S]*?\n")
+_FENCE_TAIL = re.compile(r"```$")
+_BRACKETED = re.compile(r"^\[(.+)\]$")
+_WHITESPACE = re.compile(r"\s+")
+
+def clean_markdown_spans(s: str) -> str:
+    if not s:
+        return s
+    # 去掉代码块围栏（先做廉价的首尾判断，结果与直接 sub 相同）
+    s = s.strip()
+    if s.startswith("```"):
+        s = _FENCE_HEAD.sub("", s)
+    s = s.strip()
+    if s.endswith("```"):
+        s = _FENCE_TAIL.sub("", s)
+    # 去掉外层引号
+    if len(s) >= 2 and ((s[0] == '"' and s[-1] == '"') or (s[0] == "'" and s[-1] == "'")):
+        s = s[1:-1].strip()
+    # 去掉加粗/反引号/方括号包裹
+    s = s.replace("**", "").replace("`", "").strip()
+    if s.startswith("[") and s.endswith("]"):
+        s = _BRACKETED.sub(r"\1", s)
+    return s
+
+
+def extract_first(patterns: List[re.Pattern], text: str) -> Optional[str]:
+    for pat in patterns:
+        m = pat.search(text)
+        if m:
+            return m.group(1).strip()
+    return None
+
+
+def parse_description(raw: str) -> str:
+    # 1) 常见格式：Reason...: <desc>
+    for pat in DESC_REGEXES:
+        m = pat.search(raw)
+        if m:
+            desc = m.group(1).strip()
+            break
+    else:
+        # 2) 退路：截取二级类别句子后的剩余文本
+        m = DESC_AFTER_LEVEL2_REGEX.search(raw)
+        if m:
+            desc = m.group(1).strip()
+        else:
+            # 3) 再退路：从 “The image shows ...” 开始
+            m = DESC_IMAGE_SHOWS_REGEX.search(raw)
+            desc = m.group(1).strip() if m else ""
+
+    desc = _WHITESPACE.sub(" ", desc).strip()
+    desc = clean_markdown_spans(desc)
+    return desc
+
+
+def parse_raw_prediction(raw: str) -> Tuple[Optional[str], Optional[str], Optional[str], str]:
+    """
+    Returns (img_path, level1, level2, description)
+    """
+    raw = clean_markdown_spans(raw)
+
+    img_path = extract_first(IMG_PATH_REGEXES, raw)
+    level1   = clean_markdown_spans(extract_first(LEVEL1_REGEXES, raw) or "")
+    level2   = clean_markdown_spans(extract_first(LEVEL2_REGEXES, raw) or "")
+    desc     = parse_description(raw)
+
+    return img_path, level1 or None, level2 or None, desc
@@ -2,7 +2,18 @@
 import json
 import os
 import random
-from typing import Any, Dict, List
+from collections.abc import Mapping
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import fast_json
+from ann_store import AnnotationStore, signature_file
+from build_manifest import NameManifest, file_signature, hash_obj, stage_is_current, stamp_path_for, write_stage_stamp
+from compact_dataset import CompactWriter, compact_path, iter_alpaca_rows
+import dataset_splits
+from dataset_splits import write_splits
+from seg_encoding import decode_segmentation, estimate_tokens, mask_to_grid, mask_to_polygon, quantize_bbox
 
 # Input paths
 INPUT_JSON = "/root/openset/dataset_processed/output_json/renamed_output_images_annotation.json"
@@ -12,12 +23,44 @@ IMAGE_CATEGORY_MAPPING_JSON = "/root/openset/dataset/renamed_final/image_categor
 OUTPUT_DIR = "/root/openset/llama_factory/LLaMA-Factory/data"
 DATASET_FILE = "rs_open_tag_infer_new.jsonl"
 
+SHUFFLE_SEED: Optional[int] = None   # 设为整数时打乱顺序可复现
+# True: 另外按 dataset_splits.py 的配置（比例 / 分片数 / SEED）写出确定性的 train/val/test 分片
+WRITE_SPLITS = False
+SPLIT_DIR = os.path.join(OUTPUT_DIR, "rs_open_tag_splits")
+
+# Columnar mode: read rename.py's annotation store (memory-mapped, records are read-only views) instead of INPUT_JSON
+COLUMNAR = False
+INPUT_STORE = "/root/openset/dataset_processed/output_json/renamed_output_images_annotation.annstore"
+
+# True: 写 compact 格式（instruction 只在文件头存一次），输出到 *.compact.jsonl；用 compact_dataset.py 展开
+COMPACT_OUTPUT = False
+
 INCLUDE_RLE = True
 MIN_SCORE_HINT = 0.30
 
+# Incremental build: skip when both inputs and the settings are unchanged; otherwise re-encode only images whose
+# annotation hash (ann_hash in rename.py's build manifest) changed and reuse the others' input from the previous output
+INCREMENTAL = False
+BUILD_MANIFEST = "/root/openset/dataset/renamed_final/.build_manifest.json"     # rename.py 的 BUILD_MANIFEST
+PAYLOAD_STATE = os.path.join(OUTPUT_DIR, f".{DATASET_FILE}.payload_state.json")  # 上次输出的设置哈希与各图 ann_hash / 统计
+
+# ---- input payload 压缩 ----
+SEG_ENCODING = "rle"          # "rle"(完整 COCO counts) | "polygon" | "grid" | "none"；INCLUDE_RLE=False 时等价于 "none"
+POLYGON_MAX_VERTICES = 16     # polygon: 最大连通域外轮廓简化到的顶点数
+GRID_SIZE = 8                 # grid: GRID_SIZE x GRID_SIZE 占用码（十六进制，行优先）
+GRID_MIN_FILL = 0.25          # grid: 格内覆盖率 >= 该值置 1
+BBOX_QUANT_LEVELS = None      # 如 1000：bbox 归一化为 [0, 1000] 的整数；None 保留原始像素坐标
+ENFORCE_MIN_SCORE = False     # True: 丢弃 score < MIN_SCORE_HINT 的实例（无 score 的保留）
+TOP_K = None                  # 只保留按 RANK_BY 排序的前 K 个实例（输出仍保持原顺序）
+RANK_BY = "score"             # "score"(score 降序，area 次之；无 score 的排最后) | "area"
+TOKEN_BUDGET = None           # 如 3000：按 RANK_BY 逐步减少实例，直到 input 的估计 token 数不超过预算
+TOKENIZER = None              # tokenizer 名称/路径（transformers）；None 时按 CHARS_PER_TOKEN 粗估
+CHARS_PER_TOKEN = 3.0
+REPORT_ENCODINGS = False      # True: 额外统计每种编码模式的 payload 大小与估计 token 数
+REPORT_SAMPLE = 500           # 统计所用的样本数（取前 N 条）
+
 def load_json(path: str) -> List[Dict[str, Any]]:
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    return fast_json.load(path)
 
 def build_instruction() -> str:
     return (
@@ -47,56 +90,209 @@ def build_instruction() -> str:
         "ONLY OUTPUT a single category ID."
     )
 
-def build_input_payload(item: Dict[str, Any]) -> str:
-    instances = []
-    for ann in item.get("annotations", []):
-        one = {
-            "id": int(ann.get("id")),
-            "bbox_xywh": ann.get("bbox"),
-            "area": ann.get("area"),
-            "iscrowd": ann.get("iscrowd", 0),
-        }
-        if "score" in ann:
-            one["score"] = ann["score"]
+def _rank_key(ann: Dict[str, Any]) -> Tuple[float, float]:
+    score = ann.get("score")
+    score = float(score) if score is not None else float("-inf")     # 无分数的实例排在有分数的之后
+    area = float(ann.get("area") or 0)
+    return (-area, -score) if RANK_BY == "area" else (-score, -area)
+
+def select_instances(anns: List[Dict[str, Any]]) -> List[int]:
+    """Indices of instances to keep, in priority order (MIN_SCORE_HINT filter + TOP_K)."""
+    idx = range(len(anns))
+    if ENFORCE_MIN_SCORE:
+        idx = [i for i in idx if anns[i].get("score") is None or anns[i]["score"] >= MIN_SCORE_HINT]
+    ranked = sorted(idx, key=lambda i: _rank_key(anns[i]))
+    return ranked[:TOP_K] if TOP_K is not None else ranked
 
-        if INCLUDE_RLE and "segmentation" in ann:
-            seg = ann.get("segmentation", {})
-            one["segmentation"] = {
-                "size": seg.get("size"),
-                "counts": seg.get("counts"),
-            }
-        instances.append(one)
+def encode_instance(ann: Dict[str, Any], item: Dict[str, Any], mode: str) -> Dict[str, Any]:
+    bbox = ann.get("bbox")
+    seg = ann.get("segmentation")
+    if BBOX_QUANT_LEVELS and bbox is not None:
+        width, height = item.get("width"), item.get("height")
+        if not (width and height) and isinstance(seg, Mapping) and seg.get("size"):
+            height, width = seg["size"]             # RLE size 为 [h, w]
+        if width and height:                        # 尺寸未知时保留像素坐标，不量化
+            bbox = quantize_bbox(bbox, width, height, BBOX_QUANT_LEVELS)
+    one = {
+        "id": int(ann.get("id")),
+        "bbox_xywh": bbox,
+        "area": ann.get("area"),
+        "iscrowd": ann.get("iscrowd", 0),
+    }
+    if "score" in ann:
+        one["score"] = ann["score"]
+
+    if mode == "rle" and "segmentation" in ann:
+        seg = seg or {}
+        one["segmentation"] = {
+            "size": seg.get("size"),
+            "counts": seg.get("counts"),
+        }
+    elif mode == "polygon" and seg:
+        one["polygon"] = mask_to_polygon(decode_segmentation(seg), POLYGON_MAX_VERTICES)
+    elif mode == "grid" and seg:
+        one["grid"] = mask_to_grid(decode_segmentation(seg), GRID_SIZE, GRID_MIN_FILL)
+    return one
 
+def _dump_payload(item: Dict[str, Any], instances: List[Dict[str, Any]], total: int, mode: str) -> str:
+    meta = {
+        "image_id": int(item.get("id")),
+        "width": item.get("width"),
+        "height": item.get("height"),
+        "path": item.get("file_path"),
+        "instance_count": len(instances)
+    }
+    if len(instances) != total:
+        meta["instances_total"] = total
+    rules = {
+        "labels_per_instance": 1,
+        "enforce_one_label": True,
+        "preserve_order": True,
+        "language": "en",
+        "min_score_hint": MIN_SCORE_HINT
+    }
+    if mode in ("polygon", "grid"):
+        rules["segmentation_encoding"] = mode
+    if mode == "grid":
+        rules["grid_size"] = GRID_SIZE
+    if BBOX_QUANT_LEVELS:
+        rules["bbox_scale"] = BBOX_QUANT_LEVELS
     payload = {
-        "image_meta": {
-            "image_id": int(item.get("id")),
-            "width": item.get("width"),
-            "height": item.get("height"),
-            "path": item.get("file_path"),
-            "instance_count": len(instances)
-        },
+        "image_meta": meta,
         "instances": instances,
-        "rules": {
-            "labels_per_instance": 1,
-            "enforce_one_label": True,
-            "preserve_order": True,
-            "language": "en",
-            "min_score_hint": MIN_SCORE_HINT
-        }
+        "rules": rules
     }
+    # alpaca 的 input 是文本字段：模型看到的就是这段 JSON 文本，所以先序列化成字符串，写 JSONL 时再作为字符串转义一次，
+    # 这是数据格式本身的嵌套，不是多余的编码。用 stdlib 生成，保证 prompt 文本不随 fast_json 后端变化
     return json.dumps(payload, ensure_ascii=False)
 
+def encode_payload(item: Dict[str, Any], mode: Optional[str] = None) -> Tuple[str, Dict[str, Any]]:
+    """
+    Returns (payload_json, info); info has bytes / tokens / instances / kept / over_budget.
+    With TOKEN_BUDGET set, the lowest-ranked instances are dropped (binary search on the
+    number kept) until the estimated token count fits.
+    """
+    mode = mode or (SEG_ENCODING if INCLUDE_RLE else "none")
+    anns = item.get("annotations", [])
+    ranked = select_instances(anns)
+    encoded = {i: encode_instance(anns[i], item, mode) for i in ranked}
+
+    def build(n: int) -> str:
+        keep = sorted(ranked[:n])          # 恢复原始顺序
+        return _dump_payload(item, [encoded[i] for i in keep], len(anns), mode)
+
+    n = len(ranked)
+    payload = build(n)
+    tokens = estimate_tokens(payload, TOKENIZER, CHARS_PER_TOKEN)
+    if TOKEN_BUDGET is not None and tokens > TOKEN_BUDGET:
+        lo, hi = 0, n - 1                  # 找满足预算的最大实例数
+        best = None
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            p = build(mid)
+            t = estimate_tokens(p, TOKENIZER, CHARS_PER_TOKEN)
+            if t <= TOKEN_BUDGET:
+                best, lo = (mid, p, t), mid + 1
+            else:
+                hi = mid - 1
+        if best is None:
+            n, payload = 0, build(0)
+            tokens = estimate_tokens(payload, TOKENIZER, CHARS_PER_TOKEN)
+        else:
+            n, payload, tokens = best
+
+    info = {
+        "bytes": len(payload.encode("utf-8")),
+        "tokens": tokens,
+        "instances": len(anns),
+        "kept": n,
+        "over_budget": TOKEN_BUDGET is not None and tokens > TOKEN_BUDGET,
+    }
+    return payload, info
+
+def build_input_payload(item: Dict[str, Any]) -> str:
+    return encode_payload(item)[0]
+
+def format_payload_stats(name: str, infos: List[Dict[str, Any]]) -> str:
+    if not infos:
+        return f"[PAYLOAD] {name}: no records"
+    b = np.array([x["bytes"] for x in infos])
+    t = np.array([x["tokens"] for x in infos])
+    kept = sum(x["kept"] for x in infos)
+    total = sum(x["instances"] for x in infos)
+    over = sum(x["over_budget"] for x in infos)
+    return (f"[PAYLOAD] {name}: n={len(infos)} | bytes mean={b.mean():.0f} p95={np.percentile(b, 95):.0f} "
+            f"max={b.max()} | tokens mean={t.mean():.0f} p95={np.percentile(t, 95):.0f} max={t.max()} | "
+            f"instances kept {kept}/{total} | over budget {over}")
+
+def report_encodings(items: List[Dict[str, Any]]) -> None:
+    sample = items[:REPORT_SAMPLE]
+    for mode in ("rle", "polygon", "grid", "none"):
+        infos = [encode_payload(it, mode)[1] for it in sample]
+        print(format_payload_stats(mode, infos))
+
 def build_image_category_map(mapping_items: List[Dict[str, Any]]) -> Dict[str, str]:
     """
     Creates a mapping: new_path -> category.
     """
     return {item["new_path"]: item["category"] for item in mapping_items}
 
+def payload_settings() -> Dict[str, Any]:
+    return {
+        "include_rle": INCLUDE_RLE, "min_score_hint": MIN_SCORE_HINT, "seg_encoding": SEG_ENCODING,
+        "polygon_max_vertices": POLYGON_MAX_VERTICES, "grid_size": GRID_SIZE, "grid_min_fill": GRID_MIN_FILL,
+        "bbox_quant_levels": BBOX_QUANT_LEVELS, "enforce_min_score": ENFORCE_MIN_SCORE, "top_k": TOP_K,
+        "rank_by": RANK_BY, "token_budget": TOKEN_BUDGET, "tokenizer": TOKENIZER, "chars_per_token": CHARS_PER_TOKEN,
+    }
+
+def load_previous_payloads(
+    out_path: str, settings_key: str, ann_hashes: Dict[str, str]
+) -> Dict[str, Tuple[str, Dict[str, Any]]]:
+    """
+    file_path -> (input, info) from the previous output, for images whose ann_hash and the payload settings
+    are the same as when that output was written (PAYLOAD_STATE; out_path must be unchanged since).
+    """
+    if not (os.path.exists(PAYLOAD_STATE) and os.path.exists(out_path)):
+        return {}
+    with open(PAYLOAD_STATE, "r", encoding="utf-8") as f:
+        state = json.load(f)
+    if state.get("settings") != settings_key or state.get("output") != file_signature(out_path):
+        return {}
+    reusable = {p: info for p, (h, info) in state.get("images", {}).items()
+                if ann_hashes.get(os.path.basename(p)) == h}
+    previous = {}
+    if reusable:
+        for row in iter_alpaca_rows(out_path):
+            p = row["images"][0]
+            if p in reusable:
+                previous[p] = (row["input"], reusable[p])
+    return previous
+
+def save_payload_state(
+    out_path: str, items: List[Dict[str, Any]], infos: List[Dict[str, Any]], settings_key: str,
+    ann_hashes: Dict[str, str],
+) -> None:
+    """Records what out_path was built from: settings hash, its (size, mtime_ns) and each image's ann_hash / info."""
+    images = {}
+    for it, info in zip(items, infos):
+        h = ann_hashes.get(os.path.basename(it["file_path"]))
+        if h is not None:
+            images[it["file_path"]] = [h, info]
+    tmp = PAYLOAD_STATE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"settings": settings_key, "output": file_signature(out_path), "images": images}, f,
+                  ensure_ascii=False)
+    os.replace(tmp, PAYLOAD_STATE)
+
 def convert_to_alpaca(
-    items: List[Dict[str, Any]], image_category_map: Dict[str, str]
-) -> List[Dict[str, Any]]:
+    items: List[Dict[str, Any]], image_category_map: Dict[str, str],
+    previous: Optional[Dict[str, Tuple[str, Dict[str, Any]]]] = None,
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Returns (samples, payload infos) in item order; images found in `previous` reuse its input unchanged."""
     inst = build_instruction()
     outputs: List[Dict[str, Any]] = []
+    infos: List[Dict[str, Any]] = []
+    reused = 0
 
     for it in items:
         file_path = it["file_path"]
@@ -104,24 +300,55 @@ def convert_to_alpaca(
         if category_label == "unknown":
             raise ValueError(f"Category not found for image path: {file_path}")
 
+        hit = previous.get(file_path) if previous else None
+        if hit is not None:
+            payload, info = hit
+            reused += 1
+        else:
+            payload, info = encode_payload(it)
+        infos.append(info)
         sample = {
             "instruction": inst,
-            "input": build_input_payload(it),
+            "input": payload,
             "output": category_label,  # from mapping JSON
             "images": [file_path]
         }
         outputs.append(sample)
 
-    return outputs
+    print(format_payload_stats(SEG_ENCODING if INCLUDE_RLE else "none", infos))
+    if previous is not None:
+        print(f"[INCR] Reused {reused} payloads from the previous output, encoded {len(items) - reused}.")
+    return outputs, infos
 
 def save_jsonl(rows: List[Dict[str, Any]], path: str) -> None:
     os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
+    fast_json.write_jsonl(rows, path)
+
+def save_compact_jsonl(rows: List[Dict[str, Any]], path: str) -> None:
+    """rows 的 instruction 必须都等于 build_instruction()；只在文件头保存一次。"""
+    inst = build_instruction()
+    with CompactWriter(path, {"instruction": inst}) as w:
         for r in rows:
-            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+            if r["instruction"] != inst:
+                raise ValueError(f"Unexpected instruction for image: {r['images']}")
+            w.write({**r, "instruction": w.ref("instruction")})
 
 def main():
-    items = load_json(INPUT_JSON)
+    out_path = os.path.join(OUTPUT_DIR, DATASET_FILE)
+    if COMPACT_OUTPUT:
+        out_path = compact_path(out_path)
+    stamp = stamp_path_for(out_path)
+    stamp_params = {**payload_settings(), "compact": COMPACT_OUTPUT, "write_splits": WRITE_SPLITS}
+    if WRITE_SPLITS:
+        stamp_params["splits"] = {"splits": dataset_splits.SPLITS, "num_shards": dataset_splits.NUM_SHARDS,
+                                  "seed": dataset_splits.SEED, "stratify": dataset_splits.STRATIFY}
+    inputs = [signature_file(INPUT_STORE) if COLUMNAR else INPUT_JSON, IMAGE_CATEGORY_MAPPING_JSON]
+    outputs = [out_path] + ([os.path.join(SPLIT_DIR, "splits_manifest.json")] if WRITE_SPLITS else [])
+    if INCREMENTAL and stage_is_current(stamp, inputs, outputs, stamp_params):
+        print(f"[SKIP] Inputs unchanged since last build -> {out_path}")
+        return
+
+    items = AnnotationStore.load(INPUT_STORE) if COLUMNAR else load_json(INPUT_JSON)
     mapping_items = load_json(IMAGE_CATEGORY_MAPPING_JSON)
 
     image_category_map = build_image_category_map(mapping_items)
@@ -129,16 +356,36 @@ def main():
     print(f"[LOAD] Read {len(items)} image records from annotation JSON.")
     print(f"[LOAD] Read {len(mapping_items)} category mappings.")
 
-    samples = convert_to_alpaca(items, image_category_map)
+    if REPORT_ENCODINGS:
+        report_encodings(items)
+
+    settings_key = hash_obj(payload_settings())
+    ann_hashes: Dict[str, str] = {}
+    previous = None
+    if INCREMENTAL:
+        ann_hashes = NameManifest(BUILD_MANIFEST).ann_hashes_by_name()
+        previous = load_previous_payloads(out_path, settings_key, ann_hashes)
+    samples, infos = convert_to_alpaca(items, image_category_map, previous)
 
-    random.shuffle(samples)
+    random.Random(SHUFFLE_SEED).shuffle(samples)
     print(f"[SHUFFLE] Shuffled {len(samples)} samples.")
 
     os.makedirs(OUTPUT_DIR, exist_ok=True)
-    out_path = os.path.join(OUTPUT_DIR, DATASET_FILE)
-    save_jsonl(samples, out_path)
+    if COMPACT_OUTPUT:
+        save_compact_jsonl(samples, out_path)
+    else:
+        save_jsonl(samples, out_path)
+    if INCREMENTAL:
+        save_payload_state(out_path, items, infos, settings_key, ann_hashes)
+        write_stage_stamp(stamp, inputs, stamp_params)
 
     print(f"[SAVE] Dataset successfully written to: {out_path}")
 
+    if WRITE_SPLITS:
+        os.makedirs(SPLIT_DIR, exist_ok=True)
+        manifest = write_splits(out_path, SPLIT_DIR)
+        for name, info in manifest["splits"].items():
+            print(f"[SAVE] {name}: {info['records']} records in {len(info['shards'])} shards -> {SPLIT_DIR}")
+
 if __name__ == "__main__":
     main()
@@ -1,16 +1,37 @@
 # -*- coding: utf-8 -*-
-import json
 import os
 import re
-import shutil
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 from collections import defaultdict
 
+import fast_json
+from ann_store import AnnotationStore, signature_file
+from build_manifest import NameManifest, record_hash, stage_is_current, stamp_path_for, write_stage_stamp
+from copy_engine import copy_many, format_stats
+
 INPUT_JSON = "/root/openset/dataset_processed/output_json/output_images_annotations.json"
 RENAMED_FINAL_DIR = "/root/openset/dataset/renamed_final"
 OUTPUT_JSON = "/root/openset/dataset_processed/output_json/renamed_output_images_annotation.json"
 IMAGE_CATEGORY_MAPPING_JSON = os.path.join(RENAMED_FINAL_DIR, "image_category_mapping.json")
 
+# Copy engine: "copy" | "hardlink" | "reflink" | "symlink" (link modes copy zero bytes on the same filesystem)
+COPY_MODE = "copy"
+COPY_WORKERS = 16
+COPY_MANIFEST = os.path.join(RENAMED_FINAL_DIR, ".copy_manifest.json")   # None -> always re-copy
+
+# Incremental build: names/category ids stay stable across reruns (recorded in BUILD_MANIFEST together with
+# source-image and annotation hashes); new images get the next free number; unchanged input -> step skipped
+INCREMENTAL = False
+BUILD_MANIFEST = os.path.join(RENAMED_FINAL_DIR, ".build_manifest.json")
+
+PRETTY_JSON = True   # indent=2 output; False writes compact JSON
+
+# Columnar mode: read combine.py's annotation store (memory-mapped) and write a store whose image table is
+# reordered/renamed; annotation columns are passed through untouched instead of copying every record dict
+COLUMNAR = False
+INPUT_STORE = "/root/openset/dataset_processed/output_json/output_images_annotations.annstore"
+OUTPUT_STORE = "/root/openset/dataset_processed/output_json/renamed_output_images_annotation.annstore"
+
 CATEGORY_PREFIX = "category"
 IMAGE_PREFIX = "image"
 
@@ -30,13 +51,13 @@ ALIAS_MAP = {
     "circular_farm_land": "circular_farmland"}
 
 def load_json(path: str) -> List[Dict[str, Any]]:
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    if path.endswith(".jsonl"):  # combine.py streaming output
+        return list(fast_json.iter_jsonl(path))
+    return fast_json.load(path)
 
 def save_json(obj: Any, path: str) -> None:
     os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(obj, f, ensure_ascii=False, indent=2)
+    fast_json.dump(obj, path, pretty=PRETTY_JSON)
 
 def normalize_label(s: str) -> str:
     s = s.strip().lower()
@@ -62,62 +83,123 @@ def parse_category(file_path: str) -> str:
 def digits(n: int, min_width: int = 6) -> int:
     return max(min_width, len(str(n)))
 
-def copy_file(src: str, dst: str):
-    os.makedirs(os.path.dirname(dst), exist_ok=True)
-    shutil.copy2(src, dst)
-
-def main():
-    items = load_json(INPUT_JSON)
-    category_to_items = defaultdict(list)
+def plan_renames(
+    file_paths: List[str], manifest: Optional[NameManifest] = None
+) -> Tuple[List[Tuple[int, str, str, bool]], Dict[str, str]]:
+    """
+    Assign new file names: grouped by sorted category, input order within a category.
+    Returns (plan, category_id_map); plan rows are (index into file_paths, category, new_filename, is_new)
+    in output order. With a manifest, known images keep their names and category ids.
+    """
+    category_to_idx = defaultdict(list)
 
     # Step 1: 分类统计
-    for item in items:
-        category = parse_category(item["file_path"])
-        category_to_items[category].append(item)
-
-    categories_sorted = sorted(category_to_items.keys())
-    category_id_map = {cat: f"{CATEGORY_PREFIX}{str(idx).zfill(4)}"
-                       for idx, cat in enumerate(categories_sorted, start=1)}
+    for i, fp in enumerate(file_paths):
+        category_to_idx[parse_category(fp)].append(i)
+
+    categories_sorted = sorted(category_to_idx.keys())
+    if manifest is None:
+        category_id_map = {cat: f"{CATEGORY_PREFIX}{str(idx).zfill(4)}"
+                           for idx, cat in enumerate(categories_sorted, start=1)}
+    else:
+        # 已有类别沿用原 id，新类别按排序顺序接着编号（空 manifest 时与全量构建一致）
+        category_id_map = manifest.assign_categories(categories_sorted)
+
+    img_digits = digits(len(file_paths))
+    if manifest is not None and manifest.img_digits is None:
+        manifest.img_digits = img_digits
+
+    plan = []
+    image_counter = 1
+    for cat in categories_sorted:
+        for i in category_to_idx[cat]:
+            ext = os.path.splitext(file_paths[i])[-1] or ".tif"
+            if manifest is None:
+                new_filename, is_new = f"{IMAGE_PREFIX}{str(image_counter).zfill(img_digits)}{ext}", True
+            else:
+                new_filename, is_new = manifest.image_name(file_paths[i], ext)
+            plan.append((i, cat, new_filename, is_new))
+            image_counter += 1
+    return plan, category_id_map
 
+def main():
+    manifest = NameManifest(BUILD_MANIFEST, IMAGE_PREFIX, CATEGORY_PREFIX) if INCREMENTAL else None
+    input_path = INPUT_STORE if COLUMNAR else INPUT_JSON
+    output_path = OUTPUT_STORE if COLUMNAR else OUTPUT_JSON
+    stamp = stamp_path_for(output_path)
+    stamp_params = {"renamed_dir": RENAMED_FINAL_DIR, "copy_mode": COPY_MODE}
+    stamp_inputs = [signature_file(input_path), BUILD_MANIFEST]
+    outputs = [signature_file(output_path), IMAGE_CATEGORY_MAPPING_JSON]
+    if (manifest is not None and stage_is_current(stamp, stamp_inputs, outputs, stamp_params)
+            and manifest.sources_unchanged()):
+        print(f"[SKIP] {input_path} and {len(manifest)} source images unchanged since last build")
+        return
+
+    items = AnnotationStore.load(INPUT_STORE) if COLUMNAR else load_json(INPUT_JSON)
+    file_paths = items.file_paths() if COLUMNAR else [item["file_path"] for item in items]
+    plan, category_id_map = plan_renames(file_paths, manifest)
+    categories_sorted = sorted(category_id_map)
     total_images = len(items)
-    img_digits = digits(total_images)
 
     mapping_json = []
-    updated_items = []
-    image_counter = 1
+    order = []
+    copy_jobs = []
     category_counts = defaultdict(int)
+    n_new = n_ann_changed = 0
 
     os.makedirs(RENAMED_FINAL_DIR, exist_ok=True)
 
-    for cat in categories_sorted:
+    for idx, cat, new_filename, is_new in plan:
+        src = file_paths[idx]
         cat_id = category_id_map[cat]
-        cat_items = category_to_items[cat]
-        for item in cat_items:
-            ext = os.path.splitext(item["file_path"])[-1] or ".tif"
-            new_filename = f"{IMAGE_PREFIX}{str(image_counter).zfill(img_digits)}{ext}"
-            new_filepath = os.path.join(RENAMED_FINAL_DIR, new_filename)
-
-            # Copy and rename once
-            copy_file(item["file_path"], new_filepath)
-
-            # Record mappings (增加了原始路径)
-            mapping_json.append({
-                "new_filename": new_filename,
-                "original_path": item["file_path"],
-                "new_path": new_filepath,
-                "category": cat_id
-            })
-
-            item_updated = dict(item)
-            item_updated["file_path"] = new_filepath
-            updated_items.append(item_updated)
-
-            image_counter += 1
-            category_counts[cat_id] += 1
+        if manifest is not None:
+            entry = manifest.images[src]
+            ann_hash = record_hash(items[idx])
+            n_new += is_new
+            n_ann_changed += (not is_new) and entry.get("ann_hash") != ann_hash
+            entry["category"], entry["ann_hash"] = cat_id, ann_hash
+        new_filepath = os.path.join(RENAMED_FINAL_DIR, new_filename)
+
+        # Copy and rename once (executed in parallel below; unchanged files are skipped by the copy manifest)
+        copy_jobs.append((src, new_filepath))
+
+        # Record mappings (增加了原始路径)
+        mapping_json.append({
+            "new_filename": new_filename,
+            "original_path": src,
+            "new_path": new_filepath,
+            "category": cat_id
+        })
+        order.append(idx)
+
+        category_counts[cat_id] += 1
+
+    if manifest is not None:
+        n_removed = manifest.mark_present(file_paths)
+        changed = manifest.refresh_hashes([src for src, _ in copy_jobs], workers=COPY_WORKERS)
+        print(f"[INCR] {n_new} new, {len(changed) - n_new} source images changed, "
+              f"{n_ann_changed} annotation sets changed, {n_removed} no longer in input")
+
+    stats = copy_many(copy_jobs, mode=COPY_MODE, workers=COPY_WORKERS, manifest_path=COPY_MANIFEST)
+    print(f"[COPY] {format_stats(stats)}")
+    if stats["errors"]:
+        raise RuntimeError(f"{len(stats['errors'])} files failed to copy, first: {stats['errors'][0]}")
 
     # Save mapping and updated annotations
     save_json(mapping_json, IMAGE_CATEGORY_MAPPING_JSON)
-    save_json(updated_items, OUTPUT_JSON)
+    new_paths = [row["new_path"] for row in mapping_json]
+    if COLUMNAR:
+        items.take(order, new_paths).save(OUTPUT_STORE)
+    else:
+        updated_items = []
+        for idx, new_filepath in zip(order, new_paths):
+            item_updated = dict(items[idx])
+            item_updated["file_path"] = new_filepath
+            updated_items.append(item_updated)
+        save_json(updated_items, OUTPUT_JSON)
+    if manifest is not None:
+        manifest.save()
+        write_stage_stamp(stamp, stamp_inputs, stamp_params)
 
     print("=== Processing Summary ===")
     for cat in categories_sorted:
@@ -128,7 +210,7 @@ def main():
     print(f"\nTotal images processed: {total_images}")
     print(f"Unified images stored at: {RENAMED_FINAL_DIR}")
     print(f"Detailed mapping JSON saved at: {IMAGE_CATEGORY_MAPPING_JSON}")
-    print(f"Updated annotations JSON saved at: {OUTPUT_JSON}")
+    print(f"Updated annotations saved at: {output_path}")
 
 if __name__ == "__main__":
     main()
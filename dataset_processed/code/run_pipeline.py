@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Fused second-stage pipeline: combine.py -> rename.py -> process_json.py in one process and one pass.
+
+COCO 输入流式解析（coco_stream），按 image 合并标注后直接完成分类/重命名与 Alpaca 转换，
+不再写出、重新解析中间 JSON。命名规则与三步脚本一致（rename.plan_renames），输出数据集与 process_json 相同
+（shuffle 顺序除外）。
+- WRITE_INTERMEDIATES=True 时额外写出中间结果：合并/重命名后的记录为 JSONL（rename.load_json 可直接读取），
+  映射表为 JSON
+- 结束时打印各阶段耗时
+"""
+import os
+import random
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, IO, Iterator, List, Optional
+
+import combine
+import fast_json
+import process_json
+import rename
+from build_manifest import NameManifest
+from coco_stream import AnnotationGrouper, iter_coco_arrays
+from copy_engine import copy_many, format_stats
+
+# 默认沿用三个脚本各自的配置
+INPUT_JSON = combine.INPUT_JSON
+IMG_BASE_DIR = combine.IMG_BASE_DIR
+RENAMED_FINAL_DIR = rename.RENAMED_FINAL_DIR
+OUTPUT_DIR = process_json.OUTPUT_DIR
+DATASET_FILE = process_json.DATASET_FILE
+
+WRITE_INTERMEDIATES = False
+MERGED_JSONL = "/root/openset/dataset_processed/output_json/output_images_annotations.jsonl"
+RENAMED_JSONL = "/root/openset/dataset_processed/output_json/renamed_output_images_annotation.jsonl"
+IMAGE_CATEGORY_MAPPING_JSON = rename.IMAGE_CATEGORY_MAPPING_JSON
+
+SHUFFLE = True                # 与 process_json 一致：全部样本在内存中打乱后写出；False 则边转换边写
+STABLE_NAMES = False          # True: 使用 rename.BUILD_MANIFEST 保持 imageNNNNNN / categoryNNNN 不变
+COPY_MODE = rename.COPY_MODE
+COPY_WORKERS = rename.COPY_WORKERS
+COPY_MANIFEST = rename.COPY_MANIFEST
+
+
+class StageTimer:
+    def __init__(self):
+        self.seconds: Dict[str, float] = defaultdict(float)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - t0
+
+    def report(self) -> str:
+        total = sum(self.seconds.values())
+        rows = [f"  {name:<12} {sec:8.2f}s  {100 * sec / max(total, 1e-9):5.1f}%" for name, sec in self.seconds.items()]
+        return "\n".join(["[TIME] stage timings:"] + rows + [f"  {'total':<12} {total:8.2f}s"])
+
+
+def _open_jsonl(path: str) -> IO[bytes]:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    return open(path, "wb")
+
+
+def main():
+    timer = StageTimer()
+    grouper = AnnotationGrouper(max_buffered=combine.MAX_BUFFERED_RECORDS, spill_dir=combine.SPILL_DIR)
+    manifest = NameManifest(rename.BUILD_MANIFEST, rename.IMAGE_PREFIX, rename.CATEGORY_PREFIX) if STABLE_NAMES else None
+    merged_f = renamed_f = stream_f = None
+    stream_tmp: Optional[str] = None          # SHUFFLE=False 时边转换边写的临时文件，成功后 os.replace 为 out_path
+    try:
+        # 1) 流式解析 COCO，按 image 聚合标注；同时记下输入顺序的文件路径用于命名
+        file_paths: List[str] = []
+        index_of: Dict[int, int] = {}
+        n_anns = 0
+        with timer.stage("parse"):
+            for key, obj in iter_coco_arrays(INPUT_JSON):
+                if key == "images":
+                    grouper.add_image(obj)
+                    index_of[int(obj["id"])] = len(file_paths)
+                    file_paths.append(combine.to_file_path(obj["file_name"], IMG_BASE_DIR))
+                else:
+                    grouper.add_annotation(obj)
+                    n_anns += 1
+        print(f"[LOAD] {len(file_paths)} images, {n_anns} annotations from {INPUT_JSON}")
+
+        # 2) 命名（需要全部类别，只用到文件路径）
+        with timer.stage("plan"):
+            plan, category_id_map = rename.plan_renames(file_paths, manifest)
+            new_path = [""] * len(file_paths)
+            category_of = [""] * len(file_paths)
+            mapping_json = []
+            copy_jobs = []
+            for idx, cat, new_filename, _ in plan:
+                new_path[idx] = os.path.join(RENAMED_FINAL_DIR, new_filename)
+                category_of[idx] = category_id_map[cat]
+                copy_jobs.append((file_paths[idx], new_path[idx]))
+                mapping_json.append({"new_filename": new_filename, "original_path": file_paths[idx],
+                                     "new_path": new_path[idx], "category": category_of[idx]})
+
+        # 3) 合并 -> 重命名 -> Alpaca，一次遍历
+        if WRITE_INTERMEDIATES:
+            merged_f, renamed_f = _open_jsonl(MERGED_JSONL), _open_jsonl(RENAMED_JSONL)
+        out_path = os.path.join(OUTPUT_DIR, DATASET_FILE)
+        if process_json.COMPACT_OUTPUT:
+            out_path = process_json.compact_path(out_path)
+        inst = process_json.build_instruction()
+        samples: List[Dict[str, Any]] = []
+        infos: List[Dict[str, Any]] = []
+        if not SHUFFLE and not process_json.COMPACT_OUTPUT:
+            stream_tmp = out_path + ".tmp"
+            stream_f = _open_jsonl(stream_tmp)
+
+        groups = grouper.groups()
+        while True:
+            with timer.stage("group"):            # 读回溢写分桶（若有）
+                nxt = next(groups, None)
+            if nxt is None:
+                break
+            img, anns = nxt
+            with timer.stage("merge"):
+                item = combine.build_merged_item(img, anns, IMG_BASE_DIR)
+                idx = index_of[item["id"]]
+                renamed_item = dict(item)
+                renamed_item["file_path"] = new_path[idx]
+            with timer.stage("encode"):
+                payload, info = process_json.encode_payload(renamed_item)
+                infos.append(info)
+                sample = {"instruction": inst, "input": payload, "output": category_of[idx],
+                          "images": [new_path[idx]]}
+            with timer.stage("write"):
+                if WRITE_INTERMEDIATES:
+                    merged_f.write(fast_json.dumps(item) + b"\n")
+                    renamed_f.write(fast_json.dumps(renamed_item) + b"\n")
+                if stream_f is not None:
+                    stream_f.write(fast_json.dumps(sample) + b"\n")
+                else:
+                    samples.append(sample)
+        print(process_json.format_payload_stats(process_json.SEG_ENCODING if process_json.INCLUDE_RLE else "none", infos))
+    except BaseException:
+        if stream_f is not None:
+            stream_f.close()
+            os.remove(stream_tmp)
+        raise
+    finally:
+        grouper.close()
+        for f in (merged_f, renamed_f, stream_f):
+            if f is not None:
+                f.close()
+
+    # 4) 复制/链接图像
+    with timer.stage("copy"):
+        os.makedirs(RENAMED_FINAL_DIR, exist_ok=True)
+        stats = copy_many(copy_jobs, mode=COPY_MODE, workers=COPY_WORKERS, manifest_path=COPY_MANIFEST)
+    print(f"[COPY] {format_stats(stats)}")
+    if stats["errors"]:
+        if stream_tmp is not None:
+            os.remove(stream_tmp)
+        raise RuntimeError(f"{len(stats['errors'])} files failed to copy, first: {stats['errors'][0]}")
+
+    # 5) 打乱并写出数据集
+    with timer.stage("save"):
+        if stream_tmp is not None:
+            os.replace(stream_tmp, out_path)
+        else:
+            if SHUFFLE:
+                random.Random(process_json.SHUFFLE_SEED).shuffle(samples)
+            if process_json.COMPACT_OUTPUT:
+                process_json.save_compact_jsonl(samples, out_path)
+            else:
+                process_json.save_jsonl(samples, out_path)
+        if WRITE_INTERMEDIATES:
+            rename.save_json(mapping_json, IMAGE_CATEGORY_MAPPING_JSON)
+        if manifest is not None:
+            manifest.mark_present(file_paths)
+            for row in mapping_json:
+                manifest.images[row["original_path"]]["category"] = row["category"]
+            manifest.save()
+
+    print(f"[SAVE] {len(infos)} samples -> {out_path}")
+    if WRITE_INTERMEDIATES:
+        print(f"[SAVE] Intermediates: {MERGED_JSONL}, {RENAMED_JSONL}, {IMAGE_CATEGORY_MAPPING_JSON}")
+    print(timer.report())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+Compact encodings of COCO RLE segmentations for prompt payloads, plus a token estimate.
+
+- mask_to_polygon: 最大连通域的外轮廓（Moore 邻域跟踪），再用 Visvalingam–Whyatt 简化到给定顶点数
+- mask_to_grid:    GxG 粗网格占用码（覆盖率 >= min_fill 的格子置 1，行优先，按 4 位一组写成十六进制）
+- quantize_bbox:   bbox 归一化到 [0, levels] 的整数
+- estimate_tokens: 指定 tokenizer 时精确计数，否则按字符数粗估
+- rle_intervals / crop_rle: 不解码整幅掩码，直接在游程（列优先前景区间）上裁剪窗口并重新编码为 COCO RLE
+"""
+import heapq
+import math
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# 8 邻域，顺时针（图像坐标系，y 向下），从正西开始
+_DIRS = ((0, -1), (-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1))
+_DIR_INDEX = {d: i for i, d in enumerate(_DIRS)}
+
+
+def decode_segmentation(seg: Dict[str, Any]) -> np.ndarray:
+    """COCO RLE dict (compressed string or uncompressed counts list) -> HxW bool mask."""
+    from pycocotools import mask as maskUtils
+
+    h, w = seg["size"]
+    counts = seg["counts"]
+    if isinstance(counts, list):
+        rle = maskUtils.frPyObjects(seg, h, w)
+    else:
+        rle = {"size": [h, w], "counts": counts.encode("utf-8") if isinstance(counts, str) else counts}
+    return maskUtils.decode(rle).astype(bool)
+
+
+def rle_counts(seg: Dict[str, Any]) -> np.ndarray:
+    """Run lengths of a COCO RLE (background first); compressed strings are decoded as in rleFrString."""
+    counts = seg["counts"]
+    if isinstance(counts, list):
+        return np.asarray(counts, dtype=np.int64)
+    s = counts.encode("ascii") if isinstance(counts, str) else counts
+    out: List[int] = []
+    p = 0
+    while p < len(s):
+        x = k = 0
+        more = True
+        while more:
+            c = s[p] - 48
+            x |= (c & 0x1F) << (5 * k)
+            more = bool(c & 0x20)
+            p += 1
+            k += 1
+            if not more and (c & 0x10):
+                x |= -1 << (5 * k)
+        if len(out) > 2:
+            x += out[-2]
+        out.append(x)
+    return np.asarray(out, dtype=np.int64)
+
+
+def rle_intervals(seg: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray]:
+    """Foreground runs as sorted [start, end) offsets into the column-major flattened mask."""
+    bounds = np.concatenate([[0], np.cumsum(rle_counts(seg))])
+    starts, ends = bounds[1::2], bounds[2::2]
+    starts = starts[:len(ends)]
+    keep = ends > starts
+    return starts[keep], ends[keep]
+
+
+def crop_rle(
+    intervals: Tuple[np.ndarray, np.ndarray], height: int, window: Tuple[int, int, int, int],
+    bbox: Optional[Sequence[float]] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Clip a mask of the given full height (as rle_intervals) to window (x, y, w, h).
+    Returns {"segmentation": compressed RLE of size [h, w], "area", "bbox"} in window
+    coordinates, or None if nothing is visible. The mask bbox, if known, limits the columns searched.
+    """
+    from pycocotools import mask as maskUtils
+
+    S, E = intervals
+    x0, y0, w, h = window
+    cx0, cx1 = x0, x0 + w
+    if bbox is not None:
+        cx0 = max(cx0, int(math.floor(bbox[0])))
+        cx1 = min(cx1, int(math.ceil(bbox[0] + bbox[2])))
+    if cx1 <= cx0 or len(S) == 0:
+        return None
+    cols = np.arange(cx0, cx1, dtype=np.int64)
+    lo = cols * height + y0
+    hi = lo + h
+    a = np.searchsorted(E, lo, side="right")      # 第一个结束于列窗口起点之后的区间
+    b = np.searchsorted(S, hi, side="left")       # 起点落在列窗口终点之前的区间
+    n = np.maximum(b - a, 0)
+    total = int(n.sum())
+    if total == 0:
+        return None
+    col = np.repeat(np.arange(len(cols)), n)
+    piece = np.repeat(a, n) + np.arange(total) - np.repeat(np.cumsum(n) - n, n)
+    base = (cols[col] - x0) * h
+    rs = np.maximum(S[piece], lo[col]) - lo[col]            # 窗口内的行区间
+    re = np.minimum(E[piece], hi[col]) - lo[col]
+    s, e = rs + base, re + base
+    # 跨列相接的区间合并，再写成 背景/前景 交替的游程
+    first = np.r_[True, s[1:] != e[:-1]]
+    last = np.r_[first[1:], True]
+    s, e = s[first], e[last]
+    counts = np.empty(2 * len(s) + 1, dtype=np.int64)
+    counts[0:-1:2] = s - np.r_[0, e[:-1]]
+    counts[1::2] = e - s
+    counts[-1] = w * h - e[-1]
+    rle = maskUtils.frPyObjects({"size": [h, w], "counts": counts.tolist()}, h, w)
+    xs = cols[col] - x0
+    bx, by = int(xs.min()), int(rs.min())
+    return {
+        "segmentation": {"size": [h, w], "counts": rle["counts"].decode("ascii")},
+        "area": int((e - s).sum()),
+        "bbox": [bx, by, int(xs.max()) + 1 - bx, int(re.max()) - by],
+    }
+
+
+def _largest_component(mask: np.ndarray) -> np.ndarray:
+    from scipy import ndimage
+
+    labels, n = ndimage.label(mask, structure=np.ones((3, 3), dtype=bool))
+    if n <= 1:
+        return mask
+    sizes = np.bincount(labels.ravel())
+    sizes[0] = 0
+    return labels == int(sizes.argmax())
+
+
+def trace_outer_boundary(mask: np.ndarray) -> List[tuple]:
+    """
+    Ordered (x, y) pixel coordinates of the outer boundary of the component containing the
+    first foreground pixel in raster order (Moore-neighbour tracing; stops when the first move repeats).
+    """
+    ys, xs = np.nonzero(mask)
+    if len(ys) == 0:
+        return []
+    y0, x0 = int(ys.min()), int(xs.min())
+    y1, x1 = int(ys.max()), int(xs.max())
+    crop = np.zeros((y1 - y0 + 3, x1 - x0 + 3), dtype=bool)   # 1px 背景边框，邻域访问不越界
+    crop[1:-1, 1:-1] = mask[y0:y1 + 1, x0:x1 + 1]
+
+    fy, fx = np.nonzero(crop)
+    start = (int(fy[0]), int(fx[0]))          # 行优先第一个前景像素，其正西必为背景
+    p, back = start, 0
+    path = [start]
+    second = None
+    for _ in range(4 * crop.size):
+        for k in range(1, 9):
+            nd = (back + k) % 8
+            q = (p[0] + _DIRS[nd][0], p[1] + _DIRS[nd][1])
+            if crop[q]:
+                prev = _DIRS[(nd - 1) % 8]
+                back = _DIR_INDEX[(p[0] + prev[0] - q[0], p[1] + prev[1] - q[1])]
+                break
+        else:
+            break                             # 孤立像素
+        # 回到起点且下一步与第一步相同：轮廓闭合
+        if p == start and second is not None and q == second:
+            break
+        if second is None:
+            second = q
+        if q != start:
+            path.append(q)
+        p = q
+    return [(c - 1 + x0, r - 1 + y0) for r, c in path]
+
+
+def simplify_polygon(points: Sequence[tuple], max_vertices: int) -> List[tuple]:
+    """
+    Visvalingam–Whyatt on a closed ring: drop the smallest-area vertex until <= max_vertices
+    remain; collinear vertices (zero area) are always dropped.
+    """
+    n = len(points)
+    if n <= 3:
+        return list(points)
+    max_vertices = max(3, max_vertices)
+    prev = [(i - 1) % n for i in range(n)]
+    nxt = [(i + 1) % n for i in range(n)]
+    alive = [True] * n
+    version = [0] * n
+
+    def area(i: int) -> float:
+        (ax, ay), (bx, by), (cx, cy) = points[prev[i]], points[i], points[nxt[i]]
+        return abs((bx - ax) * (cy - ay) - (cx - ax) * (by - ay))
+
+    heap = [(area(i), i, 0) for i in range(n)]
+    heapq.heapify(heap)
+    remaining = n
+    while remaining > 3 and heap and (remaining > max_vertices or heap[0][0] == 0):
+        _, i, ver = heapq.heappop(heap)
+        if not alive[i] or ver != version[i]:
+            continue
+        alive[i] = False
+        remaining -= 1
+        a, b = prev[i], nxt[i]
+        nxt[a], prev[b] = b, a
+        for j in (a, b):
+            version[j] += 1
+            heapq.heappush(heap, (area(j), j, version[j]))
+    return [points[i] for i in range(n) if alive[i]]
+
+
+def mask_to_polygon(mask: np.ndarray, max_vertices: int) -> List[int]:
+    """Flat COCO-style polygon [x1, y1, x2, y2, ...] of the largest component, <= max_vertices vertices."""
+    if not mask.any():
+        return []
+    ring = trace_outer_boundary(_largest_component(mask))
+    ring = simplify_polygon(ring, max_vertices)
+    return [int(v) for xy in ring for v in xy]
+
+
+def mask_to_grid(mask: np.ndarray, grid: int, min_fill: float) -> str:
+    """GxG occupancy bits (row-major) as a hex string; a cell is set when coverage >= min_fill."""
+    h, w = mask.shape
+    r_edges = np.linspace(0, h, grid + 1).astype(np.int64)
+    c_edges = np.linspace(0, w, grid + 1).astype(np.int64)
+    m = mask.astype(np.uint32)
+    # 行、列分段求和（reduceat 要求起点严格递增，图像小于网格时退化到逐格计算）
+    if np.all(np.diff(r_edges) > 0) and np.all(np.diff(c_edges) > 0):
+        sums = np.add.reduceat(np.add.reduceat(m, r_edges[:-1], axis=0), c_edges[:-1], axis=1)
+    else:
+        sums = np.array([[m[r_edges[i]:r_edges[i + 1], c_edges[j]:c_edges[j + 1]].sum()
+                          for j in range(grid)] for i in range(grid)])
+    cell_area = np.outer(np.diff(r_edges), np.diff(c_edges))
+    bits = (sums >= np.maximum(cell_area, 1) * min_fill) & (sums > 0)
+    if not bits.any() and sums.any():
+        bits.flat[int(sums.argmax())] = True      # 小目标至少占一格
+    flat = bits.ravel()
+    pad = (-len(flat)) % 4
+    if pad:
+        flat = np.concatenate([flat, np.zeros(pad, dtype=bool)])
+    nibbles = flat.reshape(-1, 4) @ np.array([8, 4, 2, 1])
+    return "".join("0123456789abcdef"[int(v)] for v in nibbles)
+
+
+def quantize_bbox(bbox: Sequence[float], width: int, height: int, levels: int) -> List[int]:
+    """[x, y, w, h] in pixels -> integers in [0, levels] relative to the image size (width, height > 0)."""
+    if width <= 0 or height <= 0:
+        raise ValueError(f"quantize_bbox needs the image size, got {width}x{height}")
+    x, y, w, h = bbox
+    sx, sy = levels / width, levels / height
+    return [int(round(x * sx)), int(round(y * sy)), int(round(w * sx)), int(round(h * sy))]
+
+
+@lru_cache(maxsize=4)
+def _load_tokenizer(name_or_path: str):
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(name_or_path, trust_remote_code=True)
+
+
+def estimate_tokens(text: str, tokenizer: Optional[str] = None, chars_per_token: float = 3.0) -> int:
+    if tokenizer:
+        return len(_load_tokenizer(tokenizer).encode(text, add_special_tokens=False))
+    return int(math.ceil(len(text) / chars_per_token))
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Precompiled index over generate_test_json.TAXONOMY for normalizing parsed Level-1 / Level-2
+predictions to taxonomy codes ("05" / "051").
+
+- 别名哈希：规范化后的名称、代码、常见变体 -> 代码（整串命中，O(len)）
+- 字符 trie：整串未命中时按词边界取最长前缀（如 "Paddy field with ridges" -> 011）
+- Level-2 与 Level-1 不一致（父类代码不同）时标记 consistent=False
+"""
+import re
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from generate_test_json import TAXONOMY
+
+# 常见的非标准写法（规范化后） -> 代码；与 TAXONOMY 名称派生的别名冲突时以此为准
+EXTRA_ALIASES: Dict[str, Dict[str, str]] = {
+    "level1": {
+        "farmland": "01", "cropland": "01", "agricultural land": "01",
+        "garden": "02", "forest": "03", "woodland": "03",
+        "commercial": "05", "commercial land": "05", "commercial and service land": "05",
+        "industrial": "06", "industrial land": "06", "industrial mining and storage land": "06",
+        "residential": "07",
+        "public service land": "08", "public administration and service land": "08",
+        "transportation": "10", "transport land": "10",
+        "water bodies": "11", "water body": "11", "water": "11", "water area": "11",
+        "unused land": "12", "other": "12",
+    },
+    "level2": {
+        "paddy": "011", "rice paddy": "011", "paddy land": "011",
+        "irrigated farmland": "012", "dryland": "013", "dry farmland": "013",
+        "tea plantation": "022",
+        "shrub land": "032", "shrub": "032",
+        "urban residential": "071", "rural residential land": "072", "rural homestead": "072",
+        "park": "087", "green space": "087",
+        "road": "102", "highway": "102", "airport": "105", "port": "106", "harbor": "106", "harbour": "106",
+        "river": "111", "lake": "112", "reservoir": "113", "pond": "114", "tidal flat": "115",
+        "ditch": "117", "canal": "117", "desert": "126", "bare soil": "127",
+    },
+}
+
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+_LEADING_ARTICLE = re.compile(r"^(?:the|a|an) ")
+_TERMINAL = "\0"
+
+
+def normalize_label(text: str) -> str:
+    """'Industrial, Mining & Storage land' -> 'industrial mining and storage land'"""
+    s = text.lower().replace("&", " and ")
+    s = _NON_ALNUM.sub(" ", s).strip()
+    return _LEADING_ARTICLE.sub("", s)
+
+
+def _name_variants(name: str) -> Iterable[str]:
+    base = normalize_label(name)
+    yield base
+    if base.endswith(" land"):
+        yield base[:-5]                  # "railway land" -> "railway"
+    else:
+        yield base + " land"             # "forest" -> "forest land"
+    if base.endswith("land") and not base.endswith(" land"):
+        yield base[:-4] + " land"        # "grassland" -> "grass land"
+
+
+class TaxonomyIndex:
+    """Alias hash + character trie per level, built once from a TAXONOMY dict."""
+
+    def __init__(self, taxonomy: Dict[str, Dict] = TAXONOMY, extra_aliases: Dict[str, Dict[str, str]] = EXTRA_ALIASES):
+        self.names: Dict[str, str] = {}
+        self.parent: Dict[str, str] = {}
+        l1: Dict[str, str] = {}
+        l2: Dict[str, str] = {}
+        for code1, node in taxonomy.items():
+            self.names[code1] = node["name"]
+            self._add_aliases(l1, code1, node["name"])
+            for code2, sub_name in node["subs"].items():
+                self.names[code2] = sub_name
+                self.parent[code2] = code1
+                self._add_aliases(l2, code2, sub_name)
+        l1 = {k: v for k, v in l1.items() if v is not None}
+        l2 = {k: v for k, v in l2.items() if v is not None}
+        l1.update(extra_aliases.get("level1", {}))
+        l2.update(extra_aliases.get("level2", {}))
+
+        self.aliases = {"level1": l1, "level2": l2}
+        self.tries = {"level1": self._build_trie(l1), "level2": self._build_trie(l2)}
+
+    @staticmethod
+    def _add_aliases(table: Dict[str, Optional[str]], code: str, name: str) -> None:
+        keys = [code, f"{code} {normalize_label(name)}"]
+        keys.extend(_name_variants(name))
+        for key in keys:
+            # 同一别名指向不同代码时视为歧义，整体丢弃
+            if key in table and table[key] != code:
+                table[key] = None
+            else:
+                table[key] = code
+
+    @staticmethod
+    def _build_trie(table: Dict[str, str]) -> Dict[str, Any]:
+        root: Dict[str, Any] = {}
+        for key, code in table.items():
+            node = root
+            for ch in key:
+                node = node.setdefault(ch, {})
+            node[_TERMINAL] = code
+        return root
+
+    def lookup(self, level: str, text: Optional[str]) -> Optional[str]:
+        """Map a free-text label of `level` ("level1" / "level2") to its code, or None."""
+        if not text:
+            return None
+        key = normalize_label(text)
+        code = self.aliases[level].get(key)
+        if code is not None:
+            return code
+        # 最长的、止于词边界的前缀
+        node = self.tries[level]
+        best = None
+        for i, ch in enumerate(key):
+            node = node.get(ch)
+            if node is None:
+                break
+            if _TERMINAL in node and (i + 1 == len(key) or key[i + 1] == " "):
+                best = node[_TERMINAL]
+        return best
+
+    def normalize_prediction(self, level1: Optional[str], level2: Optional[str]) -> Dict[str, Any]:
+        """
+        Returns level1_code / level2_code (None when unmapped), the canonical names, and
+        consistent: whether level2_code belongs to level1_code (None if either is missing).
+        """
+        c1 = self.lookup("level1", level1)
+        c2 = self.lookup("level2", level2)
+        consistent = None if (c1 is None or c2 is None) else self.parent[c2] == c1
+        return {
+            "level1_code": c1,
+            "level1_name": self.names.get(c1) if c1 else None,
+            "level2_code": c2,
+            "level2_name": self.names.get(c2) if c2 else None,
+            "consistent": consistent,
+        }
+
+
+@lru_cache(maxsize=None)
+def get_taxonomy_index() -> TaxonomyIndex:
+    return TaxonomyIndex()
+
+
+def level_codes(code: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """'051' -> ('05', '051'); '05' -> ('05', None)."""
+    if not code:
+        return None, None
+    return (code[:2], code) if len(code) == 3 else (code, None)
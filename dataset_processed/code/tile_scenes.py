@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+"""
+Cut large scenes (10k x 10k+ GeoTIFF orthophotos) into overlapping tiles before prompt generation.
+
+- 窗口读取：安装了 rasterio 时按窗口读取（GDAL 只解码与窗口相交的块，压缩 / 分块 GeoTIFF 均可）；
+  否则未压缩 TIFF 用 PIL 只解码与窗口相交的条带 / 块；其它格式整幅解码（打印 [WARN]，内存与影像大小相关）
+- 窗口：TILE_SIZE 见方、相邻重叠 OVERLAP，最后一行 / 列贴齐影像边缘，影像小于 TILE_SIZE 时只有一块
+- 输出：切片图像 + 每块一行 JSONL 提示：
+  无标注（SCENE_DIR）       -> generate_test_json.py 格式
+  有标注（SCENE_RECORDS）   -> process_json.py 格式，SAM 的 RLE 在游程上裁剪到切片并重新编码（不解码整幅掩码）
+  每行带 "tile"：源影像、窗口偏移与大小、影像尺寸（有 rasterio 时另含 crs / 仿射变换）
+- 另写 TILE_RECORDS_JSONL（combine.py 的合并记录格式 + "tile"），可直接作为 process_json / 拼接聚合的输入
+- 逐影像、逐切片流式处理，切片编码写盘在线程池中进行，在途切片数有上限
+- 场景通常超过 PIL 的解压炸弹上限（约 1.79 亿像素），扫描与打开场景统一使用 SCENE_MAX_PIXELS（默认不限制）
+"""
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+import fast_json
+import generate_test_json
+import process_json
+from ann_store import load_records
+from image_scan import ImageScanner, pixel_limit
+from seg_encoding import crop_rle, rle_intervals
+
+try:
+    import rasterio
+    from rasterio.windows import Window
+except ImportError:  # optional: lazy windowed reads for compressed / tiled GeoTIFF
+    rasterio = None
+
+# ---- I/O ----
+SCENE_DIR = "/root/openset/dataset/scenes"            # 无标注：目录下的大幅影像
+SCENE_EXTS = {".tif", ".tiff", ".png", ".jpg", ".jpeg"}
+SCENE_RECORDS: Optional[str] = None                   # 有标注：combine.py 的输出（JSON / JSONL / .annstore），优先于 SCENE_DIR
+IMAGE_CATEGORY_MAPPING_JSON: Optional[str] = None     # 影像 -> 类别（process_json 格式的 output）；None 时 output 为空
+TILE_DIR = "/root/openset/dataset/scene_tiles"
+OUTPUT_JSONL = "/root/openset/llama_factory/LLaMA-Factory/data/scene_tiles.jsonl"
+TILE_RECORDS_JSONL = "/root/openset/dataset_processed/output_json/scene_tile_annotations.jsonl"
+
+# ---- tiling ----
+TILE_SIZE = 1024
+OVERLAP = 128
+TILE_FORMAT = "png"           # "png" | "jpg"
+JPEG_QUALITY = 95
+BANDS = (1, 2, 3)             # rasterio 读取的波段（1 起）；单波段影像复制为 RGB
+VALUE_RANGE: Optional[Tuple[float, float]] = None   # 非 uint8 影像线性拉伸到 0-255 的范围；None 时整数用类型范围，浮点用 [0, 1]
+SKIP_EMPTY_TILES = True       # 跳过全部为无效值 / 纯黑的切片（影像外的填充区）
+MIN_CLIP_AREA = 16            # 裁剪后面积小于该像素数的实例丢弃
+MIN_VISIBLE_FRACTION = 0.0    # 裁剪后可见面积 / 原面积 低于该值的实例丢弃
+WORKERS = 4                   # 切片编码写盘线程数
+SCENE_MAX_PIXELS: Optional[int] = None   # 场景像素上限（扫描 + PIL 打开）；None 不限制，只对本脚本的场景读取生效
+
+
+def tile_windows(width: int, height: int, tile: int = TILE_SIZE, overlap: int = OVERLAP) -> List[Tuple[int, int, int, int]]:
+    """(x, y, w, h) windows in row-major order; the last row / column is aligned to the scene edge."""
+    if overlap >= tile:
+        raise ValueError(f"OVERLAP ({overlap}) must be smaller than TILE_SIZE ({tile})")
+
+    def starts(n: int) -> List[int]:
+        if n <= tile:
+            return [0]
+        step = tile - overlap
+        out = list(range(0, n - tile, step))
+        return out + [n - tile]
+
+    return [(x, y, min(tile, width), min(tile, height)) for y in starts(height) for x in starts(width)]
+
+
+def _to_uint8(a: np.ndarray) -> np.ndarray:
+    if a.dtype == np.uint8:
+        return a
+    if VALUE_RANGE is not None:
+        lo, hi = VALUE_RANGE
+    elif np.issubdtype(a.dtype, np.integer):
+        lo, hi = np.iinfo(a.dtype).min, np.iinfo(a.dtype).max
+    else:
+        lo, hi = 0.0, 1.0
+    scaled = (a.astype(np.float32) - lo) * (255.0 / max(hi - lo, 1e-12))
+    return np.clip(scaled, 0, 255).astype(np.uint8)
+
+
+class SceneReader:
+    """Windowed RGB reads from one scene: rasterio > PIL strips/tiles of uncompressed TIFF > full decode."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.ds = None
+        self.full: Optional[Image.Image] = None
+        self.geo: Optional[Dict[str, Any]] = None
+        if rasterio is not None:
+            try:
+                self.ds = rasterio.open(path)
+            except Exception:
+                self.ds = None
+        if self.ds is not None:
+            self.size = (self.ds.width, self.ds.height)
+            self.backend = "rasterio"
+            if self.ds.crs is not None:
+                self.geo = {"crs": self.ds.crs.to_string()}
+            return
+
+        with pixel_limit(SCENE_MAX_PIXELS), Image.open(path) as im:
+            self.size = im.size
+            # 未压缩条带 / 块：raw 解码器，行自上而下（ystep == 1）
+            windowed = im.format == "TIFF" and bool(im.tile) and all(
+                t[0] == "raw" and len(t[3]) >= 3 and t[3][2] == 1 for t in im.tile)
+        self.backend = "pil-window" if windowed else "pil-full"
+        if not windowed:
+            print(f"[WARN] {path}: no windowed reader for this file (install rasterio); decoding the full scene")
+            with pixel_limit(SCENE_MAX_PIXELS), Image.open(path) as im:
+                self.full = im.convert("RGB")
+
+    def close(self) -> None:
+        if self.ds is not None:
+            self.ds.close()
+        self.full = None
+
+    def tile_geo(self, window: Tuple[int, int, int, int]) -> Optional[Dict[str, Any]]:
+        if self.ds is None or self.geo is None:
+            return None
+        t = self.ds.window_transform(Window(*window))
+        return {**self.geo, "transform": [t.a, t.b, t.c, t.d, t.e, t.f]}
+
+    def read(self, window: Tuple[int, int, int, int]) -> Image.Image:
+        x, y, w, h = window
+        if self.ds is not None:
+            bands = [b for b in BANDS if b <= self.ds.count] or [1]
+            a = self.ds.read(indexes=bands, window=Window(x, y, w, h))
+            a = _to_uint8(np.moveaxis(a, 0, -1))
+            if a.shape[-1] == 1:
+                a = np.repeat(a, 3, axis=-1)
+            return Image.fromarray(np.ascontiguousarray(a[..., :3]), "RGB")
+        if self.full is not None:
+            return self.full.crop((x, y, x + w, y + h))
+
+        # 只保留与窗口相交的条带 / 块，并跳过窗口以外的行（raw 数据按行定长），当作一幅较小的图像解码
+        # TIFF 在 load() 时按整幅尺寸再检查一次像素上限，整个读取都在 pixel_limit 内
+        with pixel_limit(SCENE_MAX_PIXELS), Image.open(self.path) as im:
+            tiles = []
+            for codec, (ex0, ey0, ex1, ey1), offset, args in im.tile:
+                if ex0 >= x + w or ex1 <= x or ey0 >= y + h or ey1 <= y:
+                    continue
+                row_bytes = args[1] or len(Image.new(im.mode, (ex1 - ex0, 1)).tobytes("raw", args[0]))
+                r0, r1 = max(ey0, y), min(ey1, y + h)
+                tiles.append((codec, (ex0, r0, ex1, r1), offset + (r0 - ey0) * row_bytes, args))
+            bx0, by0 = min(t[1][0] for t in tiles), min(t[1][1] for t in tiles)
+            bx1, by1 = max(t[1][2] for t in tiles), max(t[1][3] for t in tiles)
+            im._size = (bx1 - bx0, by1 - by0)
+            im.tile = [(t[0], (t[1][0] - bx0, t[1][1] - by0, t[1][2] - bx0, t[1][3] - by0), t[2], t[3]) for t in tiles]
+            im.load()
+            out = im.crop((x - bx0, y - by0, x - bx0 + w, y - by0 + h))
+            return out if out.mode == "RGB" else _pil_to_rgb(out)
+
+
+def _pil_to_rgb(im: Image.Image) -> Image.Image:
+    if im.mode in ("I;16", "I;16B", "I;16L", "I", "F"):
+        return Image.fromarray(_to_uint8(np.asarray(im)), "L").convert("RGB")
+    return im.convert("RGB")
+
+
+def clip_annotations(
+    anns: List[Dict[str, Any]], window: Tuple[int, int, int, int], tile_id: int,
+    cache: Dict[int, Tuple[np.ndarray, np.ndarray]],
+) -> List[Dict[str, Any]]:
+    """Annotations visible in the window, in window coordinates; cache holds each RLE's runs (decoded once per scene)."""
+    x0, y0, w, h = window
+    out = []
+    for i, ann in enumerate(anns):
+        bbox = ann.get("bbox")
+        if bbox is not None and (bbox[0] >= x0 + w or bbox[0] + bbox[2] <= x0 or bbox[1] >= y0 + h or bbox[1] + bbox[3] <= y0):
+            continue
+        seg = ann.get("segmentation")
+        clipped = dict(ann)
+        clipped["image_id"] = tile_id
+        if isinstance(seg, dict) and "counts" in seg:
+            if i not in cache:
+                cache[i] = rle_intervals(seg)
+            c = crop_rle(cache[i], int(seg["size"][0]), window, bbox)
+            if c is None:
+                continue
+            clipped.update(c)
+            full_area = float(ann.get("area") or int((cache[i][1] - cache[i][0]).sum()))
+        elif bbox is not None:
+            bx0, by0 = max(bbox[0], x0), max(bbox[1], y0)
+            bx1, by1 = min(bbox[0] + bbox[2], x0 + w), min(bbox[1] + bbox[3], y0 + h)
+            clipped["bbox"] = [bx0 - x0, by0 - y0, bx1 - bx0, by1 - by0]
+            clipped["area"] = (bx1 - bx0) * (by1 - by0)
+            full_area = float(bbox[2] * bbox[3])
+            clipped.pop("segmentation", None)
+        else:
+            continue
+        if clipped["area"] < MIN_CLIP_AREA:
+            continue
+        if MIN_VISIBLE_FRACTION and full_area > 0 and clipped["area"] / full_area < MIN_VISIBLE_FRACTION:
+            continue
+        out.append(clipped)
+    return out
+
+
+def iter_scenes() -> Iterator[Dict[str, Any]]:
+    """Merged records (combine.py format); without SCENE_RECORDS every image in SCENE_DIR with no annotations."""
+    if SCENE_RECORDS:
+        if SCENE_RECORDS.endswith(".jsonl"):
+            yield from fast_json.iter_jsonl(SCENE_RECORDS)
+        else:
+            yield from load_records(SCENE_RECORDS)
+        return
+    scanner = ImageScanner("header", max_pixels=SCENE_MAX_PIXELS)
+    found = scanner.scan_dirs([SCENE_DIR], SCENE_EXTS)[SCENE_DIR]
+    for i, r in enumerate(found, 1):
+        yield {"id": i, "file_path": r["path"], "width": r["width"], "height": r["height"], "annotations": None}
+
+
+def _save_tile(img: Image.Image, path: str) -> None:
+    tmp = path + ".tmp"
+    if TILE_FORMAT == "jpg":
+        img.save(tmp, format="JPEG", quality=JPEG_QUALITY)
+    else:
+        img.save(tmp, format="PNG")
+    os.replace(tmp, path)
+
+
+def build_row(tile_item: Dict[str, Any], category: Optional[str], sam_format: bool) -> Dict[str, Any]:
+    path = tile_item["file_path"]
+    if sam_format:
+        row = {"instruction": process_json.build_instruction(), "input": process_json.build_input_payload(tile_item),
+               "output": category or "", "images": [path]}
+    else:
+        row = {"instruction": generate_test_json.build_instruction(path), "input": f"The image path is: {path}",
+               "output": "", "images": [path]}
+    row["tile"] = tile_item["tile"]
+    return row
+
+
+def tile_scene(
+    scene: Dict[str, Any], next_id: int, category: Optional[str], pool: ThreadPoolExecutor, pending: List[Future],
+) -> Iterator[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    """(JSONL row, tile record) for every kept tile of one scene; tile images are written by `pool`."""
+    path = scene["file_path"]
+    reader = SceneReader(path)
+    try:
+        W, H = reader.size
+        anns = scene.get("annotations")
+        sam_format = anns is not None
+        cache: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+        out_dir = os.path.join(TILE_DIR, Path(path).stem)
+        os.makedirs(out_dir, exist_ok=True)
+        ext = ".jpg" if TILE_FORMAT == "jpg" else ".png"
+        for window in tile_windows(W, H):
+            x, y, w, h = window
+            img = reader.read(window)
+            if SKIP_EMPTY_TILES and img.getbbox() is None:
+                continue
+            tile_path = os.path.abspath(os.path.join(out_dir, f"{Path(path).stem}_x{x:06d}_y{y:06d}{ext}"))
+            pending.append(pool.submit(_save_tile, img, tile_path))
+            while len(pending) > 2 * WORKERS:       # 在途切片数有上限，内存与影像大小无关
+                pending.pop(0).result()
+            tile = {"scene": path, "scene_id": scene.get("id"), "x": x, "y": y, "width": w, "height": h,
+                    "scene_width": W, "scene_height": H}
+            geo = reader.tile_geo(window)
+            if geo is not None:
+                tile["geo"] = geo
+            item = {"id": next_id, "file_path": tile_path, "width": w, "height": h, "tile": tile,
+                    "annotations": clip_annotations(anns, window, next_id, cache) if sam_format else []}
+            next_id += 1
+            yield build_row(item, category, sam_format), item
+    finally:
+        reader.close()
+
+
+def main():
+    category_map: Dict[str, str] = {}
+    if IMAGE_CATEGORY_MAPPING_JSON:
+        category_map = process_json.build_image_category_map(fast_json.load(IMAGE_CATEGORY_MAPPING_JSON))
+    for p in (OUTPUT_JSONL, TILE_RECORDS_JSONL):
+        os.makedirs(os.path.dirname(p) or ".", exist_ok=True)
+
+    n_scenes = n_tiles = n_anns = 0
+    next_id = 1
+    pending: List[Future] = []
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool, \
+            open(OUTPUT_JSONL, "wb") as rows_f, open(TILE_RECORDS_JSONL, "wb") as rec_f:
+        for scene in iter_scenes():
+            scene = dict(scene)
+            if scene.get("annotations") is not None:
+                scene["annotations"] = [dict(a) for a in scene["annotations"]]
+            n_scenes += 1
+            before = n_tiles
+            for row, item in tile_scene(scene, next_id, category_map.get(scene["file_path"]), pool, pending):
+                rows_f.write(fast_json.dumps(row) + b"\n")
+                rec_f.write(fast_json.dumps(item) + b"\n")
+                next_id = item["id"] + 1
+                n_tiles += 1
+                n_anns += len(item["annotations"])
+            print(f"[TILE] {scene['file_path']} -> {n_tiles - before} tiles")
+        for f in pending:
+            f.result()
+
+    print(f"[OK] {n_scenes} scenes -> {n_tiles} tiles ({n_anns} clipped annotations) in {TILE_DIR}")
+    print(f"[SAVE] Prompts: {OUTPUT_JSONL}")
+    print(f"[SAVE] Tile records: {TILE_RECORDS_JSONL}")
+
+
+if __name__ == "__main__":
+    main()
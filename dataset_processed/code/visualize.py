@@ -1,10 +1,14 @@
 # -*- coding: utf-8 -*-
 import os
 import json
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Tuple
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 
+from ann_store import AnnotationStore, is_store_path
+from font_cache import get_font
+from image_loader import load_rgb
+
 # ======== 可按需修改 ========
 INPUT_JSON = "/root/openset/dataset_processed/sample_json/final_annotations.json"
 OUTPUT_DIR = "/root/openset/dataset_processed/visualize_folder"
@@ -13,6 +17,13 @@ DRAW_ID = True                 # 是否在实例中心写 id
 BASE_FONT_SIZE = 9             # 目标字号（DejaVu/Arial 找不到则回退默认字号）
 TEXT_FILL = (255, 255, 255)    # 文字颜色
 TEXT_STROKE = (0, 0, 0)        # 1px 黑色描边，增强可读
+FONT_CANDIDATES = (
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/freefont/FreeSans.ttf",
+    "DejaVuSans.ttf",
+    "Arial.ttf",
+)
+VECTORIZED = True              # 批量解码 + 单次合成；False 走逐实例叠加的旧路径
 # ============================
 
 # 更深的配色（饱和）
@@ -39,6 +50,8 @@ def ensure_dir(p: str) -> None:
 
 
 def load_items(path: str) -> List[Dict[str, Any]]:
+    if is_store_path(path):   # 列式标注库（ann_store.py），逐条只读视图
+        return AnnotationStore.load(path)
     with open(path, "r", encoding="utf-8") as f:
         return json.load(f)
 
@@ -72,20 +85,8 @@ def overlay_mask_on_image(img: Image.Image, mask: np.ndarray, color: tuple, alph
 
 
 def _load_font(target_size: int) -> ImageFont.FreeTypeFont | ImageFont.ImageFont:
-    """优先加载可控字号的 TrueType 字体；缺失时退回默认位图字体。"""
-    candidates = [
-        "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
-        "/usr/share/fonts/truetype/freefont/FreeSans.ttf",
-        "DejaVuSans.ttf",
-        "Arial.ttf",
-    ]
-    for p in candidates:
-        if os.path.exists(p):
-            try:
-                return ImageFont.truetype(p, size=target_size)
-            except Exception:
-                pass
-    return ImageFont.load_default()  # 退回默认（字号不可控，通常≈10px）
+    """优先加载可控字号的 TrueType 字体；缺失时退回默认位图字体（字号不可控，通常≈10px）。"""
+    return get_font(target_size, FONT_CANDIDATES)
 
 
 def draw_segment_id(img: Image.Image, mask: np.ndarray, seg_id: int) -> Image.Image:
@@ -94,19 +95,21 @@ def draw_segment_id(img: Image.Image, mask: np.ndarray, seg_id: int) -> Image.Im
     ys, xs = np.where(mask > 0)
     if len(xs) == 0:
         return img
-    cx, cy = int(xs.mean()), int(ys.mean())
+    return draw_id_at(img, (int(xs.mean()), int(ys.mean())), seg_id)
+
 
+def _id_font(width: int, height: int) -> ImageFont.FreeTypeFont | ImageFont.ImageFont:
     # 动态字号：在小图上保持更小；在大图上略放大
-    img_min_side = min(img.width, img.height)
+    img_min_side = min(width, height)
     fs = max(8, min(14, int(img_min_side / 32)))  # 256px -> 8，512px -> 16(被限制到14)
     fs = max(fs, BASE_FONT_SIZE)
+    return _load_font(fs)
 
-    font = _load_font(fs)
-    draw = ImageDraw.Draw(img)
 
+def _draw_id_text(draw: ImageDraw.ImageDraw, xy: tuple, seg_id: int, font) -> None:
     # 仅文字，无白底；用 1px 描边保证可读
     draw.text(
-        (cx, cy),
+        xy,
         str(seg_id),
         fill=TEXT_FILL,
         font=font,
@@ -114,14 +117,15 @@ def draw_segment_id(img: Image.Image, mask: np.ndarray, seg_id: int) -> Image.Im
         stroke_width=1,
         stroke_fill=TEXT_STROKE,
     )
-    return img
 
 
-def visualize_item(item: Dict[str, Any], out_dir: str, alpha: float = ALPHA) -> str:
-    img_path = item["file_path"]
-    img = Image.open(img_path).convert("RGB")
-    anns = item.get("annotations", [])
+def draw_id_at(img: Image.Image, center: tuple, seg_id: int) -> Image.Image:
+    _draw_id_text(ImageDraw.Draw(img), center, seg_id, _id_font(img.width, img.height))
+    return img
+
 
+def composite_sequential(img: Image.Image, anns: List[Dict[str, Any]], alpha: float = ALPHA) -> Image.Image:
+    """Per-instance path: overlay_mask_on_image then draw_segment_id for each annotation, in order."""
     for k, ann in enumerate(anns):
         seg = ann.get("segmentation")
         if not seg or "counts" not in seg or "size" not in seg:
@@ -130,6 +134,183 @@ def visualize_item(item: Dict[str, Any], out_dir: str, alpha: float = ALPHA) ->
         color = DEEP_COLORS[k % len(DEEP_COLORS)]
         img = overlay_mask_on_image(img, mask, color=color, alpha=alpha)
         img = draw_segment_id(img, mask, seg_id=int(ann.get("id", k + 1)))
+    return img
+
+
+_MEASURE = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+ID_BOX_PAD = 2                 # 编号文字框外扩像素，覆盖描边与抗锯齿边缘
+
+
+class MaskCompositor:
+    """
+    Batched multi-mask compositor, pixel-identical to composite_sequential.
+
+    All same-size RLEs of an image are decoded in one maskUtils.decode call (mixed sizes are decoded
+    one by one); masks not at image size are nearest-resized to (W, H) like overlay_mask_on_image.
+    The float blend (with its uint8 truncation) is tabulated once per alpha as a
+    [color, channel, value] LUT, so pixels covered by a single mask are blended in one
+    gather through the label map; only pixels covered by several masks are replayed mask by
+    mask, in annotation order. Segment ids are drawn in the sequential path's order (each right
+    after its mask, later masks blend over it) by replaying masks and ids inside the union of the
+    id text boxes only. Buffers are reused across images of the same size.
+    """
+
+    def __init__(self, alpha: float = ALPHA, colors: List[tuple] = DEEP_COLORS):
+        self.colors = colors
+        v = np.arange(256, dtype=np.float32)
+        a = np.float32(alpha)
+        keep = np.float32(1 - alpha)
+        col = np.asarray(colors, dtype=np.float32)                    # (C, 3)
+        lut = v[None, None, :] * keep + col[:, :, None] * a           # (C, 3, 256)
+        self.lut = np.clip(lut, 0, 255).astype(np.uint8)
+        self._bufs: Dict[str, np.ndarray] = {}
+
+    def _buffer(self, name: str, shape: tuple, dtype=np.uint8) -> np.ndarray:
+        buf = self._bufs.get(name)
+        if buf is None or buf.shape != shape:
+            buf = self._bufs[name] = np.empty(shape, dtype=dtype)
+        return buf
+
+    def composite(self, img: Image.Image, anns: List[Dict[str, Any]], draw_ids: bool = DRAW_ID) -> np.ndarray:
+        """Composited HxWx3 uint8 buffer (reused by the next call)."""
+        src = np.asarray(img)
+        out = self._buffer("out", src.shape)
+        np.copyto(out, src)
+        H, W = out.shape[:2]
+
+        seg_ids, color_idx, rles = [], [], []
+        for k, ann in enumerate(anns):
+            seg = ann.get("segmentation")
+            if not seg or "counts" not in seg or "size" not in seg:
+                continue
+            counts = seg["counts"]
+            if isinstance(counts, str):
+                counts = counts.encode("utf-8")
+            seg_ids.append(int(ann.get("id", k + 1)))
+            color_idx.append(k % len(self.colors))
+            rles.append({"size": seg["size"], "counts": counts})
+        if not rles:
+            return out
+        n = len(rles)
+
+        # 同尺寸 RLE 一次解码；尺寸不一致时逐个解码
+        if all(r["size"] == rles[0]["size"] for r in rles):
+            decoded = maskUtils.decode(rles)                          # (h, w, N)
+            masks = [decoded[:, :, i] for i in range(n)]
+        else:
+            masks = [decode_rle_to_mask(r) for r in rles]
+        boxes = maskUtils.toBbox(rles).astype(np.int64)              # (N, 4) xywh，后续只在框内计算
+
+        # 质心与 draw_segment_id 一致：在原始 mask 坐标系上计算
+        centers: List[Any] = [None] * n
+        for i in range(n):
+            x, y, bw, bh = boxes[i]
+            m = masks[i][y:y + bh, x:x + bw]
+            cnt = int(m.sum(dtype=np.int64))
+            if cnt:
+                cx = int((np.arange(x, x + bw) @ m.sum(axis=0, dtype=np.int64)) / cnt)
+                cy = int((np.arange(y, y + bh) @ m.sum(axis=1, dtype=np.int64)) / cnt)
+                centers[i] = (cx, cy)
+
+        # 与图像尺寸不一致的 mask 按 overlay_mask_on_image 的方式最近邻缩放到 (W, H)
+        for i in range(n):
+            if masks[i].shape != (H, W):
+                masks[i] = np.array(Image.fromarray(np.ascontiguousarray(masks[i], dtype=np.uint8))
+                                    .resize((W, H), Image.NEAREST))
+                ys = np.flatnonzero(masks[i].any(axis=1))
+                xs = np.flatnonzero(masks[i].any(axis=0))
+                boxes[i] = (xs[0], ys[0], xs[-1] + 1 - xs[0], ys[-1] + 1 - ys[0]) if len(xs) else (0, 0, 0, 0)
+
+        # label map（最后覆盖者）+ 覆盖次数
+        colors = np.array(color_idx, dtype=np.intp)
+        top = self._buffer("top", (H, W), np.intp)
+        cover = self._buffer("cover", (H, W), np.uint16)
+        cover.fill(0)
+        for i in range(n):
+            x, y, bw, bh = boxes[i]
+            m = masks[i][y:y + bh, x:x + bw].astype(bool)
+            top[y:y + bh, x:x + bw][m] = i
+            cover[y:y + bh, x:x + bw] += m
+
+        channels = np.arange(3)
+
+        # 单层覆盖：按 label map 一次查表完成全部颜色混合
+        single = cover == 1
+        if single.any():
+            c = colors[top[single]]
+            out[single] = self.lut[c[:, None], channels[None, :], out[single]]
+
+        # 多层覆盖：按标注顺序依次混合，复现逐实例叠加的截断行为
+        multi = cover > 1
+        if multi.any():
+            for i in range(n):
+                x, y, bw, bh = boxes[i]
+                sel = masks[i][y:y + bh, x:x + bw].astype(bool) & multi[y:y + bh, x:x + bw]
+                if not sel.any():
+                    continue
+                region = out[y:y + bh, x:x + bw]
+                region[sel] = self.lut[colors[i]][channels, region[sel]]
+
+        if draw_ids:
+            self._draw_ids(out, src, masks, boxes, colors, seg_ids, centers)
+        return out
+
+    def _draw_ids(self, out: np.ndarray, src: np.ndarray, masks: List[np.ndarray], boxes: np.ndarray,
+                  colors: np.ndarray, seg_ids: List[int], centers: List[Any]) -> None:
+        """Replays masks and ids in annotation order, restricted to the union of the id text boxes."""
+        H, W = out.shape[:2]
+        font = _id_font(W, H)
+        text_boxes: Dict[int, Tuple[int, int, int, int]] = {}
+        in_text = self._buffer("in_text", (H, W), bool)
+        in_text.fill(False)
+        for i, center in enumerate(centers):
+            if center is None:
+                continue
+            l, t, r, b = _MEASURE.textbbox(center, str(seg_ids[i]), font=font, anchor="mm", stroke_width=1)
+            x0, y0 = max(0, int(l) - ID_BOX_PAD), max(0, int(t) - ID_BOX_PAD)
+            x1, y1 = min(W, int(np.ceil(r)) + ID_BOX_PAD), min(H, int(np.ceil(b)) + ID_BOX_PAD)
+            if x0 < x1 and y0 < y1:
+                text_boxes[i] = (x0, y0, x1, y1)
+                in_text[y0:y1, x0:x1] = True
+        if not text_boxes:
+            return
+
+        work = self._buffer("work", out.shape)
+        np.copyto(work, src)
+        channels = np.arange(3)
+        for i in range(len(masks)):
+            x, y, bw, bh = boxes[i]
+            sel = masks[i][y:y + bh, x:x + bw].astype(bool) & in_text[y:y + bh, x:x + bw]
+            if sel.any():
+                region = work[y:y + bh, x:x + bw]
+                region[sel] = self.lut[colors[i]][channels, region[sel]]
+            if i in text_boxes:
+                x0, y0, x1, y1 = text_boxes[i]
+                crop = Image.fromarray(work[y0:y1, x0:x1], mode="RGB")
+                cx, cy = centers[i]
+                _draw_id_text(ImageDraw.Draw(crop), (cx - x0, cy - y0), seg_ids[i], font)
+                work[y0:y1, x0:x1] = np.asarray(crop)
+        np.copyto(out, work, where=in_text[:, :, None])
+
+
+_COMPOSITORS: Dict[float, MaskCompositor] = {}
+
+
+def get_compositor(alpha: float) -> MaskCompositor:
+    if alpha not in _COMPOSITORS:
+        _COMPOSITORS[alpha] = MaskCompositor(alpha)
+    return _COMPOSITORS[alpha]
+
+
+def visualize_item(item: Dict[str, Any], out_dir: str, alpha: float = ALPHA) -> str:
+    img_path = item["file_path"]
+    img, _ = load_rgb(img_path)   # 掩码为原图尺寸，需全分辨率解码；同图多次渲染时走缓存
+    anns = item.get("annotations", [])
+
+    if VECTORIZED:
+        img = Image.fromarray(get_compositor(alpha).composite(img, anns), mode="RGB")
+    else:
+        img = composite_sequential(img, anns, alpha)
 
     base = os.path.splitext(os.path.basename(img_path))[0]
     save_path = os.path.join(out_dir, f"{base}_vis.jpg")
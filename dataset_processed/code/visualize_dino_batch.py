@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Batch DINO-seed visualization: stream a JSONL of
+    {"image": "<path>", "seeds": [{"xy": [x, y], "score": s}, ...], "src_wh": [w, h], "id": optional}
+and render, per record, the soft-overlay view and the points-only view (visualize_new.render_dino_views)
+across a process pool.
+
+- 每张原图只解码一次，两种输出共用同一张缩放图
+- 输出名 {id 或 行号}_{原图名}_overlay / _points，互不覆盖（id 中的路径分隔符等非法字符替换为 _）
+- 输出格式可配（PNG 压缩级别 / JPEG、WebP 质量）
+"""
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from batch_runner import Progress, iter_chunks, run_chunks, safe_filename
+from image_loader import load_rgb
+from visualize_new import IMAGE_FORMAT_EXT, render_dino_views, save_image
+
+# -------------------- Hard-coded paths --------------------
+SEEDS_JSONL = "/root/openset/dataset_processed/dino_seeds/seeds.jsonl"
+IMAGE_ROOT = None         # 相对路径的 image 以此为根；None -> 相对 SEEDS_JSONL 所在目录
+OUTPUT_DIR = "/root/openset/dataset_processed/dino_seed_vis"
+SUMMARY_JSON = os.path.join(OUTPUT_DIR, "dino_vis_summary.json")
+
+DEFAULT_SRC_WH = (256, 256)   # 记录缺少 src_wh 时使用
+DISPLAY_LIMIT = 512
+
+OUTPUT_FORMAT = "png"         # "png" | "jpeg" | "webp"
+PNG_COMPRESS_LEVEL = 1        # 0-9；1 编码很快，文件略大
+QUALITY = 90                  # JPEG / WebP 质量
+WEBP_METHOD = 2               # 0(快)-6(慢，更小)
+
+WORKERS = None           # 进程数；None -> os.cpu_count()，1 -> 串行
+CHUNK_SIZE = 16          # 每个任务包含的 JSONL 行数
+PROGRESS_EVERY_S = 5.0   # 进度/ETA 打印间隔（秒）
+
+
+def resolve_image(image: str, base_dir: str) -> str:
+    if os.path.isabs(image):
+        return image
+    return os.path.join(IMAGE_ROOT or base_dir, image)
+
+
+def process_record(line_no: int, raw_line: str, base_dir: str) -> Dict[str, Any]:
+    res: Dict[str, Any] = {"line": line_no}
+    try:
+        rec = json.loads(raw_line)
+        image = resolve_image(rec["image"], base_dir)
+        seeds = rec.get("seeds") or []
+        src_wh = tuple(rec.get("src_wh") or DEFAULT_SRC_WH)
+    except Exception as e:
+        res.update(status="parse_error", error=str(e))
+        return res
+
+    res["image"] = image
+    if not os.path.exists(image):
+        res["status"] = "missing_image"
+        return res
+
+    ext = IMAGE_FORMAT_EXT[OUTPUT_FORMAT]
+    stem = safe_filename(f"{rec.get('id', f'{line_no:07d}')}_{Path(image).stem}")
+    outs = [os.path.join(OUTPUT_DIR, f"{stem}_overlay{ext}"), os.path.join(OUTPUT_DIR, f"{stem}_points{ext}")]
+    try:
+        img, orig_size = load_rgb(image, max_side=DISPLAY_LIMIT, cache=False)
+        views = render_dino_views(img, seeds, src_wh, DISPLAY_LIMIT, orig_size)
+        for view, out in zip(views, outs):
+            tmp = out + ".part"
+            save_image(view, tmp, OUTPUT_FORMAT, PNG_COMPRESS_LEVEL, QUALITY, WEBP_METHOD)
+            os.replace(tmp, out)
+    except Exception as e:
+        res.update(status="render_error", error=str(e))
+        return res
+
+    res.update(status="saved", outputs=outs, seeds=len(seeds))
+    return res
+
+
+def process_chunk(chunk: List[Tuple[int, str]], base_dir: str) -> List[Dict[str, Any]]:
+    return [process_record(line_no, raw, base_dir) for line_no, raw in chunk]
+
+
+def main():
+    if OUTPUT_FORMAT not in IMAGE_FORMAT_EXT:
+        raise ValueError(f"OUTPUT_FORMAT must be one of {sorted(IMAGE_FORMAT_EXT)}")
+    if not os.path.exists(SEEDS_JSONL):
+        raise FileNotFoundError(f"Seeds JSONL not found: {SEEDS_JSONL}")
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+    base_dir = os.path.dirname(os.path.abspath(SEEDS_JSONL))
+    workers = WORKERS or os.cpu_count() or 1
+    summary: Dict[str, Any] = {
+        "jsonl": SEEDS_JSONL, "output_dir": OUTPUT_DIR, "workers": workers, "format": OUTPUT_FORMAT,
+        "records": 0, "saved": 0, "parse_errors": [], "missing_images": [], "render_errors": [],
+    }
+    progress = Progress(os.path.getsize(SEEDS_JSONL), PROGRESS_EVERY_S)
+
+    for results, offset in run_chunks(process_chunk, iter_chunks(SEEDS_JSONL, CHUNK_SIZE), workers, base_dir):
+        for res in results:
+            summary["records"] += 1
+            status = res["status"]
+            if status == "saved":
+                summary["saved"] += 1
+            elif status == "parse_error":
+                summary["parse_errors"].append({"line": res["line"], "error": res["error"]})
+            elif status == "missing_image":
+                summary["missing_images"].append({"line": res["line"], "image": res["image"]})
+            else:
+                summary["render_errors"].append({"line": res["line"], "image": res["image"], "error": res["error"]})
+        progress.update(summary["records"], offset)
+
+    summary["seconds"] = round(progress.elapsed(), 3)
+    with open(SUMMARY_JSON, "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+
+    print(f"Done. Rendered {summary['saved']} / {summary['records']} records to {OUTPUT_DIR}", flush=True)
+    print(f"  parse errors: {len(summary['parse_errors'])}, missing images: {len(summary['missing_images'])}, "
+          f"render errors: {len(summary['render_errors'])} -> {SUMMARY_JSON}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
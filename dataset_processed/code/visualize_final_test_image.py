@@ -4,132 +4,70 @@
 import os
 import json
 import re
-from typing import Optional, Tuple, List
+from typing import Any, Dict, Iterator, Optional, Tuple, List
 
 from PIL import Image, ImageDraw, ImageFont
 
+from batch_runner import Progress, iter_chunks, run_chunks
+from font_cache import get_font, text_width
+from image_loader import load_rgb
+from jsonl_index import JsonlIndex
+from prediction_cache import PredictionCache, prompt_hash
+from prediction_parser import parse_raw_prediction
+from taxonomy_index import get_taxonomy_index
+
 # -------------------- Hard-coded paths --------------------
 DATASET_DIR = "/root/openset/dataset_eval/Test_processed"
 JSONL_PATH  = "/root/openset/llama_factory/LLaMA-Factory/outputs/no-finetune-pixtral_test_2025-09-14/generated_predictions.jsonl"
 OUTPUT_DIR  = "/root/openset/dataset_eval/no-finetune-pixtral-result"
+SUMMARY_JSON = os.path.join(OUTPUT_DIR, "render_summary.json")
+LABELS_JSONL = os.path.join(OUTPUT_DIR, "normalized_labels.jsonl")   # 每条已解析预测的规范化 taxonomy 代码
 
-# -------------------- Regex helpers (robust to commas, etc.) --------------------
-IMG_PATH_REGEXES = [
-    re.compile(r"\((/[^)]+\.(?:png|jpg|jpeg|bmp|gif|tif|tiff))\)", re.IGNORECASE),
-    re.compile(r"image\s*[:=]\s*(/[^,\s]+\.(?:png|jpg|jpeg|bmp|gif|tif|tiff))", re.IGNORECASE),
-]
-
-LEVEL1_REGEXES = [
-    re.compile(r"Level-1\s*category\s*[: ]\s*(.+?)(?=\.|\n|$)", re.IGNORECASE),
-    re.compile(r"belongs to\s+Level-1\s*category\s+(.+?)(?=\.|,|\n|$)", re.IGNORECASE),
-]
-
-LEVEL2_REGEXES = [
-    re.compile(r"Level-2\s*subclass\s*[: ]\s*(.+?)(?=\.|\n|$)", re.IGNORECASE),
-    re.compile(r"falls under\s+Level-2\s*subclass\s+(.+?)(?=\.|,|\n|$)", re.IGNORECASE),
-]
-
-DESC_REGEXES = [
-    re.compile(r"(?:The\s+reason\s+for\s+this\s+classification\s+is\s+as\s+follows:)\s*(.*)$",
-               re.IGNORECASE | re.DOTALL),
-    re.compile(r"(?:Reason\s*:)\s*(.*)$", re.IGNORECASE | re.DOTALL),
-    re.compile(r"(?:because\s*:?)\s*(.*)$", re.IGNORECASE | re.DOTALL),
-]
-
-def extract_first(patterns: List[re.Pattern], text: str) -> Optional[str]:
-    for pat in patterns:
-        m = pat.search(text)
-        if m:
-            return m.group(1).strip()
-    return None
+WRAP_EXACT_SLACK = 2.0   # 估算宽度与 max_width 相差不足该像素数时，用 textlength 精确判断（字距调整）
 
-def clean_markdown_spans(s: str) -> str:
-    if not s:
-        return s
-    # 去掉代码块围栏
-    s = re.sub(r"^```[\s\S]*?\n", "", s.strip())
-    s = re.sub(r"```$", "", s.strip())
-    # 去掉外层引号
-    if len(s) >= 2 and ((s[0] == '"' and s[-1] == '"') or (s[0] == "'" and s[-1] == "'")):
-        s = s[1:-1].strip()
-    # 去掉加粗/反引号/方括号包裹
-    s = s.replace("**", "").replace("`", "").strip()
-    s = re.sub(r"^\[(.+)\]$", r"\1", s)
-    return s
-
-def parse_description(raw: str) -> str:
-    # 1) 常见格式：Reason...: <desc>
-    for pat in DESC_REGEXES:
-        m = pat.search(raw)
-        if m:
-            desc = m.group(1).strip()
-            break
-    else:
-        # 2) 退路：截取二级类别句子后的剩余文本
-        m = re.search(
-            r"Specifically,\s*it\s+falls\s+under\s+Level-2\s*subclass\s+.+?\.?\s*(.*)$",
-            raw,
-            re.IGNORECASE | re.DOTALL,
-        )
-        if m:
-            desc = m.group(1).strip()
-        else:
-            # 3) 再退路：从 “The image shows ...” 开始
-            m = re.search(
-                r"(The\s+image\s+shows\b.*)$",
-                raw,
-                re.IGNORECASE | re.DOTALL,
-            )
-            desc = m.group(1).strip() if m else ""
-
-    desc = re.sub(r"\s+", " ", desc).strip()
-    desc = clean_markdown_spans(desc)
-    return desc
-
-def parse_raw_prediction(raw: str) -> Tuple[Optional[str], Optional[str], Optional[str], str]:
-    """
-    Returns (img_path, level1, level2, description)
-    """
-    raw = clean_markdown_spans(raw)
+# -------------------- Batch rendering --------------------
+WORKERS = None           # 进程数；None -> os.cpu_count()，1 -> 串行
+CHUNK_SIZE = 64          # 每个任务包含的 JSONL 行数
+PROGRESS_EVERY_S = 5.0   # 进度/ETA 打印间隔（秒）
+
+# -------------------- Render cache (prediction_cache, keyed by source image hash + parsed prediction) --------------------
+USE_RENDER_CACHE = True
+RENDER_CACHE_PATH = "/root/openset/cache/render_cache.sqlite"
+RENDER_CACHE_MAX_BYTES = 8 << 30
+RENDER_CACHE_ID = "annotate_image:v1"   # 修改 annotate_image 的布局 / 字体 / JPEG 质量时递增，使旧渲染失效
 
-    img_path = extract_first(IMG_PATH_REGEXES, raw)
-    level1   = clean_markdown_spans(extract_first(LEVEL1_REGEXES, raw) or "")
-    level2   = clean_markdown_spans(extract_first(LEVEL2_REGEXES, raw) or "")
-    desc     = parse_description(raw)
+# -------------------- Subset rendering (uses the jsonl_index sidecar, no full scan) --------------------
+SELECT_IMAGES: Optional[List[str]] = None   # 只渲染这些图像（完整路径或 basename）的预测
+SAMPLE_SIZE: Optional[int] = None            # 随机抽取 N 条预测渲染
+SAMPLE_SEED = 0
 
-    level1 = level1 or None
-    level2 = level2 or None
-    return img_path, level1, level2, desc
+# Image-name fallback when the prediction has no absolute path
+IMG_NAME_REGEX = re.compile(r"(\d+\.(?:png|jpg|jpeg|bmp|gif|tif|tiff))", re.IGNORECASE)
 
 # -------------------- Imaging helpers --------------------
 def try_load_font(font_size: int) -> ImageFont.FreeTypeFont:
-    candidates = [
-        "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
-        "/usr/share/fonts/dejavu/DejaVuSans.ttf",
-        "/usr/share/fonts/truetype/freefont/FreeSans.ttf",
-        "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
-    ]
-    for path in candidates:
-        if os.path.exists(path):
-            try:
-                return ImageFont.truetype(path, font_size)
-            except Exception:
-                pass
-    return ImageFont.load_default()
+    return get_font(font_size)  # font_cache.DEFAULT_FONT_CANDIDATES
 
 def wrap_text(draw: ImageDraw.ImageDraw, text: str, font: ImageFont.ImageFont, max_width: int) -> List[str]:
     words = text.split()
     if not words:
         return [""]
+    # 行宽按单词宽度累加估算（单词宽度有缓存），只在临界处精确测量
+    space_w = text_width(font, " ")
     lines = []
     cur = words[0]
+    cur_w = text_width(font, cur)
     for w in words[1:]:
-        trial = cur + " " + w
-        if draw.textlength(trial, font=font) <= max_width:
-            cur = trial
+        trial_w = cur_w + space_w + text_width(font, w)
+        if abs(trial_w - max_width) <= WRAP_EXACT_SLACK:
+            trial_w = draw.textlength(cur + " " + w, font=font)
+        if trial_w <= max_width:
+            cur = cur + " " + w
+            cur_w = trial_w
         else:
             lines.append(cur)
             cur = w
+            cur_w = text_width(font, w)
     lines.append(cur)
     return lines
 
@@ -143,138 +81,282 @@ def lines_height(draw: ImageDraw.ImageDraw, lines: List[str], font, line_spacing
     return h_sum - line_spacing
 
 def annotate_image(img_path: str, level1: str, level2: str, desc: str, out_path: str) -> None:
-    with Image.open(img_path) as im:
-        im = im.convert("RGB")
-        W, H = im.size
-
-        scale_factor = 0.9
-        new_W, new_H = int(W * scale_factor), int(H * scale_factor)
-        im_resized = im.resize((new_W, new_H), Image.LANCZOS)
-
-        base_size = max(14, min(40, int(W * 0.025)))
-        font_h = try_load_font(base_size)
-
-        desc_size = max(10, int(base_size * 0.75))
-        font_d = try_load_font(desc_size)
-
-        left = max(20, int(W * 0.05))
-        right = left
-        top_pad = max(10, int(base_size * 0.3))
-        mid_pad = max(6, int(base_size * 0.3))
-        bottom_pad = max(12, int(base_size * 0.4))
-        line_space_h = max(4, int(base_size * 0.15))
-        def line_space_d(sz): return max(3, int(sz * 0.15))
-        max_text_w = W - left - right
-
-        tmp = ImageDraw.Draw(im_resized)
-
-        l12_text = f"Level-1: {level1}, Level-2: {level2}"
-        l12 = wrap_text(tmp, l12_text, font_h, max_text_w)
-        h12 = lines_height(tmp, l12, font_h, line_space_h)
-
-        max_footer_h = H - new_H + int(H * 0.25)
-        while True:
-            font_d = try_load_font(desc_size)
-            l3 = wrap_text(tmp, f"Description: {desc}", font_d, max_text_w)
-            h3 = lines_height(tmp, l3, font_d, line_space_d(desc_size))
-            footer_h = top_pad + h12 + mid_pad + h3 + bottom_pad
-            if footer_h <= max_footer_h or desc_size <= 8:
-                break
-            desc_size -= 1
-
-        total_H = new_H + footer_h
-        out = Image.new("RGB", (W, total_H), "white")
-
-        img_x = (W - new_W) // 2
-        out.paste(im_resized, (img_x, 0))
-        draw = ImageDraw.Draw(out)
-        sep_th = max(1, W // 800)
-        draw.line([(0, new_H), (W, new_H)], fill=(200,200,200), width=sep_th)
-
-        def draw_lines(lines, y, font, ls):
-            for t in lines:
-                draw.text((left, y), t, font=font, fill="black")
-                y = draw.textbbox((left, y), t, font=font)[3] + ls
-            return y
-
-        y0 = new_H + top_pad
-        y0 = draw_lines(l12, y0, font_h, line_space_h)
-        y0 += (mid_pad - line_space_h)
-        draw_lines(l3, y0, font_d, line_space_d(desc_size))
-
-        os.makedirs(os.path.dirname(out_path), exist_ok=True)
-        out_path = os.path.splitext(out_path)[0] + ".jpg"
-        out.save(out_path, format="JPEG", quality=95)
+    scale_factor = 0.9
+    # 只需 0.9 倍的图：JPEG 可降分辨率解码（draft），布局仍按原始尺寸
+    im, (W, H) = load_rgb(img_path, scale=scale_factor, cache=False)
+    new_W, new_H = int(W * scale_factor), int(H * scale_factor)
+    im_resized = im.resize((new_W, new_H), Image.LANCZOS)
+
+    base_size = max(14, min(40, int(W * 0.025)))
+    font_h = try_load_font(base_size)
+
+    desc_size = max(10, int(base_size * 0.75))
+
+    left = max(20, int(W * 0.05))
+    right = left
+    top_pad = max(10, int(base_size * 0.3))
+    mid_pad = max(6, int(base_size * 0.3))
+    bottom_pad = max(12, int(base_size * 0.4))
+    line_space_h = max(4, int(base_size * 0.15))
+    def line_space_d(sz): return max(3, int(sz * 0.15))
+    max_text_w = W - left - right
+
+    tmp = ImageDraw.Draw(im_resized)
+
+    l12_text = f"Level-1: {level1}, Level-2: {level2}"
+    l12 = wrap_text(tmp, l12_text, font_h, max_text_w)
+    h12 = lines_height(tmp, l12, font_h, line_space_h)
+
+    max_footer_h = H - new_H + int(H * 0.25)
+    desc_text = f"Description: {desc}"
+
+    def layout(sz):
+        f = try_load_font(sz)
+        lines = wrap_text(tmp, desc_text, f, max_text_w)
+        fh = top_pad + h12 + mid_pad + lines_height(tmp, lines, f, line_space_d(sz)) + bottom_pad
+        return f, lines, fh
+
+    # 最大的可容纳字号：先试初始字号，再在 [8, desc_size) 上二分（下限 8 与原线性递减一致）
+    font_d, l3, footer_h = layout(desc_size)
+    if footer_h > max_footer_h and desc_size > 8:
+        lo, hi = 8, desc_size - 1
+        best = None
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            cand = layout(mid)
+            if cand[2] <= max_footer_h:
+                best, desc_size, lo = cand, mid, mid + 1
+            else:
+                hi = mid - 1
+        if best is None:
+            desc_size = 8
+            best = layout(8)
+        font_d, l3, footer_h = best
+
+    total_H = new_H + footer_h
+    out = Image.new("RGB", (W, total_H), "white")
+
+    img_x = (W - new_W) // 2
+    out.paste(im_resized, (img_x, 0))
+    draw = ImageDraw.Draw(out)
+    sep_th = max(1, W // 800)
+    draw.line([(0, new_H), (W, new_H)], fill=(200,200,200), width=sep_th)
+
+    def draw_lines(lines, y, font, ls):
+        for t in lines:
+            draw.text((left, y), t, font=font, fill="black")
+            y = draw.textbbox((left, y), t, font=font)[3] + ls
+        return y
+
+    y0 = new_H + top_pad
+    y0 = draw_lines(l12, y0, font_h, line_space_h)
+    y0 += (mid_pad - line_space_h)
+    draw_lines(l3, y0, font_d, line_space_d(desc_size))
+
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    out_path = os.path.splitext(out_path)[0] + ".jpg"
+    out.save(out_path, format="JPEG", quality=95)
 
 # -------------------- Main pipeline --------------------
-def main():
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-
-    if not os.path.exists(JSONL_PATH):
-        raise FileNotFoundError(f"JSONL file not found: {JSONL_PATH}")
-
-    # Count non-empty lines for progress bar upper bound (minimal logs)
-    total_lines = 0
-    with open(JSONL_PATH, "r", encoding="utf-8") as f:
-        for line in f:
-            if line.strip():
-                total_lines += 1
+def resolve_image_path(img_path: Optional[str], raw: str) -> Optional[str]:
+    """Resolve image path（优先绝对路径，其次 DATASET_DIR/basename）"""
+    candidate_paths = []
+    if img_path and os.path.exists(img_path):
+        candidate_paths.append(img_path)
+    if img_path:
+        candidate_paths.append(os.path.join(DATASET_DIR, os.path.basename(img_path)))
+    else:
+        m = IMG_NAME_REGEX.search(raw)
+        if m:
+            candidate_paths.append(os.path.join(DATASET_DIR, m.group(1)))
 
-    processed_index = 0  # 仅用于展示“Processing i/N”
-    saved = 0
+    for p in candidate_paths:
+        if p and os.path.exists(p):
+            return p
+    return None
 
-    with open(JSONL_PATH, "r", encoding="utf-8") as f:
-        for line in f:
-            raw_line = line.strip()
+_render_cache: Optional[PredictionCache] = None
+
+def get_render_cache() -> Optional[PredictionCache]:
+    """Per-process render cache connection (opened lazily in each worker)."""
+    global _render_cache
+    if USE_RENDER_CACHE and _render_cache is None:
+        _render_cache = PredictionCache(RENDER_CACHE_PATH, max_bytes=RENDER_CACHE_MAX_BYTES)
+    return _render_cache
+
+def render_cached(img_path: str, level1: str, level2: str, desc: str, out_path: str) -> bool:
+    """annotate_image through the render cache; returns True on a cache hit."""
+    cache = get_render_cache()
+    if cache is None:
+        annotate_image(img_path, level1, level2, desc, out_path)
+        return False
+    image_hash = cache.image_hash(img_path)
+    text_hash = prompt_hash(f"{level1}\n{level2}\n{desc}")
+    data = cache.get(image_hash, text_hash, RENDER_CACHE_ID)
+    if data is not None:
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        with open(out_path, "wb") as f:
+            f.write(data)
+        return True
+    annotate_image(img_path, level1, level2, desc, out_path)
+    with open(out_path, "rb") as f:
+        cache.put(image_hash, text_hash, RENDER_CACHE_ID, f.read())
+    return False
+
+def process_record(line_no: int, raw_line: str) -> Dict[str, Any]:
+    """
+    Parse + resolve + render one JSONL line. The image is written to a per-line temp file;
+    the caller moves it into place in input order, so duplicates resolve like a serial run.
+    """
+    res: Dict[str, Any] = {"line": line_no, "status": "saved"}
+
+    # 解析 JSONL
+    try:
+        obj = json.loads(raw_line)
+    except json.JSONDecodeError as e:
+        res.update(status="parse_error", error=str(e))
+        return res
+
+    # 只要 predict，不要 prompt；同时兼容旧键名
+    raw = obj.get("predict") or obj.get("raw_prediction") or obj.get("text") or obj.get("output")
+    if not raw or not isinstance(raw, str):
+        res["status"] = "no_prediction"
+        return res
+
+    img_path, level1, level2, desc = parse_raw_prediction(raw)
+    res["labels"] = {"img_path": img_path, "level1": level1, "level2": level2,
+                     **get_taxonomy_index().normalize_prediction(level1, level2)}
+    if not (level1 and level2):
+        res.update(status="unparsed", img_path=img_path)
+        return res
+
+    resolved = resolve_image_path(img_path, raw)
+    if not resolved:
+        res.update(status="missing_image", img_path=img_path)
+        return res
+
+    res["source"] = resolved
+    base = os.path.splitext(os.path.join(OUTPUT_DIR, os.path.basename(resolved)))[0]
+    res["out"] = base + ".jpg"
+    res["tmp"] = f"{base}.part{line_no}.jpg"
+    try:
+        res["cached"] = render_cached(resolved, level1, level2, desc, res["tmp"])
+    except Exception as e:
+        res.update(status="render_error", error=f"{type(e).__name__}: {e}", image=resolved)
+    return res
+
+def process_chunk(chunk: List[Tuple[int, str]]) -> List[Dict[str, Any]]:
+    results = [process_record(line_no, raw_line) for line_no, raw_line in chunk]
+    if _render_cache is not None:
+        _render_cache.flush()   # 进程池 worker 退出时不执行清理，按块写回命中时间与统计
+    return results
+
+def select_rows(idx: JsonlIndex) -> List[int]:
+    """Row numbers (0-based) selected by SELECT_IMAGES / SAMPLE_SIZE, in file order."""
+    rows = set()
+    if SELECT_IMAGES is not None:
+        for key in SELECT_IMAGES:
+            found = idx.find(key)
+            if not found:
+                print(f"[WARN] No prediction found for image: {key}")
+            rows.update(found)
+    if SAMPLE_SIZE is not None:
+        rows.update(idx.sample(SAMPLE_SIZE, SAMPLE_SEED))
+    return sorted(rows)
+
+def iter_indexed_chunks(
+    path: str, spans: List[Tuple[int, int, int]], chunk_size: int
+) -> Iterator[Tuple[List[Tuple[int, str]], int]]:
+    """Like iter_chunks for the given (row, start, end) byte spans only; the offset is the number of selected bytes read so far."""
+    chunk: List[Tuple[int, str]] = []
+    done = 0
+    with open(path, "rb") as f:
+        for row, start, end in spans:
+            f.seek(start)
+            line = f.read(end - start)
+            done += len(line)
+            raw_line = line.decode("utf-8", errors="replace").strip()
             if not raw_line:
                 continue
+            chunk.append((row + 1, raw_line))
+            if len(chunk) >= chunk_size:
+                yield chunk, done
+                chunk = []
+    if chunk:
+        yield chunk, done
 
-            processed_index += 1
-            print(f"Processing {processed_index}/{total_lines}", flush=True)
-
-            # 解析 JSONL
-            try:
-                obj = json.loads(raw_line)
-            except json.JSONDecodeError:
-                continue
-
-            # 只要 predict，不要 prompt；同时兼容旧键名
-            raw = obj.get("predict") or obj.get("raw_prediction") or obj.get("text") or obj.get("output")
-            if not raw or not isinstance(raw, str):
-                continue
-            raw = clean_markdown_spans(raw)
-
-            img_path, level1, level2, desc = parse_raw_prediction(raw)
-            if not (level1 and level2):
-                continue
-
-            # Resolve image path（优先绝对路径，其次 DATASET_DIR/basename）
-            candidate_paths = []
-            if img_path and os.path.exists(img_path):
-                candidate_paths.append(img_path)
-            if img_path:
-                candidate_paths.append(os.path.join(DATASET_DIR, os.path.basename(img_path)))
-            else:
-                m = re.search(r"(\d+\.(?:png|jpg|jpeg|bmp|gif|tif|tiff))", raw, re.IGNORECASE)
-                if m:
-                    candidate_paths.append(os.path.join(DATASET_DIR, m.group(1)))
-
-            resolved = None
-            for p in candidate_paths:
-                if p and os.path.exists(p):
-                    resolved = p
-                    break
-            if not resolved:
-                continue
+def main():
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-            out_path = os.path.join(OUTPUT_DIR, os.path.basename(resolved))
-            try:
-                annotate_image(resolved, level1, level2, desc, out_path)
-                saved += 1
-            except Exception:
-                continue
+    if not os.path.exists(JSONL_PATH):
+        raise FileNotFoundError(f"JSONL file not found: {JSONL_PATH}")
 
-    print(f"Done. Saved {saved} images to {OUTPUT_DIR}", flush=True)
+    if SELECT_IMAGES is None and SAMPLE_SIZE is None:
+        total_bytes = os.path.getsize(JSONL_PATH)
+        chunks = iter_chunks(JSONL_PATH, CHUNK_SIZE)
+    else:
+        # 索引只用于选行与取字节范围，之后即关闭（释放 mmap）；渲染阶段按字节范围直接读源文件
+        with JsonlIndex.open(JSONL_PATH) as idx:
+            rows = select_rows(idx)
+            spans = [(r, int(idx.offsets[r]), int(idx.offsets[r + 1])) for r in rows]
+        total_bytes = sum(end - start for _, start, end in spans)
+        chunks = iter_indexed_chunks(JSONL_PATH, spans, CHUNK_SIZE)
+        print(f"[INDEX] Rendering {len(rows)} selected records", flush=True)
+    workers = WORKERS or os.cpu_count() or 1
+    summary: Dict[str, Any] = {
+        "jsonl": JSONL_PATH, "output_dir": OUTPUT_DIR, "workers": workers,
+        "records": 0, "saved": 0, "overwritten": 0, "render_cache_hits": 0,
+        "parse_errors": [], "no_prediction": [], "unparsed": [], "missing_images": [], "render_errors": [],
+        "labels": {"level1_unmapped": 0, "level2_unmapped": 0, "inconsistent": 0},
+    }
+    written = set()
+    progress = Progress(total_bytes, PROGRESS_EVERY_S)
+    with open(LABELS_JSONL, "w", encoding="utf-8") as labels_f:
+        for results, offset in run_chunks(process_chunk, chunks, workers):
+            for res in results:
+                summary["records"] += 1
+                status = res["status"]
+                labels = res.get("labels")
+                if labels is not None:
+                    row = {"line": res["line"], "status": status, "source": res.get("source"),
+                           "image": res.get("out") if status == "saved" else None, **labels}
+                    labels_f.write(json.dumps(row, ensure_ascii=False) + "\n")
+                    summary["labels"]["level1_unmapped"] += labels["level1_code"] is None
+                    summary["labels"]["level2_unmapped"] += labels["level2_code"] is None
+                    summary["labels"]["inconsistent"] += labels["consistent"] is False
+                if status == "saved":
+                    # 按输入顺序落盘：同名输出以后出现的记录为准（与串行一致）
+                    os.replace(res["tmp"], res["out"])
+                    if res["out"] in written:
+                        summary["overwritten"] += 1
+                    written.add(res["out"])
+                    summary["saved"] += 1
+                    summary["render_cache_hits"] += bool(res.get("cached"))
+                elif status == "parse_error":
+                    summary["parse_errors"].append({"line": res["line"], "error": res["error"]})
+                elif status == "no_prediction":
+                    summary["no_prediction"].append(res["line"])
+                elif status == "unparsed":
+                    summary["unparsed"].append({"line": res["line"], "img_path": res.get("img_path")})
+                elif status == "missing_image":
+                    summary["missing_images"].append({"line": res["line"], "img_path": res.get("img_path")})
+                else:
+                    if os.path.exists(res.get("tmp", "")):
+                        os.remove(res["tmp"])
+                    summary["render_errors"].append({"line": res["line"], "image": res["image"], "error": res["error"]})
+            progress.update(summary["records"], offset)
+
+    summary["seconds"] = round(progress.elapsed(), 3)
+    with open(SUMMARY_JSON, "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+
+    print(f"Done. Saved {summary['saved']} images to {OUTPUT_DIR} "
+          f"({summary['render_cache_hits']} from the render cache)", flush=True)
+    print(f"  parse errors: {len(summary['parse_errors'])}, no prediction: {len(summary['no_prediction'])}, "
+          f"unparsed: {len(summary['unparsed'])}, missing images: {len(summary['missing_images'])}, "
+          f"render errors: {len(summary['render_errors'])} -> {SUMMARY_JSON}", flush=True)
+    print(f"  taxonomy: {summary['labels']['level1_unmapped']} Level-1 / {summary['labels']['level2_unmapped']} Level-2 "
+          f"unmapped, {summary['labels']['inconsistent']} inconsistent -> {LABELS_JSONL}", flush=True)
 
 if __name__ == "__main__":
     main()
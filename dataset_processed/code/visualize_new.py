@@ -5,12 +5,20 @@
 # IMG_PATH = "/mnt/data/airfield__airplane_001.jpg"
 IMG_PATH = "/root/openset/dataset/flat_out/airfield__airplane_001.jpg"   # 默认放在脚本同目录
 
-import os
 from pathlib import Path
 from typing import List, Tuple, Dict, Optional
 
 import numpy as np
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
+
+from font_cache import find_font_path, load_font
+from image_loader import load_rgb
+
+LABEL_FONT_CANDIDATES = (
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
+)
+HEAT_TRUNCATE_SIGMA = 3.0   # 热力图高斯在 ±3σ 外截断（尾部 ≤ exp(-4.5) ≈ 1.1%）
 
 
 # =========================
@@ -46,10 +54,8 @@ def map_points_to_image(
     return mapped_scaled, new_size, scale
 
 
-def _light_colormap(v: np.ndarray) -> np.ndarray:
-    c1 = np.array([180, 210, 255], dtype=np.float32) / 255.0
-    c2 = np.array([255, 200, 220], dtype=np.float32) / 255.0
-    return c1 * (1.0 - v[..., None]) + c2 * v[..., None]
+_LIGHT_C1 = np.array([180, 210, 255], dtype=np.float32) / 255.0
+_LIGHT_C2 = np.array([255, 200, 220], dtype=np.float32) / 255.0
 
 
 def make_soft_overlay(
@@ -57,30 +63,45 @@ def make_soft_overlay(
     disp_H: int,
     points: List[Dict],
     max_alpha: float = 0.45,
+    truncate: float = HEAT_TRUNCATE_SIGMA,
 ) -> np.ndarray:
-    yy, xx = np.mgrid[0:disp_H, 0:disp_W]
+    """
+    每个点的高斯只在 ±truncate·σ 的窗口内计算：可分离为 gy ⊗ gx 两个一维核，
+    外积写入复用的 float32 缓冲后原地取 max；颜色映射整幅广播，无逐行循环。
+    与整幅逐点计算的差异只来自窗口外被截断的尾部（≤ exp(-truncate²/2)），见 bench_soft_overlay.py。
+    """
     heat = np.zeros((disp_H, disp_W), dtype=np.float32)
 
     sigma = max(disp_W, disp_H) / 18.0
-    two_sigma2 = 2.0 * (sigma ** 2)
+    inv_two_sigma2 = np.float32(1.0 / (2.0 * (sigma ** 2)))
+    radius = int(np.ceil(truncate * sigma))
+    win = np.empty((min(disp_H, 2 * radius + 1), min(disp_W, 2 * radius + 1)), dtype=np.float32)
+    xs = np.arange(disp_W, dtype=np.float32)
+    ys = np.arange(disp_H, dtype=np.float32)
 
     for m in points:
         (cx, cy) = m["xy"]
         score = float(m.get("score", 1.0))
         amp = max(0.25, min(1.0, score))
-        g = np.exp(-((xx - cx) ** 2 + (yy - cy) ** 2) / two_sigma2) * amp
-        heat = np.maximum(heat, g)
-
-    if heat.max() > 0:
-        heat_norm = heat / heat.max()
-    else:
-        heat_norm = heat
-
-    rgba = np.zeros((disp_H, disp_W, 4), dtype=np.float32)
-    for y in range(disp_H):
-        rgb_row = _light_colormap(heat_norm[y, :])
-        rgba[y, :, :3] = rgb_row
-    rgba[:, :, 3] = heat_norm * max_alpha
+        x0, x1 = max(0, int(np.floor(cx)) - radius), min(disp_W, int(np.floor(cx)) + radius + 1)
+        y0, y1 = max(0, int(np.floor(cy)) - radius), min(disp_H, int(np.floor(cy)) + radius + 1)
+        if x0 >= x1 or y0 >= y1:
+            continue
+        gx = np.exp(-np.square(xs[x0:x1] - np.float32(cx)) * inv_two_sigma2) * np.float32(amp)
+        gy = np.exp(-np.square(ys[y0:y1] - np.float32(cy)) * inv_two_sigma2)
+        g = win[:y1 - y0, :x1 - x0]
+        np.multiply.outer(gy, gx, out=g)
+        region = heat[y0:y1, x0:x1]
+        np.maximum(region, g, out=region)
+
+    peak = heat.max() if heat.size else 0.0
+    if peak > 0:
+        heat *= np.float32(1.0 / peak)
+
+    rgba = np.empty((disp_H, disp_W, 4), dtype=np.float32)
+    rgba[:, :, :3] = _LIGHT_C1
+    rgba[:, :, :3] += heat[:, :, None] * (_LIGHT_C2 - _LIGHT_C1)
+    np.multiply(heat, np.float32(max_alpha), out=rgba[:, :, 3])
     return rgba
 
 
@@ -108,18 +129,9 @@ def draw_points_with_labels(
     img = pil_img.copy()
     draw = ImageDraw.Draw(img)
 
-    # 尝试加载小号字体
-    font = None
-    for fp in [
-        "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
-        "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
-    ]:
-        if os.path.exists(fp):
-            try:
-                font = ImageFont.truetype(fp, size=7)  # 字体更小
-                break
-            except Exception:
-                font = None
+    # 尝试加载小号字体（缓存；找不到时用 Pillow 默认字体）
+    font_path = find_font_path(LABEL_FONT_CANDIDATES)
+    font = load_font(font_path, 7) if font_path else None  # 字体更小
 
     for i, m in enumerate(points, 1):
         x, y = m["xy"]
@@ -132,18 +144,18 @@ def draw_points_with_labels(
     return img
 
 
-def visualize_dino_points_on_image(
-    img_path: Path,
+def render_dino_views(
+    img: Image.Image,
     seeds: List[Dict],
     src_wh: Tuple[int, int] = (256, 256),
     display_limit: int = 512,
-    out_dir: Optional[Path] = None,
-) -> Tuple[Path, Path]:
-    if out_dir is None:
-        out_dir = Path(".")
-
-    img = Image.open(img_path).convert("RGB")
-    W, H = img.size
+    orig_size: Optional[Tuple[int, int]] = None,
+) -> Tuple[Image.Image, Image.Image]:
+    """
+    已解码的 RGB 原图 -> (带热力叠加的可视化, 仅点与标签)；两者共用同一张缩放后的图。
+    img 可以是降分辨率解码的结果，此时 orig_size 给出原始尺寸（坐标映射与显示尺寸都按原始尺寸计算）。
+    """
+    W, H = orig_size or img.size
 
     mapped_scaled, new_size, scale = map_points_to_image(
         points_src=seeds,
@@ -152,7 +164,7 @@ def visualize_dino_points_on_image(
         scale_limit=display_limit,
     )
 
-    if new_size != (W, H):
+    if new_size != img.size:
         img_disp = img.resize(new_size, Image.LANCZOS)
     else:
         img_disp = img.copy()
@@ -162,10 +174,48 @@ def visualize_dino_points_on_image(
     comp_img = overlay_rgba_on_image(img_disp, overlay_rgba)
     vis_with_overlay = draw_points_with_labels(comp_img, mapped_scaled, radius=6)
     vis_points_only = draw_points_with_labels(img_disp, mapped_scaled, radius=6)
+    return vis_with_overlay, vis_points_only
+
+
+IMAGE_FORMAT_EXT = {"png": ".png", "jpeg": ".jpg", "webp": ".webp"}
+
+
+def save_image(
+    img: Image.Image,
+    path: Path,
+    fmt: str = "png",
+    png_compress_level: int = 6,
+    quality: int = 90,
+    webp_method: int = 4,
+) -> None:
+    """fmt: "png"（compress_level 0-9，越小越快）| "jpeg" | "webp"（quality 0-100）。"""
+    if fmt == "png":
+        img.save(path, format="PNG", compress_level=png_compress_level)
+    elif fmt == "jpeg":
+        img.save(path, format="JPEG", quality=quality)
+    elif fmt == "webp":
+        img.save(path, format="WEBP", quality=quality, method=webp_method)
+    else:
+        raise ValueError(f"Unsupported output format: {fmt}")
+
+
+def visualize_dino_points_on_image(
+    img_path: Path,
+    seeds: List[Dict],
+    src_wh: Tuple[int, int] = (256, 256),
+    display_limit: int = 512,
+    out_dir: Optional[Path] = None,
+    out_stem: str = "overlay",
+) -> Tuple[Path, Path]:
+    if out_dir is None:
+        out_dir = Path(".")
+
+    img, orig_size = load_rgb(str(img_path), max_side=display_limit)
+    vis_with_overlay, vis_points_only = render_dino_views(img, seeds, src_wh, display_limit, orig_size)
 
     out_dir.mkdir(parents=True, exist_ok=True)
-    out_overlay = out_dir / "overlay.png"
-    out_points = out_dir / "overlay_points_only.png"
+    out_overlay = out_dir / f"{out_stem}.png"
+    out_points = out_dir / f"{out_stem}_points_only.png"
     vis_with_overlay.save(out_overlay)
     vis_points_only.save(out_points)
 